@@ -0,0 +1,81 @@
+"""Memory vs speed of the precomputed ALBERT embedding tables for 21k and 30k vocabularies.
+
+For every vocabulary size an ``AlbertModel`` (or the bright variant with ``--bright``) is built from the
+config with that ``vocab_size`` and random weights. The embedding stage and the full forward are timed
+with and without ``precompute_embeddings``, the extra table memory and the maximum output difference
+are reported.
+
+    python benchmarks/albert_embeddings.py --config model/albert_pytorch/prev_trained_model/albert_base_v2/config.json
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model.albert_pytorch.configuration_albert import AlbertConfig
+from model.albert_pytorch import modeling_albert, modeling_albert_bright
+
+
+def timed(function, repeats, warmup=3):
+    with torch.no_grad():
+        for _ in range(warmup):
+            output = function()
+        start = time.time()
+        for _ in range(repeats):
+            output = function()
+    return output, 1000.0 * (time.time() - start) / repeats
+
+
+def table_bytes(embeddings):
+    names = ('word_table', 'position_table', 'token_type_table', 'table_bias')
+    tables = [getattr(embeddings, name, None) for name in names]
+    return sum(table.numel() * table.element_size() for table in tables if table is not None)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", default="model/albert_pytorch/prev_trained_model/albert_base_v2/config.json")
+    parser.add_argument("--vocab_sizes", default=[21128, 30000], type=int, nargs="+")
+    parser.add_argument("--bright", action="store_true", help="Benchmark modeling_albert_bright.AlbertModel.")
+    parser.add_argument("--half_tables", action="store_true", help="Store the tables in float16.")
+    parser.add_argument("--batch_size", default=8, type=int)
+    parser.add_argument("--seq_length", default=202, type=int)
+    parser.add_argument("--repeats", default=20, type=int)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    module = modeling_albert_bright if args.bright else modeling_albert
+    dtype = torch.float16 if args.half_tables else None
+
+    print("vocab\ttable_mb\tembed_ms\tembed_ms_table\tforward_ms\tforward_ms_table\tmax_abs_diff")
+    for vocab_size in args.vocab_sizes:
+        config = AlbertConfig.from_pretrained(args.config, vocab_size=vocab_size)
+        model = module.AlbertModel(config, add_pooling_layer=False)
+        model.eval()
+        input_ids = torch.randint(1, vocab_size, (args.batch_size, args.seq_length))
+
+        if args.bright:
+            embed = lambda: model.embeddings(input_ids)
+        else:
+            embed = lambda: model._embed(input_ids)
+        forward = lambda: model(input_ids)[0]
+
+        _, embed_ms = timed(embed, args.repeats)
+        reference, forward_ms = timed(forward, args.repeats)
+        model.precompute_embeddings(dtype=dtype)
+        _, embed_table_ms = timed(embed, args.repeats)
+        output, forward_table_ms = timed(forward, args.repeats)
+
+        print("%d\t%.1f\t%.2f\t%.2f\t%.1f\t%.1f\t%.2e" % (
+            vocab_size, table_bytes(model.embeddings) / 2 ** 20, embed_ms, embed_table_ms,
+            forward_ms, forward_table_ms, (output - reference).abs().max().item()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Peak memory of an ALBERT step against the previous AlbertGroup and with every intermediate output.
+
+Runs ``AlbertModel`` built from a config file on random ids and reports the peak allocation of the step
+for three variants: ``baseline``, the AlbertGroup before it kept only the running hidden state (every
+inner layer's hidden state and self-attention output tuple collected on every call, see
+``BaselineAlbertGroup``), ``lean``, the current AlbertGroup, and ``retain all outputs``, with
+``output_hidden_states`` / ``output_attentions`` set. By default the step is forward + backward; in
+training autograd keeps the hidden states and attention contexts alive for the backward pass anyway,
+so baseline and lean should be close there and ``--no_grad`` (forward only) is where the tuples the
+baseline built cost memory. On CUDA the peak comes from ``torch.cuda.max_memory_allocated``, on CPU it
+is replayed from the autograd profiler memory statistics (an approximation).
+
+    python benchmarks/albert_memory.py --config model/albert_pytorch/prev_trained_model/albert_base_v2/config.json
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import os
+import sys
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model.albert_pytorch.configuration_albert import AlbertConfig
+from model.albert_pytorch.modeling_albert import AlbertGroup, AlbertModel
+
+
+class BaselineAlbertGroup(AlbertGroup):
+    """ AlbertGroup.forward as it was before it kept only the running hidden state (git show b3531c1^). The
+        previous AlbertAttention (attention output plus the whole self-attention output tuple) is inlined; the
+        last hidden state is returned the way AlbertTransformer reads it now. """
+    def forward(self, hidden_states, attention_mask, head_mask):
+        layer_attentions = ()
+        layer_hidden_states = ()
+        for inner_group_idx in range(self.inner_group_num):
+            layer_module = self.inner_group[inner_group_idx]
+            self_outputs = layer_module.attention.self(hidden_states, attention_mask, head_mask)
+            attention_output = layer_module.attention.output(self_outputs[0], hidden_states)
+            attention_output = layer_module.LayerNorm(attention_output + hidden_states)
+            ffn_output = layer_module.ffn(attention_output)
+            hidden_states = layer_module.LayerNorm_1(ffn_output + attention_output)
+            layer_attentions = layer_attentions + (self_outputs,)
+            layer_hidden_states = layer_hidden_states + (hidden_states,)
+        return (layer_hidden_states[-1], layer_hidden_states, layer_attentions)
+
+
+def peak_memory(config, input_ids, device, baseline=False, no_grad=False):
+    model = AlbertModel(config).to(device)
+    model.train()
+    if baseline:
+        for group in model.encoder.transformer.group:
+            group.__class__ = BaselineAlbertGroup
+
+    def step():
+        if no_grad:
+            with torch.no_grad():
+                model(input_ids)
+            return
+        outputs = model(input_ids)
+        loss = sum(output.float().sum() for output in outputs if isinstance(output, torch.Tensor))
+        loss.backward()
+
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        base = torch.cuda.memory_allocated()
+        step()
+        torch.cuda.synchronize()
+        return torch.cuda.max_memory_allocated() - base
+
+    with torch.autograd.profiler.profile(profile_memory=True) as prof:
+        step()
+    # replay the allocations / frees of every op in order to find the high-water mark of the step
+    current, peak = 0, 0
+    for event in sorted(prof.function_events, key=lambda e: e.cpu_interval.start):
+        current += event.self_cpu_memory_usage
+        peak = max(peak, current)
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", default="model/albert_pytorch/prev_trained_model/albert_base_v2/config.json")
+    parser.add_argument("--batch_size", default=8, type=int)
+    parser.add_argument("--seq_length", default=202, type=int)
+    parser.add_argument("--no_grad", action="store_true", help="measure a forward pass without autograd")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    torch.manual_seed(0)
+
+    results = []
+    for name, baseline, retain in (("baseline", True, False), ("lean", False, False),
+                                   ("retain all outputs", False, True)):
+        config = AlbertConfig.from_pretrained(args.config, output_hidden_states=retain, output_attentions=retain)
+        input_ids = torch.randint(1, config.vocab_size, (args.batch_size, args.seq_length), device=device)
+        results.append((name, peak_memory(config, input_ids, device, baseline=baseline, no_grad=args.no_grad)))
+
+    for name, peak in results:
+        print("%-20s peak %.1f MB" % (name, peak / 2 ** 20))
+    print("reduction against baseline %.1f%%" % (100.0 * (1 - results[1][1] / float(results[0][1]))))
+    print("reduction against retain all outputs %.1f%%" % (100.0 * (1 - results[1][1] / float(results[2][1]))))
+
+
+if __name__ == "__main__":
+    main()
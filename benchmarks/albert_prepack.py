@@ -0,0 +1,65 @@
+"""CPU inference latency of AlbertModel before and after oneDNN weight prepacking.
+
+Builds ``AlbertModel`` from a config file (random weights, the layout not the values matters), times
+the forward on random ids, prepacks the shared layer with ``prepare_for_inference`` and times it again.
+The maximum absolute difference of the outputs is reported as a sanity check.
+
+    python benchmarks/albert_prepack.py --config model/albert_pytorch/prev_trained_model/albert_base_v2/config.json
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model.albert_pytorch.configuration_albert import AlbertConfig
+from model.albert_pytorch.modeling_albert import AlbertModel
+
+
+def timed(model, input_ids, repeats, warmup=3):
+    with torch.no_grad():
+        for _ in range(warmup):
+            output = model(input_ids)[0]
+        start = time.time()
+        for _ in range(repeats):
+            output = model(input_ids)[0]
+    return output, 1000.0 * (time.time() - start) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", default="model/albert_pytorch/prev_trained_model/albert_base_v2/config.json")
+    parser.add_argument("--batch_sizes", default=[1, 8, 32], type=int, nargs="+")
+    parser.add_argument("--seq_length", default=202, type=int)
+    parser.add_argument("--repeats", default=20, type=int)
+    parser.add_argument("--num_threads", default=None, type=int)
+    args = parser.parse_args()
+
+    if args.num_threads:
+        torch.set_num_threads(args.num_threads)
+    torch.manual_seed(0)
+    config = AlbertConfig.from_pretrained(args.config)
+    model = AlbertModel(config, add_pooling_layer=False)
+    model.eval()
+
+    inputs = [torch.randint(1, config.vocab_size, (batch_size, args.seq_length)) for batch_size in args.batch_sizes]
+    before = [timed(model, input_ids, args.repeats) for input_ids in inputs]
+
+    if not model.prepare_for_inference():
+        print("oneDNN prepacking is not available in this torch build, nothing to compare")
+        return
+    after = [timed(model, input_ids, args.repeats) for input_ids in inputs]
+
+    print("batch\tdense_ms\tprepacked_ms\tspeedup\tmax_abs_diff")
+    for batch_size, (dense, dense_ms), (packed, packed_ms) in zip(args.batch_sizes, before, after):
+        print("%d\t%.1f\t%.1f\t%.2fx\t%.2e" % (batch_size, dense_ms, packed_ms, dense_ms / packed_ms,
+                                             (dense - packed).abs().max().item()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""BasicTokenizer throughput of the compiled character classes against the previous per character passes.
+
+The sentences of ``--data`` are tokenized by ``BasicTokenizer`` and by ``per_char_tokenize``, the
+implementation it replaced (one ``unicodedata.category`` lookup and a Python branch per character in every
+pass, every token lower cased, stripped and split on its own). Both outputs are compared and the sentences
+per second of each are reported.
+
+    python benchmarks/basic_tokenizer.py --data data/test.txt
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import os
+import sys
+import time
+import unicodedata
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model.albert_pytorch.tokenization_bert import (BasicTokenizer, _is_control, _is_punctuation, _is_whitespace,
+                                                    whitespace_tokenize)
+from model.ner_utils import read_ner_file
+
+
+def per_char_tokenize(tokenizer, text):
+    output = []
+    for char in text:
+        if ord(char) == 0 or ord(char) == 0xfffd or _is_control(char):
+            continue
+        output.append(" " if _is_whitespace(char) else char)
+    text = "".join(output)
+    text = "".join(" %s " % char if tokenizer._is_chinese_char(ord(char)) else char for char in text)
+    split_tokens = []
+    for token in whitespace_tokenize(text):
+        if tokenizer.do_lower_case:
+            token = unicodedata.normalize("NFD", token.lower())
+            token = "".join(char for char in token if unicodedata.category(char) != "Mn")
+        pieces, start_new_word = [], True
+        for char in token:
+            if _is_punctuation(char):
+                pieces.append(char)
+                start_new_word = True
+            else:
+                if start_new_word:
+                    pieces.append("")
+                start_new_word = False
+                pieces[-1] += char
+        split_tokens.extend(pieces)
+    return whitespace_tokenize(" ".join(split_tokens))
+
+
+def timed(function, sentences, repeats):
+    start = time.time()
+    for _ in range(repeats):
+        output = [function(sentence) for sentence in sentences]
+    return output, repeats * len(sentences) / (time.time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data", default="data/test.txt", type=str)
+    parser.add_argument("--repeats", default=3, type=int)
+    args = parser.parse_args()
+
+    sentences = ["".join(sentence) for sentence in read_ner_file(args.data)[0]]
+    # the character classes are built on the first tokenization, not timed
+    BasicTokenizer().tokenize(sentences[0])
+    print("do_lower_case\tsentences\tper_char_sentences/s\tclasses_sentences/s\tspeedup\tidentical")
+    for do_lower_case in (True, False):
+        tokenizer = BasicTokenizer(do_lower_case=do_lower_case)
+        reference, reference_rate = timed(lambda text: per_char_tokenize(tokenizer, text), sentences, args.repeats)
+        output, rate = timed(tokenizer.tokenize, sentences, args.repeats)
+        print("%s\t%d\t%.0f\t%.0f\t%.2fx\t%s" % (do_lower_case, len(sentences), reference_rate, rate,
+                                                rate / reference_rate, output == reference))
+
+
+if __name__ == "__main__":
+    main()
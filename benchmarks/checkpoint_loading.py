@@ -0,0 +1,92 @@
+"""Cold start time and peak memory of ``from_pretrained`` for the pickled, the flat (memory mapped) and the sharded
+checkpoint, with and without the random initialization of the weights before loading (``fast_init``).
+
+A model of ``--model_type`` is built from the config with random weights and saved once in each format
+to ``--output_dir``. Every load then runs in a fresh child process which reports the wall-clock time of
+``from_pretrained`` and the growth of its peak resident memory (Linux ``ru_maxrss``). Pages of a memory
+mapped archive only count once they are touched, the ``forward`` columns include one forward pass.
+
+    python benchmarks/checkpoint_loading.py --model_type bert --config <bert config.json>
+    python benchmarks/checkpoint_loading.py --model_type albert --config model/albert_pytorch/prev_trained_model/albert_base_v2/config.json
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model.albert_pytorch.configuration_albert import AlbertConfig
+from model.albert_pytorch.configuration_bert import BertConfig
+from model.albert_pytorch.modeling_albert import AlbertModel
+from model.albert_pytorch.modeling_bert import BertModel
+
+MODEL_CLASSES = {
+    "albert": (AlbertConfig, AlbertModel),
+    "bert": (BertConfig, BertModel),
+}
+
+
+def max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def load(model_class, model_dir, fast_init, run_forward, queue):
+    torch.set_num_threads(1)
+    base = max_rss_mb()
+    start = time.time()
+    model = model_class.from_pretrained(model_dir, fast_init=fast_init)
+    seconds = time.time() - start
+    if run_forward:
+        with torch.no_grad():
+            model(torch.ones(1, 16, dtype=torch.long))
+    queue.put((seconds, max_rss_mb() - base))
+
+
+def measure(model_class, model_dir, fast_init, run_forward, repeats):
+    results = []
+    context = multiprocessing.get_context("fork")
+    for _ in range(repeats):
+        queue = context.Queue()
+        process = context.Process(target=load, args=(model_class, model_dir, fast_init, run_forward, queue))
+        process.start()
+        results.append(queue.get())
+        process.join()
+    return min(seconds for seconds, _ in results), max(mb for _, mb in results)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_type", default="albert", choices=list(MODEL_CLASSES))
+    parser.add_argument("--config", default="model/albert_pytorch/prev_trained_model/albert_base_v2/config.json")
+    parser.add_argument("--output_dir", default="outputs/checkpoint_loading", type=str)
+    parser.add_argument("--repeats", default=3, type=int)
+    parser.add_argument("--max_shard_size", default="50MB", type=str)
+    args = parser.parse_args()
+
+    config_class, model_class = MODEL_CLASSES[args.model_type]
+    model = model_class(config_class.from_pretrained(args.config))
+    formats = dict((name, os.path.join(args.output_dir, name)) for name in ("pickle", "flat", "sharded"))
+    for name, model_dir in formats.items():
+        if not os.path.isdir(model_dir):
+            os.makedirs(model_dir)
+        model.save_pretrained(model_dir, flat=name == "flat",
+                              max_shard_size=args.max_shard_size if name == "sharded" else None)
+    del model
+
+    print("format\tfast_init\tload_s\tpeak_rss_mb\tload_forward_s\tpeak_rss_forward_mb")
+    for name, model_dir in formats.items():
+        for fast_init in (False, True):
+            seconds, mb = measure(model_class, model_dir, fast_init, False, args.repeats)
+            forward_seconds, forward_mb = measure(model_class, model_dir, fast_init, True, args.repeats)
+            print("%s\t%s\t%.3f\t%.1f\t%.3f\t%.1f" % (name, fast_init, seconds, mb, forward_seconds, forward_mb))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Size, load time and error of delta checkpoints of a fine-tune against its base model.
+
+The fine-tuned model (``--finetuned_dir``, saved with ``save_pretrained``) is re-saved as a delta to the base
+model (``--base_dir``) as dense float32, dense float16 and sparse deltas for every ``--thresholds``. For
+each, the bytes on disk, the ``from_pretrained`` time and the maximum absolute weight difference to the
+full fine-tune are reported.
+
+    python benchmarks/delta_checkpoints.py --model_type albert --base_dir model/albert_pytorch/prev_trained_model/albert_base_v2 \
+        --finetuned_dir outputs/albert-ner --thresholds 1e-4 1e-3
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model.albert_pytorch.checkpoint_utils import checkpoint_file
+from model.albert_pytorch.file_utils import DELTA_INDEX_NAME, DELTA_WEIGHTS_NAME
+from model.albert_pytorch.modeling_albert import AlbertForTokenClassification
+from model.albert_pytorch.modeling_bert import BertForTokenClassification
+
+MODEL_CLASSES = {
+    "albert": AlbertForTokenClassification,
+    "bert": BertForTokenClassification,
+}
+
+
+def weights_mb(model_dir):
+    names = (DELTA_INDEX_NAME, DELTA_WEIGHTS_NAME)
+    if os.path.isfile(os.path.join(model_dir, DELTA_INDEX_NAME)):
+        return sum(os.path.getsize(os.path.join(model_dir, name)) for name in names) / 2 ** 20
+    return os.path.getsize(checkpoint_file(model_dir)) / 2 ** 20
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_type", default="albert", choices=list(MODEL_CLASSES))
+    parser.add_argument("--base_dir", required=True, type=str)
+    parser.add_argument("--finetuned_dir", required=True, type=str)
+    parser.add_argument("--output_dir", default="outputs/delta_checkpoints", type=str)
+    parser.add_argument("--thresholds", default=[1e-4, 1e-3], type=float, nargs="+")
+    args = parser.parse_args()
+
+    model_class = MODEL_CLASSES[args.model_type]
+    start = time.time()
+    finetuned = model_class.from_pretrained(args.finetuned_dir)
+    full_seconds = time.time() - start
+    reference = finetuned.state_dict()
+
+    variants = [("dense_fp32", None, None), ("dense_fp16", torch.float16, None)]
+    variants += [("sparse_%g" % threshold, None, threshold) for threshold in args.thresholds]
+    full_mb = weights_mb(args.finetuned_dir)
+    print("checkpoint\tmb\tratio\tload_s\tmax_abs_diff")
+    print("full\t%.1f\t1.00\t%.2f\t0" % (full_mb, full_seconds))
+    for name, dtype, threshold in variants:
+        delta_dir = os.path.join(args.output_dir, name)
+        if not os.path.isdir(delta_dir):
+            os.makedirs(delta_dir)
+        finetuned.save_delta_pretrained(delta_dir, args.base_dir, dtype=dtype, threshold=threshold)
+        start = time.time()
+        model = model_class.from_pretrained(delta_dir)
+        seconds = time.time() - start
+        difference = max((value.float() - reference[key].float()).abs().max().item()
+                         for key, value in model.state_dict().items() if value.numel())
+        mb = weights_mb(delta_dir)
+        print("%s\t%.1f\t%.3f\t%.2f\t%.2e" % (name, mb, mb / full_mb, seconds, difference))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Distill an encoder + CRF NER teacher into 3 / 4 / 6 layer students and report speed and entity F1.
+
+The teacher directory holds an ``EncoderCRFTagger`` saved with ``save_pretrained`` and trained on the
+label ids of ``model.ner_utils.build_label_map``. Every student is initialized from evenly spaced teacher
+layers (``uniform_layer_map``), trained with ``model.distillation.distill`` and saved to
+``<output_dir>/student-<layers>``. The repository only ships ``data/dev.txt`` and ``data/test.txt``, so
+the students are distilled on the dev split by default; pass the teacher's own training file (same
+``read_ner_file`` format) as ``--train_data`` when it is at hand.
+
+    python benchmarks/distillation.py --teacher_dir outputs/bert-bigru-crf --model_type bert \
+        --train_data data/dev.txt --eval_data data/test.txt --student_layers 3 4 6 --hidden_weight 1 --crf_weight 1
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model.albert_pytorch.modeling_albert import AlbertModel
+from model.albert_pytorch.modeling_bert import BertModel
+from model.distillation import Distiller, build_student, distill
+from model.ner_models import EncoderCRFTagger
+from model.ner_utils import (read_ner_file, load_vocab, build_label_map, encode_sentences,
+                             decode_label_ids, entity_f1)
+
+ENCODER_CLASSES = {
+    "albert": AlbertModel,
+    "bert": BertModel,
+}
+
+
+def batches(input_ids, label_ids, batch_size, shuffle):
+    order = torch.randperm(input_ids.size(0)) if shuffle else torch.arange(input_ids.size(0))
+    for i in range(0, input_ids.size(0), batch_size):
+        index = order[i:i + batch_size]
+        batch = input_ids[index]
+        yield {"input_ids": batch, "attention_mask": (batch > 0).long(), "tags": label_ids[index]}
+
+
+class Epochs(object):
+    """ Re-iterable shuffled batches, a new order every epoch """
+
+    def __init__(self, input_ids, label_ids, batch_size):
+        self.input_ids, self.label_ids, self.batch_size = input_ids, label_ids, batch_size
+
+    def __iter__(self):
+        return batches(self.input_ids, self.label_ids, self.batch_size, shuffle=True)
+
+
+def evaluate(tagger, input_ids, lengths, gold, id2label, batch_size):
+    tagger.eval()
+    predictions = []
+    start = time.time()
+    with torch.no_grad():
+        for i in range(0, input_ids.size(0), batch_size):
+            predictions.extend(tagger(input_ids[i:i + batch_size]))
+    seconds = time.time() - start
+    f1 = entity_f1(gold, decode_label_ids(predictions, lengths, id2label))[2]
+    return f1, 1000.0 * seconds / input_ids.size(0)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--teacher_dir", required=True, type=str)
+    parser.add_argument("--model_type", default="bert", choices=list(ENCODER_CLASSES))
+    parser.add_argument("--output_dir", default="outputs/distillation", type=str)
+    parser.add_argument("--train_data", default="data/dev.txt", type=str)
+    parser.add_argument("--eval_data", default="data/test.txt", type=str)
+    parser.add_argument("--vocab", default="data/vocab.txt", type=str)
+    parser.add_argument("--student_layers", default=[3, 4, 6], type=int, nargs="+")
+    parser.add_argument("--student_hidden_size", default=None, type=int)
+    parser.add_argument("--epochs", default=3, type=int)
+    parser.add_argument("--learning_rate", default=5e-5, type=float)
+    parser.add_argument("--temperature", default=2.0, type=float)
+    parser.add_argument("--hard_weight", default=1.0, type=float)
+    parser.add_argument("--emission_weight", default=1.0, type=float)
+    parser.add_argument("--hidden_weight", default=0.0, type=float)
+    parser.add_argument("--crf_weight", default=0.0, type=float)
+    parser.add_argument("--max_seq_length", default=202, type=int)
+    parser.add_argument("--batch_size", default=16, type=int)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    vocab = load_vocab(args.vocab)
+    train_words, train_labels = read_ner_file(args.train_data)
+    eval_words, eval_labels = read_ner_file(args.eval_data)
+    label2id, id2label = build_label_map(train_labels + eval_labels)
+    train_ids, train_label_ids = encode_sentences(train_words, vocab, args.max_seq_length, train_labels, label2id)
+    train_data = Epochs(torch.tensor(train_ids, dtype=torch.long), torch.tensor(train_label_ids, dtype=torch.long),
+                        args.batch_size)
+    eval_ids = torch.tensor(encode_sentences(eval_words, vocab, args.max_seq_length)[0], dtype=torch.long)
+    lengths = [min(len(sentence), args.max_seq_length - 2) for sentence in eval_words]
+    gold = [sentence[:length] for sentence, length in zip(eval_labels, lengths)]
+
+    teacher = EncoderCRFTagger.from_pretrained(args.teacher_dir, ENCODER_CLASSES[args.model_type])
+    teacher_layers = teacher.encoder.config.num_hidden_layers
+    teacher_f1, teacher_ms = evaluate(teacher, eval_ids, lengths, gold, id2label, args.batch_size)
+    rows = [("teacher", teacher_layers, teacher_f1, teacher_ms)]
+
+    for num_layers in args.student_layers:
+        student = build_student(teacher, num_layers, hidden_size=args.student_hidden_size)
+        distiller = Distiller(teacher, student, temperature=args.temperature, hard_weight=args.hard_weight,
+                              emission_weight=args.emission_weight, hidden_weight=args.hidden_weight,
+                              crf_weight=args.crf_weight)
+        distill(distiller, train_data, epochs=args.epochs, learning_rate=args.learning_rate)
+
+        student_dir = os.path.join(args.output_dir, "student-%d" % num_layers)
+        if not os.path.isdir(student_dir):
+            os.makedirs(student_dir)
+        student.save_pretrained(student_dir)
+        f1, ms = evaluate(student, eval_ids, lengths, gold, id2label, args.batch_size)
+        rows.append(("student", num_layers, f1, ms))
+
+    print("model\tlayers\tf1\tdelta_f1\tms/sentence\tspeedup")
+    for name, num_layers, f1, ms in rows:
+        print("%s\t%d\t%.4f\t%+.4f\t%.2f\t%.2fx" % (name, num_layers, f1, f1 - teacher_f1, ms, teacher_ms / ms))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Average layers executed and entity F1 delta of ALBERT early exit.
+
+The model directory holds an ``AlbertModel`` saved with ``save_pretrained`` whose config sets
+``num_exit_labels`` and whose exit heads were trained (``early_exit_loss``) on the label ids of
+``model.ner_utils.build_label_map``. The baseline is the top layer exit head (no early exit).
+
+    python benchmarks/early_exit.py --model_dir outputs/albert-early-exit --data data/test.txt \
+        --thresholds 0.8 0.9 0.95 --criterion max_prob
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model.albert_pytorch.modeling_albert import AlbertModel
+from model.ner_utils import (read_ner_file, load_vocab, build_label_map, encode_sentences,
+                             decode_label_ids, entity_f1)
+
+
+def run(model, input_ids, batch_size, threshold, criterion, per_sample):
+    predictions, layers = [], []
+    start = time.time()
+    with torch.no_grad():
+        for i in range(0, input_ids.size(0), batch_size):
+            batch = input_ids[i:i + batch_size]
+            _, logits, exit_layers = model.forward_early_exit(batch, attention_mask=(batch > 0).long(),
+                                                              threshold=threshold, criterion=criterion,
+                                                              per_sample=per_sample)
+            predictions.extend(logits.argmax(dim=-1).tolist())
+            layers.extend(exit_layers.tolist())
+    return predictions, layers, time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_dir", required=True, type=str)
+    parser.add_argument("--data", default="data/test.txt", type=str)
+    parser.add_argument("--vocab", default="data/vocab.txt", type=str)
+    parser.add_argument("--thresholds", default=[0.8, 0.9, 0.95, 0.99], type=float, nargs="+")
+    parser.add_argument("--criterion", default="max_prob", choices=["max_prob", "entropy"])
+    parser.add_argument("--per_batch", action="store_true", help="Exit the whole batch at once.")
+    parser.add_argument("--max_seq_length", default=202, type=int)
+    parser.add_argument("--batch_size", default=32, type=int)
+    args = parser.parse_args()
+
+    words, labels = read_ner_file(args.data)
+    label2id, id2label = build_label_map(labels)
+    input_ids, _ = encode_sentences(words, load_vocab(args.vocab), args.max_seq_length)
+    input_ids = torch.tensor(input_ids, dtype=torch.long)
+    lengths = [min(len(sentence), args.max_seq_length - 2) for sentence in words]
+    gold = [sentence[:length] for sentence, length in zip(labels, lengths)]
+
+    model = AlbertModel.from_pretrained(args.model_dir)
+    model.eval()
+    num_layers = model.config.num_hidden_layers
+
+    # a threshold above 1 never exits early: every sample runs the full stack and uses the top head
+    rows = [("full", 2.0)] + [("%.3f" % t, t) for t in args.thresholds]
+    base_f1 = None
+    print("threshold\tavg_layers\tf1\tdelta_f1\tseconds")
+    for name, threshold in rows:
+        predictions, layers, seconds = run(model, input_ids, args.batch_size, threshold,
+                                           args.criterion, not args.per_batch)
+        f1 = entity_f1(gold, decode_label_ids(predictions, lengths, id2label))[2]
+        if base_f1 is None:
+            base_f1 = f1
+        print("%s\t%.2f/%d\t%.4f\t%+.4f\t%.1f" % (name, sum(layers) / len(layers), num_layers,
+                                                  f1, f1 - base_f1, seconds))
+
+
+if __name__ == "__main__":
+    main()
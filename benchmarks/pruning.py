@@ -0,0 +1,130 @@
+"""Prune a NER model to a FLOP budget and report the entity F1, FLOPs and size deltas.
+
+Heads and FFN neurons are scored with gradient x activation on ``--importance_data``
+(``model.albert_pytorch.pruning``), the least important ones per FLOP are removed until the encoder
+is at ``--target`` of its FLOPs, the model is optionally fine-tuned for a few epochs on ``--train_data``
+and saved to ``--output_dir`` with ``save_pretrained``. The model directory holds an
+``AlbertForTokenClassification`` / ``BertForTokenClassification`` trained on the label ids of
+``model.ner_utils.build_label_map``.
+
+    python benchmarks/pruning.py --model_dir outputs/albert-ner --target 0.6 --output_dir outputs/albert-ner-pruned
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import os
+import sys
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model.albert_pytorch.modeling_albert import AlbertForTokenClassification
+from model.albert_pytorch.modeling_bert import BertForTokenClassification
+from model.albert_pytorch.pruning import prune_to_flop_budget
+from model.ner_utils import (read_ner_file, load_vocab, build_label_map, encode_sentences,
+                             decode_label_ids, entity_f1)
+
+MODEL_CLASSES = {
+    "albert": AlbertForTokenClassification,
+    "bert": BertForTokenClassification,
+}
+
+
+def load_data(path, vocab, label2id, max_seq_length):
+    words, labels = read_ner_file(path)
+    input_ids, label_ids = encode_sentences(words, vocab, max_seq_length, labels, label2id)
+    lengths = [min(len(sentence), max_seq_length - 2) for sentence in words]
+    gold = [sentence[:length] for sentence, length in zip(labels, lengths)]
+    return torch.tensor(input_ids, dtype=torch.long), torch.tensor(label_ids, dtype=torch.long), lengths, gold
+
+
+def batches(input_ids, label_ids, batch_size, shuffle=False):
+    order = torch.randperm(input_ids.size(0)) if shuffle else torch.arange(input_ids.size(0))
+    for i in range(0, input_ids.size(0), batch_size):
+        index = order[i:i + batch_size]
+        batch = input_ids[index]
+        yield {"input_ids": batch, "attention_mask": (batch > 0).long(), "labels": label_ids[index]}
+
+
+def evaluate(model, input_ids, lengths, gold, id2label, batch_size):
+    model.eval()
+    predictions = []
+    with torch.no_grad():
+        for i in range(0, input_ids.size(0), batch_size):
+            batch = input_ids[i:i + batch_size]
+            logits = model(batch, attention_mask=(batch > 0).long())[0]
+            predictions.extend(logits.argmax(dim=-1).tolist())
+    return entity_f1(gold, decode_label_ids(predictions, lengths, id2label))[2]
+
+
+def fine_tune(model, input_ids, label_ids, epochs, batch_size, learning_rate):
+    optimizer = torch.optim.Adam(model.parameters(), lr=learning_rate)
+    model.train()
+    for epoch in range(epochs):
+        total, steps = 0.0, 0
+        for batch in batches(input_ids, label_ids, batch_size, shuffle=True):
+            loss = model(**batch)[0]
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            total, steps = total + loss.item(), steps + 1
+        print("fine-tune epoch %d loss %.4f" % (epoch + 1, total / max(steps, 1)))
+    model.eval()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_dir", required=True, type=str)
+    parser.add_argument("--model_type", default="albert", choices=list(MODEL_CLASSES))
+    parser.add_argument("--output_dir", required=True, type=str)
+    parser.add_argument("--target", default=0.6, type=float, help="Fraction of the encoder FLOPs to keep.")
+    parser.add_argument("--importance_data", default="data/dev.txt", type=str)
+    parser.add_argument("--eval_data", default="data/test.txt", type=str)
+    parser.add_argument("--train_data", default=None, type=str)
+    parser.add_argument("--fine_tune_epochs", default=0, type=int)
+    parser.add_argument("--learning_rate", default=2e-5, type=float)
+    parser.add_argument("--vocab", default="data/vocab.txt", type=str)
+    parser.add_argument("--max_seq_length", default=202, type=int)
+    parser.add_argument("--batch_size", default=16, type=int)
+    args = parser.parse_args()
+
+    if args.fine_tune_epochs and not args.train_data:
+        parser.error("--fine_tune_epochs needs --train_data")
+    if not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    vocab = load_vocab(args.vocab)
+    label2id, id2label = build_label_map(read_ner_file(args.importance_data)[1] + read_ner_file(args.eval_data)[1])
+    importance_ids, importance_labels, _, _ = load_data(args.importance_data, vocab, label2id, args.max_seq_length)
+    eval_ids, _, eval_lengths, eval_gold = load_data(args.eval_data, vocab, label2id, args.max_seq_length)
+
+    model = MODEL_CLASSES[args.model_type].from_pretrained(args.model_dir)
+    n_params = sum(p.numel() for p in model.parameters())
+    base_f1 = evaluate(model, eval_ids, eval_lengths, eval_gold, id2label, args.batch_size)
+
+    heads, neurons, flops_before, flops_after = prune_to_flop_budget(
+        model, batches(importance_ids, importance_labels, args.batch_size), args.target, args.max_seq_length)
+    pruned_f1 = evaluate(model, eval_ids, eval_lengths, eval_gold, id2label, args.batch_size)
+
+    tuned_f1 = None
+    if args.fine_tune_epochs:
+        train_ids, train_labels, _, _ = load_data(args.train_data, vocab, label2id, args.max_seq_length)
+        fine_tune(model, train_ids, train_labels, args.fine_tune_epochs, args.batch_size, args.learning_rate)
+        tuned_f1 = evaluate(model, eval_ids, eval_lengths, eval_gold, id2label, args.batch_size)
+
+    model.save_pretrained(args.output_dir)
+    reloaded = MODEL_CLASSES[args.model_type].from_pretrained(args.output_dir)
+    pruned_params = sum(p.numel() for p in reloaded.parameters())
+
+    print("pruned heads %d, neurons %d" % (sum(len(h) for h in heads.values()), sum(len(n) for n in neurons.values())))
+    print("encoder GFLOPs/token %.3f -> %.3f (%.1f%%)" % (flops_before / 1e9, flops_after / 1e9,
+                                                         100.0 * flops_after / flops_before))
+    print("parameters %d -> %d" % (n_params, pruned_params))
+    print("f1 %.4f -> %.4f (%+.4f) after pruning" % (base_f1, pruned_f1, pruned_f1 - base_f1))
+    if tuned_f1 is not None:
+        print("f1 %.4f -> %.4f (%+.4f) after fine-tuning" % (base_f1, tuned_f1, tuned_f1 - base_f1))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Entity F1, latency and size of a dynamically int8 quantized NER model against its fp32 original.
+
+The model directory holds an ``AlbertForTokenClassification`` / ``BertForTokenClassification`` saved with
+``save_pretrained`` and trained on the label ids of ``model.ner_utils.build_label_map``. Dynamic quantization
+computes the activation ranges at run time, so the dev set is only used to evaluate (and the first batches
+to warm up). The quantized model is written with ``save_pretrained`` to ``--output_dir`` and the reported
+numbers come from reloading it with ``from_pretrained``.
+
+    python benchmarks/quantization.py --model_dir outputs/albert-ner --model_type albert --data data/dev.txt
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model.albert_pytorch.file_utils import WEIGHTS_NAME
+from model.albert_pytorch.modeling_albert import AlbertForTokenClassification
+from model.albert_pytorch.modeling_bert import BertForTokenClassification
+from model.ner_utils import (read_ner_file, load_vocab, build_label_map, encode_sentences,
+                             decode_label_ids, entity_f1)
+
+MODEL_CLASSES = {
+    "albert": AlbertForTokenClassification,
+    "bert": BertForTokenClassification,
+}
+
+
+def run(model, input_ids, batch_size, warmup=2):
+    predictions = []
+    with torch.no_grad():
+        for i in range(0, min(warmup * batch_size, input_ids.size(0)), batch_size):
+            batch = input_ids[i:i + batch_size]
+            model(batch, attention_mask=(batch > 0).long())
+        start = time.time()
+        for i in range(0, input_ids.size(0), batch_size):
+            batch = input_ids[i:i + batch_size]
+            logits = model(batch, attention_mask=(batch > 0).long())[0]
+            predictions.extend(logits.argmax(dim=-1).tolist())
+    return predictions, time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_dir", required=True, type=str)
+    parser.add_argument("--model_type", default="albert", choices=list(MODEL_CLASSES))
+    parser.add_argument("--output_dir", default=None, type=str, help="Defaults to <model_dir>-int8.")
+    parser.add_argument("--data", default="data/dev.txt", type=str)
+    parser.add_argument("--vocab", default="data/vocab.txt", type=str)
+    parser.add_argument("--max_seq_length", default=202, type=int)
+    parser.add_argument("--batch_size", default=32, type=int)
+    parser.add_argument("--num_threads", default=None, type=int)
+    args = parser.parse_args()
+
+    if args.num_threads:
+        torch.set_num_threads(args.num_threads)
+    output_dir = args.output_dir or args.model_dir.rstrip("/") + "-int8"
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    words, labels = read_ner_file(args.data)
+    label2id, id2label = build_label_map(labels)
+    input_ids, _ = encode_sentences(words, load_vocab(args.vocab), args.max_seq_length)
+    input_ids = torch.tensor(input_ids, dtype=torch.long)
+    lengths = [min(len(sentence), args.max_seq_length - 2) for sentence in words]
+    gold = [sentence[:length] for sentence, length in zip(labels, lengths)]
+
+    model_class = MODEL_CLASSES[args.model_type]
+    model = model_class.from_pretrained(args.model_dir)
+    model.quantize()
+    model.save_pretrained(output_dir)
+
+    rows = []
+    for name, model_dir in (("fp32", args.model_dir), ("int8", output_dir)):
+        model = model_class.from_pretrained(model_dir)
+        predictions, seconds = run(model, input_ids, args.batch_size)
+        f1 = entity_f1(gold, decode_label_ids(predictions, lengths, id2label))[2]
+        size = os.path.getsize(os.path.join(model_dir, WEIGHTS_NAME))
+        rows.append((name, f1, 1000.0 * seconds / len(words), size))
+
+    base = rows[0]
+    print("model\tf1\tdelta_f1\tms/sentence\tspeedup\tsize_mb\tsize_ratio")
+    for name, f1, latency, size in rows:
+        print("%s\t%.4f\t%+.4f\t%.2f\t%.2fx\t%.1f\t%.2f" % (name, f1, f1 - base[1], latency, base[2] / latency,
+                                                          size / 2 ** 20, size / float(base[3])))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+""" Low-rank (LoRA) adapters on the attention and FFN Linear layers of the ALBERT / BERT encoders.
+
+An adapter adds ``B @ A * alpha / rank`` to the weight of a Linear layer, with A (rank x in_features)
+randomly initialized and B (out_features x rank) zero, so a new adapter starts as the identity change.
+Only A and B are trained, the encoder weights are frozen. The shared ALBERT layer gets one adapter per
+Linear, applied at every one of its iterations. Several named adapters can live on the same layers, one is
+active at a time (``set_active_adapter``) and can be merged into the weights for inference without overhead,
+or every row of a batch goes through its own adapter (``set_adapter_routing``).
+
+Adapters sit on the encoder (``AlbertModel`` / ``BertModel``) wherever it is wrapped, so an adapter saved
+from an ``AlbertForTokenClassification`` loads onto the ``AlbertModel`` of an ``EncoderCRFTagger``.
+Prune heads or neurons before adding adapters, pruning replaces the Linear layers. A model saved with
+``save_pretrained`` after ``merge_adapter`` loads as a plain model with the adapted weights.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import json
+import logging
+import math
+import os
+from io import open
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from . import modeling_albert, modeling_albert_bright, modeling_bert
+from .file_utils import ADAPTER_CONFIG_NAME, ADAPTER_WEIGHTS_NAME
+from .modeling_utils import PreTrainedModel, no_init_weights
+
+logger = logging.getLogger(__name__)
+
+# 'query', 'key', 'value' are the self attention projections, 'ffn' the two dense layers of the feed forward
+ADAPTER_TARGETS = ('query', 'key', 'value', 'ffn')
+
+SELF_ATTENTION_CLASSES = (modeling_albert.AlbertSelfAttention, modeling_bert.BertSelfAttention)
+FFN_CLASSES = (modeling_albert.AlbertIntermediate, modeling_albert.AlbertOutput, modeling_bert.BertIntermediate,
+               modeling_bert.BertOutput, modeling_albert_bright.AlbertOutput)
+
+
+class LoRALinear(nn.Linear):
+    """ nn.Linear with named low-rank adapters, the weight and bias keep their names in the state dict """
+
+    def __init__(self, in_features, out_features, bias=True):
+        super(LoRALinear, self).__init__(in_features, out_features, bias=bias)
+        self.lora_A = nn.ParameterDict()
+        self.lora_B = nn.ParameterDict()
+        self.lora_dropout = nn.ModuleDict()
+        self.lora_scaling = {}
+        self.active_adapter = None
+        self.merged_adapter = None
+        self.adapter_routing = None
+
+    @classmethod
+    def from_linear(cls, linear):
+        """ LoRALinear sharing the weight and bias parameters of linear """
+        with no_init_weights():
+            lora = cls(linear.in_features, linear.out_features, bias=linear.bias is not None)
+        lora.weight = linear.weight
+        lora.bias = linear.bias
+        return lora
+
+    def add_adapter(self, name, rank, alpha, dropout=0.0):
+        weight = self.weight
+        self.lora_A[name] = nn.Parameter(weight.new_empty(rank, self.in_features))
+        self.lora_B[name] = nn.Parameter(weight.new_zeros(self.out_features, rank))
+        nn.init.kaiming_uniform_(self.lora_A[name], a=math.sqrt(5))
+        self.lora_dropout[name] = nn.Dropout(dropout) if dropout else nn.Identity()
+        self.lora_scaling[name] = alpha / float(rank)
+
+    def delete_adapter(self, name):
+        if self.merged_adapter == name:
+            self.unmerge()
+        for container in (self.lora_A, self.lora_B, self.lora_dropout):
+            del container[name]
+        del self.lora_scaling[name]
+        if self.active_adapter == name:
+            self.active_adapter = None
+
+    def lora_weight(self, name):
+        """ The change of the weight made by an adapter """
+        return torch.matmul(self.lora_B[name], self.lora_A[name]) * self.lora_scaling[name]
+
+    def lora_delta(self, input, name):
+        hidden = F.linear(self.lora_dropout[name](input), self.lora_A[name])
+        return F.linear(hidden, self.lora_B[name]) * self.lora_scaling[name]
+
+    def merge(self, name):
+        if self.merged_adapter is not None:
+            self.unmerge()
+        with torch.no_grad():
+            self.weight.add_(self.lora_weight(name).to(self.weight.dtype))
+        self.merged_adapter = self.active_adapter = name
+
+    def unmerge(self):
+        if self.merged_adapter is None:
+            return
+        with torch.no_grad():
+            self.weight.sub_(self.lora_weight(self.merged_adapter).to(self.weight.dtype))
+        self.merged_adapter = None
+
+    def forward(self, input):
+        output = F.linear(input, self.weight, self.bias)
+        if self.adapter_routing is not None:
+            # rows of a mixed batch go through their own adapter, see set_adapter_routing
+            for name, rows in self.adapter_routing:
+                if name in self.lora_A:
+                    output = output.index_add(0, rows, self.lora_delta(input.index_select(0, rows), name))
+            return output
+        if self.active_adapter is None or self.active_adapter == self.merged_adapter:
+            return output
+        return output + self.lora_delta(input, self.active_adapter)
+
+
+def encoder_of(model):
+    """ The AlbertModel / BertModel inside model (a PreTrainedModel with heads, an EncoderCRFTagger, ...) """
+    if isinstance(model, PreTrainedModel):
+        return getattr(model, model.base_model_prefix, model)
+    for module in model.modules():
+        if isinstance(module, PreTrainedModel):
+            return getattr(module, module.base_model_prefix, module)
+    raise ValueError("No ALBERT / BERT encoder in {}".format(model.__class__.__name__))
+
+
+def _target_linears(encoder, targets):
+    # (parent module, attribute) of every Linear an adapter goes on
+    for module in encoder.modules():
+        if isinstance(module, SELF_ATTENTION_CLASSES):
+            for name in ('query', 'key', 'value'):
+                if name in targets:
+                    yield module, name
+        elif 'ffn' in targets and isinstance(module, FFN_CLASSES):
+            yield module, 'dense'
+
+
+def _adapter_configs(encoder):
+    # {name: rank, alpha, dropout and targets} of the adapters of an encoder, kept on the module, not in its config:
+    # from_pretrained builds plain Linear layers, adapters are loaded on top with load_adapter
+    if not hasattr(encoder, 'adapter_configs'):
+        encoder.adapter_configs = {}
+    return encoder.adapter_configs
+
+
+def lora_layers(model):
+    """ (name relative to the encoder, LoRALinear) of every adapted layer """
+    return [(name, module) for name, module in encoder_of(model).named_modules() if isinstance(module, LoRALinear)]
+
+
+def add_adapter(model, name='default', rank=8, alpha=16, dropout=0.0, targets=ADAPTER_TARGETS, freeze_base=True,
+                activate=True):
+    """
+    Add a named adapter to the encoder of model
+
+    :param targets: the layers to adapt, see ADAPTER_TARGETS
+    :param freeze_base: stop the gradients of every encoder parameter but the adapters (the heads stay trainable)
+    :return: the adapter parameters, e.g. for the optimizer
+    """
+    unknown = [target for target in targets if target not in ADAPTER_TARGETS]
+    if unknown:
+        raise ValueError("Unknown adapter targets {}, expected some of {}".format(unknown, ADAPTER_TARGETS))
+    encoder = encoder_of(model)
+    parameters = []
+    for module, attribute in list(_target_linears(encoder, targets)):
+        linear = getattr(module, attribute)
+        if not isinstance(linear, LoRALinear):
+            linear = LoRALinear.from_linear(linear)
+            setattr(module, attribute, linear)
+        if name in linear.lora_A:
+            raise ValueError("The adapter {} already exists".format(name))
+        linear.add_adapter(name, rank, alpha, dropout)
+        parameters += [linear.lora_A[name], linear.lora_B[name]]
+    if freeze_base:
+        for param_name, param in encoder.named_parameters():
+            param.requires_grad = '.lora_' in param_name
+    if activate:
+        set_active_adapter(model, name)
+    _adapter_configs(encoder)[name] = {"rank": rank, "alpha": alpha, "dropout": dropout, "targets": list(targets)}
+    logger.info("Adapter %s of rank %d on %d layers, %d parameters", name, rank, len(parameters) // 2,
+                sum(param.numel() for param in parameters))
+    return parameters
+
+
+def set_active_adapter(model, name):
+    """ Adapter used by the forward of every adapted layer, None for the plain encoder """
+    for _, layer in lora_layers(model):
+        if layer.merged_adapter is not None and layer.merged_adapter != name:
+            layer.unmerge()
+        layer.active_adapter = name if name in layer.lora_A else None
+
+
+def set_adapter_routing(model, names):
+    """
+    Route every row of the next batches through its own adapter instead of the active one
+
+    :param names: adapter name (or None for the plain encoder) of every row of the batch, None to stop routing
+    """
+    if names is not None and getattr(encoder_of(model).config, 'halting_threshold', None) is not None:
+        # forward_halting drops the finished samples from the batch, the rows would not match names anymore
+        raise ValueError("Adapter routing can't be used with config.halting_threshold set")
+    layers = lora_layers(model)
+    routing = None
+    if names is not None and layers:
+        rows = {}
+        for row, name in enumerate(names):
+            if name is not None:
+                rows.setdefault(name, []).append(row)
+        device = layers[0][1].weight.device
+        routing = [(name, torch.tensor(indices, dtype=torch.long, device=device)) for name, indices in rows.items()]
+    for _, layer in layers:
+        layer.unmerge()
+        layer.adapter_routing = routing
+
+
+def delete_adapter(model, name):
+    for _, layer in lora_layers(model):
+        if name in layer.lora_A:
+            layer.delete_adapter(name)
+    _adapter_configs(encoder_of(model)).pop(name, None)
+
+
+def merge_adapter(model, name):
+    """ Add the adapter to the weights for inference at the cost of a plain Linear, undone by unmerge_adapter """
+    for _, layer in lora_layers(model):
+        if name in layer.lora_A:
+            layer.merge(name)
+
+
+def unmerge_adapter(model):
+    for _, layer in lora_layers(model):
+        layer.unmerge()
+
+
+def adapter_state_dict(model, name):
+    """ {layer name relative to the encoder + '.lora_A' / '.lora_B': tensor} of one adapter """
+    state_dict = {}
+    for layer_name, layer in lora_layers(model):
+        if name in layer.lora_A:
+            state_dict[layer_name + '.lora_A'] = layer.lora_A[name].detach().cpu()
+            state_dict[layer_name + '.lora_B'] = layer.lora_B[name].detach().cpu()
+    return state_dict
+
+
+def save_adapter(model, save_directory, name='default'):
+    """ Save only the adapter weights and their configuration (a few MB instead of the whole model) """
+    assert os.path.isdir(save_directory), "Saving path should be a directory where the adapter can be saved"
+    config = dict(_adapter_configs(encoder_of(model))[name], name=name)
+    with open(os.path.join(save_directory, ADAPTER_CONFIG_NAME), "w", encoding="utf-8") as writer:
+        writer.write(json.dumps(config, indent=2, sort_keys=True) + "\n")
+    torch.save(adapter_state_dict(model, name), os.path.join(save_directory, ADAPTER_WEIGHTS_NAME))
+
+
+def load_adapter(model, adapter_dir, name=None, activate=True, freeze_base=True):
+    """
+    Add the adapter saved in adapter_dir to the encoder of model
+
+    :param name: name of the adapter in model, defaults to the saved name
+    """
+    with open(os.path.join(adapter_dir, ADAPTER_CONFIG_NAME), "r", encoding="utf-8") as reader:
+        config = json.loads(reader.read())
+    name = name or config["name"]
+    add_adapter(model, name, rank=config["rank"], alpha=config["alpha"], dropout=config["dropout"],
+                targets=config["targets"], freeze_base=freeze_base, activate=activate)
+    state_dict = torch.load(os.path.join(adapter_dir, ADAPTER_WEIGHTS_NAME), map_location='cpu')
+    layers = dict(lora_layers(model))
+    with torch.no_grad():
+        for key, value in state_dict.items():
+            layer_name, matrix = key.rsplit('.', 1)
+            getattr(layers[layer_name], matrix)[name].copy_(value)
+    return name
@@ -0,0 +1,477 @@
+"""Checkpoint formats besides the pickled ``pytorch_model.bin``.
+
+Flat archive (``pytorch_model.flat``)::
+
+    8 bytes     little endian length of the header
+    header      JSON {key: {"dtype", "shape", "offset"}, "__metadata__": {...}}, padded with spaces
+    buffers     raw C-contiguous tensor data, every buffer starting on a FLAT_ALIGNMENT byte boundary
+
+Offsets are relative to the first buffer. ``load_flat_state_dict`` maps the file copy-on-write, so the
+returned tensors are views into the page cache: forked workers loading the same file share one copy
+and nothing is read from disk before a weight is touched.
+
+Sharded checkpoint (``pytorch_model.bin.index.json`` + ``pytorch_model-00001-of-0000N.bin`` ...)::
+
+    index       JSON {"weight_map": {key: shard file}, "shards": {shard file: {"size", "sha256"}}, "metadata": {...}}
+    shards      pickled state dicts of consecutive keys, each at most max_shard_size bytes (unless a single tensor is larger)
+
+``load_sharded_state_dict`` reads the shards in parallel threads, checks each against its size and hash as
+it is read and copies its tensors straight into the parameters, so one corrupted shard fails the load
+without the others having to be read first.
+
+Delta checkpoint (``delta_index.json`` + ``delta_model.bin``)::
+
+    index       JSON {"base": {"path", "size", "sha256"}, "entries": {key: {"kind", "base_key"}}, "metadata": {...}}
+    deltas      pickled {key: dense delta | (flat indices, values) | full tensor}
+
+A fine-tune of a shared base checkpoint only stores what changed: "same" keys nothing, "dense" keys
+``weight - base`` (optionally float16), "sparse" keys the entries whose change exceeds a threshold and "full"
+keys (new heads, resized embeddings) the weight itself. The base is identified by the hash of its weights file
+(the index of a sharded base, which holds the hashes of the shards). ``load_delta_state_dict`` streams the base tensor by
+tensor (a flat base is memory mapped, a sharded one read shard by shard) into the parameters and adds the deltas.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import hashlib
+import io
+import json
+import mmap
+import os
+import re
+import struct
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+from .file_utils import WEIGHTS_NAME, FLAT_WEIGHTS_NAME, SHARDED_INDEX_NAME, DELTA_INDEX_NAME, DELTA_WEIGHTS_NAME
+
+FLAT_ALIGNMENT = 64
+FLAT_VERSION = 1
+
+# torch dtype name -> numpy dtype of the raw buffers
+FLAT_DTYPES = {
+    'float64': np.float64,
+    'float32': np.float32,
+    'float16': np.float16,
+    'int64': np.int64,
+    'int32': np.int32,
+    'int16': np.int16,
+    'int8': np.int8,
+    'uint8': np.uint8,
+    'bool': np.bool_,
+}
+
+
+def _aligned(offset):
+    return (offset + FLAT_ALIGNMENT - 1) // FLAT_ALIGNMENT * FLAT_ALIGNMENT
+
+
+def save_flat_state_dict(state_dict, path, metadata=None):
+    """ Write the tensors of state_dict to a flat archive, tensors sharing their data (tied weights) are stored once """
+    header, buffers, shared = OrderedDict(), [], {}
+    offset = 0
+    for key, tensor in state_dict.items():
+        if not isinstance(tensor, torch.Tensor) or tensor.is_quantized:
+            raise ValueError("The flat format only holds plain tensors, {} is a {}".format(key, type(tensor)))
+        dtype = str(tensor.dtype).split('.')[-1]
+        if dtype not in FLAT_DTYPES:
+            raise ValueError("The flat format can't store {} of dtype {}".format(key, dtype))
+        # identified by the tensor of state_dict, alive for the whole loop: the address of a cpu / contiguous copy
+        # can be reused by the copy of a later tensor once the earlier copy is freed
+        identity = (str(tensor.device), tensor.data_ptr(), dtype, tuple(tensor.shape), tuple(tensor.stride()))
+        if identity in shared and tensor.numel():
+            header[key] = dict(header[shared[identity]])
+            continue
+        shared[identity] = key
+        tensor = tensor.detach().cpu().contiguous()
+        offset = _aligned(offset)
+        header[key] = {"dtype": dtype, "shape": list(tensor.shape), "offset": offset}
+        data = tensor.numpy().tobytes()
+        buffers.append((offset, data))
+        offset += len(data)
+    header["__metadata__"] = dict(metadata or {}, format="flat", version=FLAT_VERSION)
+
+    header_bytes = json.dumps(header).encode("utf-8")
+    header_bytes += b" " * (_aligned(8 + len(header_bytes)) - 8 - len(header_bytes))
+    with open(path, "wb") as writer:
+        writer.write(struct.pack("<Q", len(header_bytes)))
+        writer.write(header_bytes)
+        position = 0
+        for buffer_offset, data in buffers:
+            writer.write(b"\0" * (buffer_offset - position))
+            writer.write(data)
+            position = buffer_offset + len(data)
+
+
+def read_flat_header(path):
+    """ (header, offset of the first buffer in the file) """
+    with open(path, "rb") as reader:
+        header_length = struct.unpack("<Q", reader.read(8))[0]
+        header = json.loads(reader.read(header_length).decode("utf-8"))
+    return header, 8 + header_length
+
+
+def load_flat_state_dict(path):
+    """ OrderedDict of tensors viewing a copy-on-write memory map of the archive (writes stay private to the process) """
+    header, data_start = read_flat_header(path)
+    header.pop("__metadata__", None)
+    with open(path, "rb") as reader:
+        mapped = mmap.mmap(reader.fileno(), 0, access=mmap.ACCESS_COPY)
+    state_dict = OrderedDict()
+    for key, entry in header.items():
+        dtype = np.dtype(FLAT_DTYPES[entry["dtype"]])
+        count = int(np.prod(entry["shape"], dtype=np.int64))
+        array = np.frombuffer(mapped, dtype=dtype, count=count, offset=data_start + entry["offset"])
+        state_dict[key] = torch.from_numpy(array.reshape(entry["shape"]))
+    return state_dict
+
+
+def assign_state_dict(module, state_dict, prefix=''):
+    """
+    Make the parameters and persistent buffers of module the tensors of state_dict themselves instead of
+    copying into them (the load_state_dict counterpart for memory mapped tensors). A tensor of another
+    dtype than the parameter is converted, i.e. copied.
+
+    :return: (missing_keys, unexpected_keys, error_msgs) as collected by PreTrainedModel.from_pretrained
+    """
+    missing_keys, error_msgs, used = [], [], set()
+
+    def assign(module, prefix):
+        tensors = [(name, param, True) for name, param in module._parameters.items() if param is not None]
+        non_persistent = getattr(module, '_non_persistent_buffers_set', ())
+        tensors += [(name, buf, False) for name, buf in module._buffers.items()
+                    if buf is not None and name not in non_persistent]
+        for name, current, is_param in tensors:
+            key = prefix + name
+            if key not in state_dict:
+                missing_keys.append(key)
+                continue
+            used.add(key)
+            value = state_dict[key]
+            if value.shape != current.shape:
+                error_msgs.append('size mismatch for {}: copying a param with shape {} from checkpoint, '
+                                  'the shape in current model is {}.'.format(key, value.shape, current.shape))
+                continue
+            if value.dtype != current.dtype:
+                value = value.to(current.dtype)
+            if is_param:
+                current.data = value
+            else:
+                module._buffers[name] = value
+        for name, child in module._modules.items():
+            if child is not None:
+                assign(child, prefix + name + '.')
+
+    assign(module, prefix)
+    unexpected_keys = [key for key in state_dict if key.startswith(prefix) and key not in used]
+    return missing_keys, unexpected_keys, error_msgs
+
+
+def parse_size(size):
+    """ Bytes of an int or of a string like '200MB', '2GB' """
+    if isinstance(size, int):
+        return size
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([KMG]?B)?\s*$', size.upper())
+    if match is None:
+        raise ValueError("Can't parse the size {}".format(size))
+    return int(float(match.group(1)) * {'B': 1, 'KB': 2 ** 10, 'MB': 2 ** 20, 'GB': 2 ** 30}[match.group(2) or 'B'])
+
+
+def _shard_groups(state_dict, max_shard_size):
+    groups, current, current_size = [], OrderedDict(), 0
+    for key, tensor in state_dict.items():
+        if not isinstance(tensor, torch.Tensor):
+            raise ValueError("Sharded checkpoints only hold tensors, {} is a {}".format(key, type(tensor)))
+        size = tensor.numel() * tensor.element_size()
+        if current and current_size + size > max_shard_size:
+            groups.append(current)
+            current, current_size = OrderedDict(), 0
+        current[key] = tensor
+        current_size += size
+    if current or not groups:
+        groups.append(current)
+    return groups
+
+
+def _shard_files(save_directory):
+    """ Shard file names of save_directory, whichever index (if any) they belong to """
+    prefix, extension = os.path.splitext(SHARDED_INDEX_NAME[:-len(".index.json")])
+    pattern = re.compile(r"^{}-\d{{5}}-of-\d{{5}}{}$".format(re.escape(prefix), re.escape(extension)))
+    return [name for name in os.listdir(save_directory) if pattern.match(name)]
+
+
+def save_sharded_state_dict(state_dict, save_directory, max_shard_size='500MB', metadata=None):
+    """
+    Write state_dict as shards of at most max_shard_size bytes and their index to save_directory, removing the
+    shards of an earlier save that are not part of the new index
+
+    :return: the index
+    """
+    groups = _shard_groups(state_dict, parse_size(max_shard_size))
+    index = {"metadata": dict(metadata or {}, total_size=sum(t.numel() * t.element_size() for t in state_dict.values())),
+             "weight_map": OrderedDict(), "shards": OrderedDict()}
+    prefix, extension = os.path.splitext(SHARDED_INDEX_NAME[:-len(".index.json")])
+    for i, group in enumerate(groups):
+        shard_name = "{}-{:05d}-of-{:05d}{}".format(prefix, i + 1, len(groups), extension)
+        buffer = io.BytesIO()
+        torch.save(group, buffer)
+        data = buffer.getvalue()
+        with open(os.path.join(save_directory, shard_name), "wb") as writer:
+            writer.write(data)
+        index["shards"][shard_name] = {"size": len(data), "sha256": hashlib.sha256(data).hexdigest()}
+        for key in group:
+            index["weight_map"][key] = shard_name
+    with open(os.path.join(save_directory, SHARDED_INDEX_NAME), "w") as writer:
+        writer.write(json.dumps(index, indent=2) + "\n")
+    for name in _shard_files(save_directory):
+        if name not in index["shards"]:
+            os.remove(os.path.join(save_directory, name))
+    return index
+
+
+def file_sha256(path, chunk_size=2 ** 20):
+    """ Hex sha256 of a file, read in chunks """
+    digest = hashlib.sha256()
+    with open(path, "rb") as reader:
+        for chunk in iter(lambda: reader.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_shard_index(index_file):
+    with open(index_file, "r") as reader:
+        return json.loads(reader.read(), object_pairs_hook=OrderedDict)
+
+
+def read_shard(shard_file, size=None, sha256=None):
+    """ State dict of one shard, EnvironmentError if it does not have the size / hash of the index """
+    if size is not None and os.path.getsize(shard_file) != size:
+        raise EnvironmentError("Shard {} is corrupted: {} bytes instead of {}".format(
+            shard_file, os.path.getsize(shard_file), size))
+    with open(shard_file, "rb") as reader:
+        data = reader.read()
+    if sha256 is not None and hashlib.sha256(data).hexdigest() != sha256:
+        raise EnvironmentError("Shard {} is corrupted: its sha256 does not match the index".format(shard_file))
+    return torch.load(io.BytesIO(data), map_location='cpu')
+
+
+def load_sharded_state_dict(module, index_file, prefix='', num_threads=None, verify=True):
+    """
+    Load the shards listed in index_file into the parameters and persistent buffers of module, one thread per shard
+    (at most num_threads, by default the number of CPUs). Works for any nn.Module saved with save_sharded_state_dict.
+
+    :param verify: check every shard against the sha256 of the index, the size is always checked
+    :return: (missing_keys, unexpected_keys, error_msgs) as collected by PreTrainedModel.from_pretrained
+    """
+    index = read_shard_index(index_file)
+    directory = os.path.dirname(index_file)
+    targets = module.state_dict(prefix=prefix, keep_vars=True)
+    missing_keys = [key for key in targets if key not in index["weight_map"]]
+    unexpected_keys = [key for key in index["weight_map"] if key.startswith(prefix) and key not in targets]
+    error_msgs = []
+
+    def load_shard(shard_name):
+        shard = index["shards"][shard_name]
+        state_dict = read_shard(os.path.join(directory, shard_name), shard["size"], shard["sha256"] if verify else None)
+        with torch.no_grad():
+            for key, value in state_dict.items():
+                target = targets.get(key)
+                if target is None:
+                    continue
+                if target.shape != value.shape:
+                    error_msgs.append('size mismatch for {}: copying a param with shape {} from checkpoint, '
+                                      'the shape in current model is {}.'.format(key, value.shape, target.shape))
+                    continue
+                target.copy_(value)
+
+    shard_names = list(index["shards"])
+    num_threads = min(num_threads or os.cpu_count() or 1, len(shard_names)) or 1
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        for _ in executor.map(load_shard, shard_names):
+            pass
+    return missing_keys, unexpected_keys, error_msgs
+
+
+def shard_checkpoint(checkpoint_file, save_directory, max_shard_size='500MB'):
+    """ Re-save a single file checkpoint (a state dict or a whole pickled model such as outputs/*.pt) as shards """
+    checkpoint = torch.load(checkpoint_file, map_location='cpu')
+    state_dict = checkpoint.state_dict() if isinstance(checkpoint, torch.nn.Module) else checkpoint
+    if not os.path.isdir(save_directory):
+        os.makedirs(save_directory)
+    return save_sharded_state_dict(state_dict, save_directory, max_shard_size,
+                                   metadata={"source": os.path.basename(checkpoint_file)})
+
+
+def checkpoint_file(path):
+    """ The weights file of a model directory: the flat archive, the shard index or the pickle, in that order """
+    if not os.path.isdir(path):
+        return path
+    for name in (FLAT_WEIGHTS_NAME, SHARDED_INDEX_NAME, WEIGHTS_NAME):
+        if os.path.isfile(os.path.join(path, name)):
+            return os.path.join(path, name)
+    raise EnvironmentError("No {}, {} or {} in {}".format(FLAT_WEIGHTS_NAME, SHARDED_INDEX_NAME, WEIGHTS_NAME, path))
+
+
+def remove_weights_files(save_directory, keep=()):
+    """
+    Remove the weights files of save_directory in the formats other than keep (file names, the shard / delta index
+    standing for its shards / deltas). from_pretrained prefers the flat archive, then the shard index, then the delta
+    index to the pickle, so a file of an earlier save in another format would shadow the new one.
+    """
+    names = [name for name in (FLAT_WEIGHTS_NAME, SHARDED_INDEX_NAME, DELTA_INDEX_NAME, WEIGHTS_NAME)
+             if name not in keep]
+    if SHARDED_INDEX_NAME not in keep:
+        names.extend(_shard_files(save_directory))
+    if DELTA_INDEX_NAME not in keep:
+        names.append(DELTA_WEIGHTS_NAME)
+    for name in names:
+        if os.path.isfile(os.path.join(save_directory, name)):
+            os.remove(os.path.join(save_directory, name))
+
+
+def iter_checkpoint_tensors(path, keys=None, verify=False):
+    """
+    (key, tensor) of a checkpoint in any of the formats above, holding as little of it in memory as the format allows:
+    a flat archive yields views of its memory map, a sharded checkpoint one shard at a time (only the shards with
+    one of keys), a pickle is loaded whole.
+
+    :param verify: check the shards of a sharded checkpoint against the sha256 of the index, the size is always checked
+    """
+    path = checkpoint_file(path)
+    if path.endswith(".flat"):
+        state_dicts = [load_flat_state_dict(path)]
+    elif path.endswith(".index.json"):
+        index = read_shard_index(path)
+        wanted = None if keys is None else set(index["weight_map"][key] for key in keys if key in index["weight_map"])
+        shard_names = [name for name in index["shards"] if wanted is None or name in wanted]
+        state_dicts = (read_shard(os.path.join(os.path.dirname(path), name), index["shards"][name]["size"],
+                                  index["shards"][name]["sha256"] if verify else None)
+                       for name in shard_names)
+    else:
+        state_dicts = [torch.load(path, map_location='cpu')]
+    for state_dict in state_dicts:
+        for key, tensor in state_dict.items():
+            if keys is None or key in keys:
+                yield key, tensor
+
+
+def _base_key(key, base_keys, base_prefix):
+    # a base saved from another class of the same architecture has the base model prefix or not
+    if key in base_keys:
+        return key
+    if base_prefix + key in base_keys:
+        return base_prefix + key
+    if key.startswith(base_prefix) and key[len(base_prefix):] in base_keys:
+        return key[len(base_prefix):]
+    return None
+
+
+def save_delta_state_dict(state_dict, base_path, save_directory, dtype=None, threshold=None, base_prefix='bert.'):
+    """
+    Write the difference between state_dict and the base checkpoint at base_path
+
+    :param base_path: directory or weights file of the base model, referenced by the delta, not copied
+    :param dtype: e.g. torch.float16 to store the dense deltas and the sparse values in lower precision
+    :param threshold: store only the changes larger than threshold in absolute value, in sparse form where
+                      fewer than half of the entries are left (None keeps every change, dense)
+    :param base_prefix: prefix that may be on the keys of the base or of state_dict but not the other
+    :return: the index
+    """
+    base_file = checkpoint_file(base_path)
+    base = OrderedDict(iter_checkpoint_tensors(base_file))
+    entries, deltas = OrderedDict(), OrderedDict()
+    for key, tensor in state_dict.items():
+        base_key = _base_key(key, base, base_prefix)
+        reference = base[base_key] if base_key is not None else None
+        if reference is None or reference.shape != tensor.shape or not tensor.is_floating_point():
+            entries[key] = {"kind": "full"}
+            deltas[key] = tensor
+            continue
+        delta = tensor.detach().cpu() - reference.to(tensor.dtype)
+        if threshold is not None:
+            delta = delta.masked_fill(delta.abs() <= threshold, 0)
+        nonzero = delta.nonzero(as_tuple=False).size(0) if delta.dim() else int(delta.item() != 0)
+        if nonzero == 0:
+            kind = "same"
+        elif threshold is not None and nonzero < delta.numel() // 2:
+            kind = "sparse"
+            flat = delta.reshape(-1)
+            indices = flat.nonzero(as_tuple=False).reshape(-1)
+            deltas[key] = (indices.int(), flat[indices].to(dtype or delta.dtype))
+        else:
+            kind = "dense"
+            deltas[key] = delta.to(dtype or delta.dtype)
+        entries[key] = {"kind": kind, "base_key": base_key}
+
+    torch.save(deltas, os.path.join(save_directory, DELTA_WEIGHTS_NAME))
+    index = {"base": {"path": os.path.abspath(base_file), "size": os.path.getsize(base_file),
+                      "sha256": file_sha256(base_file)},
+             "entries": entries,
+             "metadata": {"dtype": str(dtype).split('.')[-1] if dtype else None, "threshold": threshold}}
+    with open(os.path.join(save_directory, DELTA_INDEX_NAME), "w") as writer:
+        writer.write(json.dumps(index, indent=2) + "\n")
+    return index
+
+
+def read_delta_index(index_file):
+    with open(index_file, "r") as reader:
+        return json.loads(reader.read(), object_pairs_hook=OrderedDict)
+
+
+def load_delta_state_dict(module, index_file, prefix='', base_path=None, verify=True):
+    """
+    Rebuild the weights of module from the base checkpoint of a delta and the delta itself
+
+    :param base_path: where the base checkpoint is now, defaults to the path recorded at save time
+    :param verify: check the base checkpoint against the sha256 of the index (and the shards of a sharded base
+                   against the hashes of its own index), the size is always checked
+    :return: (missing_keys, unexpected_keys, error_msgs) as collected by PreTrainedModel.from_pretrained
+    """
+    index = read_delta_index(index_file)
+    base_file = checkpoint_file(base_path) if base_path else index["base"]["path"]
+    if not os.path.exists(base_file):
+        raise EnvironmentError("The base checkpoint {} of the delta {} is missing".format(base_file, index_file))
+    if os.path.getsize(base_file) != index["base"]["size"] or (
+            verify and "sha256" in index["base"] and file_sha256(base_file) != index["base"]["sha256"]):
+        raise EnvironmentError("The base checkpoint {} is not the one the delta {} was computed against".format(
+            base_file, index_file))
+
+    targets = module.state_dict(prefix=prefix, keep_vars=True)
+    entries = index["entries"]
+    missing_keys = [key for key in targets if key not in entries]
+    unexpected_keys = [key for key in entries if key.startswith(prefix) and key not in targets]
+    error_msgs = []
+    deltas = torch.load(os.path.join(os.path.dirname(index_file), DELTA_WEIGHTS_NAME), map_location='cpu')
+
+    def check_shape(key, target, value):
+        if target.shape != value.shape:
+            error_msgs.append('size mismatch for {}: copying a param with shape {} from checkpoint, '
+                              'the shape in current model is {}.'.format(key, value.shape, target.shape))
+            return False
+        return True
+
+    keys_of_base = {}
+    for key, entry in entries.items():
+        if key in targets and entry["kind"] != "full":
+            keys_of_base.setdefault(entry["base_key"], []).append(key)
+    with torch.no_grad():
+        for base_key, value in iter_checkpoint_tensors(base_file, set(keys_of_base), verify=verify):
+            for key in keys_of_base.pop(base_key):
+                target = targets[key]
+                if not check_shape(key, target, value):
+                    continue
+                target.copy_(value)
+                kind = entries[key]["kind"]
+                if kind == "dense":
+                    target.add_(deltas[key].to(target.dtype))
+                elif kind == "sparse":
+                    indices, values = deltas[key]
+                    target.view(-1).index_add_(0, indices.long(), values.to(target.dtype))
+        for keys in keys_of_base.values():
+            error_msgs.extend("{} is not in the base checkpoint {}".format(key, base_file) for key in keys)
+        for key, entry in entries.items():
+            if entry["kind"] == "full" and key in targets and check_shape(key, targets[key], deltas[key]):
+                targets[key].copy_(deltas[key])
+    return missing_keys, unexpected_keys, error_msgs
@@ -33,6 +33,13 @@ class AlbertConfig(PretrainedConfig):
             initializer_range: The sttdev of the truncated_normal_initializer for
                 initializing all weight matrices.
             layer_norm_eps: The epsilon used by LayerNorm.
+            attention_chunk_size: If set, self-attention is computed exactly in chunks of this
+                many positions instead of materializing the full attention matrix.
+            num_exit_labels: If set, `AlbertTransformer` gets a linear tag emission head of this
+                size after every layer, used for early exit (see `AlbertModel.forward_early_exit`).
+            halting_threshold: If set, `AlbertTransformer` uses adaptive computation time: every token
+                stops iterating the layers once its accumulated halting probability exceeds this value.
+                The output mixes the states of all the layers, so a pretrained model has to be fine-tuned.
     """
     def __init__(self,
                  vocab_size_or_config_json_file=30000,
@@ -50,6 +57,9 @@ class AlbertConfig(PretrainedConfig):
                  type_vocab_size=2,
                  initializer_range=0.02,
                  layer_norm_eps=1e-12,
+                 attention_chunk_size=None,
+                 num_exit_labels=None,
+                 halting_threshold=None,
                  **kwargs):
         super(AlbertConfig, self).__init__(**kwargs)
         if isinstance(vocab_size_or_config_json_file, str) or (sys.version_info[0] == 2
@@ -71,6 +81,9 @@ class AlbertConfig(PretrainedConfig):
             self.type_vocab_size = type_vocab_size
             self.initializer_range = initializer_range
             self.layer_norm_eps = layer_norm_eps
+            self.attention_chunk_size = attention_chunk_size
+            self.num_exit_labels = num_exit_labels
+            self.halting_threshold = halting_threshold
             self.embedding_size = embedding_size
             self.inner_group_num = inner_group_num
             self.num_hidden_groups = num_hidden_groups
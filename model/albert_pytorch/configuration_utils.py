@@ -45,6 +45,8 @@ class PretrainedConfig(object):
             ``output_attentions``: boolean, default `False`. Should the model returns attentions weights.
             ``output_hidden_states``: string, default `False`. Should the model returns all hidden-states.
             ``torchscript``: string, default `False`. Is the model used with Torchscript.
+            ``pruned_heads``, ``pruned_neurons``: dict, default `{}`. Attention heads / FFN intermediate neurons removed from each layer, re-applied when the model is built.
+            ``quantization``: dict, default `None`. Set by :func:`~pytorch_transformers.PreTrainedModel.quantize`: ``{'dtype': 'qint8', 'modules': ['Linear', ...]}`` of the dynamically quantized layers.
     """
     pretrained_config_archive_map = {}
 
@@ -55,6 +57,8 @@ class PretrainedConfig(object):
         self.output_hidden_states = kwargs.pop('output_hidden_states', False)
         self.torchscript = kwargs.pop('torchscript', False)
         self.pruned_heads = kwargs.pop('pruned_heads', {})
+        self.pruned_neurons = kwargs.pop('pruned_neurons', {})
+        self.quantization = kwargs.pop('quantization', None)
 
     def save_pretrained(self, save_directory):
         """ Save a configuration object to the directory `save_directory`, so that it
@@ -153,6 +157,8 @@ class PretrainedConfig(object):
 
         if hasattr(config, 'pruned_heads'):
             config.pruned_heads = dict((int(key), set(value)) for key, value in config.pruned_heads.items())
+        if hasattr(config, 'pruned_neurons'):
+            config.pruned_neurons = dict((int(key), set(value)) for key, value in config.pruned_neurons.items())
 
         # Update config with kwargs if needed
         to_remove = []
@@ -0,0 +1,95 @@
+"""Convert a TensorFlow BERT / ALBERT checkpoint once into a native PyTorch checkpoint.
+
+The TF variables are mapped with the model's ``load_tf_weights`` function as usual, then saved with
+``save_pretrained`` together with a manifest (``tf_conversion.json``) of the TF variable -> state_dict key
+mapping, the key shapes, the weights file size and the size and mtime of the TF checkpoint files.
+``from_pretrained(..., from_tf=True)`` finds the manifest next to the TF checkpoint and loads the
+converted weights instead as long as neither side changed since, so TensorFlow is only needed on the
+host running the conversion.
+
+    python -m model.albert_pytorch.convert_tf_checkpoint --model_type albert \
+        --tf_checkpoint_path prev_trained_model/albert_base_zh/model.ckpt-best \
+        --config_file prev_trained_model/albert_base_zh/albert_config.json
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import argparse
+import json
+import logging
+import os
+from io import open
+
+from .configuration_albert import AlbertConfig
+from .configuration_bert import BertConfig
+from .file_utils import WEIGHTS_NAME, TF_CONVERSION_NAME
+from .modeling_utils import tf_checkpoint_files
+from . import modeling_albert, modeling_albert_bright, modeling_bert
+
+logger = logging.getLogger(__name__)
+
+MODEL_CLASSES = {
+    'albert': (AlbertConfig, modeling_albert.AlbertForPreTraining),
+    'albert_bright': (AlbertConfig, modeling_albert_bright.AlbertForPreTraining),
+    'bert': (BertConfig, modeling_bert.BertForPreTraining),
+}
+
+
+def convert_tf_checkpoint(tf_checkpoint_path, config_file, model_type='albert', output_dir=None):
+    """
+    :param tf_checkpoint_path: the TF checkpoint, as load_tf_weights of the model type expects it
+    :param config_file: json config of the model
+    :param output_dir: where to write the converted checkpoint, defaults to the directory of the TF checkpoint
+                       so that from_pretrained(..., from_tf=True) picks it up
+    :return: the manifest
+    """
+    config_class, model_class = MODEL_CLASSES[model_type]
+    if tf_checkpoint_path.endswith(".index"):
+        tf_checkpoint_path = tf_checkpoint_path[:-6]
+    is_dir = os.path.isdir(tf_checkpoint_path)
+    if output_dir is None:
+        output_dir = tf_checkpoint_path if is_dir else os.path.dirname(os.path.abspath(tf_checkpoint_path))
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    config = config_class.from_json_file(config_file)
+    model = model_class(config)
+    key_map = {}
+    model_class.load_tf_weights(model, config, tf_checkpoint_path, key_map=key_map)
+    state_dict = model.state_dict()
+    mapped = set(key_map.values())
+    unmapped = [key for key, _ in model.named_parameters() if key not in mapped]
+    if unmapped:
+        logger.warning("Weights of {} not found in the TF checkpoint, left at their initialization: {}".format(
+            model_class.__name__, unmapped))
+    model.save_pretrained(output_dir)
+
+    manifest = {
+        "tf_checkpoint": "" if is_dir else os.path.basename(tf_checkpoint_path),
+        "model_type": model_type,
+        "model_class": model_class.__name__,
+        "weights_name": WEIGHTS_NAME,
+        "weights_size": os.path.getsize(os.path.join(output_dir, WEIGHTS_NAME)),
+        "tf_files": tf_checkpoint_files(tf_checkpoint_path),
+        "variables": key_map,
+        "shapes": dict((key, list(value.shape)) for key, value in state_dict.items()),
+    }
+    with open(os.path.join(output_dir, TF_CONVERSION_NAME), "w", encoding="utf-8") as writer:
+        writer.write(json.dumps(manifest, indent=2, sort_keys=True) + "\n")
+    logger.info("Converted {} TF variables of {} into {}".format(len(key_map), tf_checkpoint_path, output_dir))
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tf_checkpoint_path", required=True, type=str)
+    parser.add_argument("--config_file", required=True, type=str)
+    parser.add_argument("--model_type", default="albert", choices=list(MODEL_CLASSES))
+    parser.add_argument("--output_dir", default=None, type=str,
+                        help="Defaults to the directory of the TF checkpoint.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    convert_tf_checkpoint(args.tf_checkpoint_path, args.config_file, args.model_type, args.output_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -49,8 +49,15 @@ except (AttributeError, ImportError):
 PYTORCH_TRANSFORMERS_CACHE = PYTORCH_PRETRAINED_BERT_CACHE  # Kept for backward compatibility
 
 WEIGHTS_NAME = "pytorch_model.bin"
+FLAT_WEIGHTS_NAME = "pytorch_model.flat"
+SHARDED_INDEX_NAME = "pytorch_model.bin.index.json"
+DELTA_INDEX_NAME = "delta_index.json"
+DELTA_WEIGHTS_NAME = "delta_model.bin"
+ADAPTER_CONFIG_NAME = "adapter_config.json"
+ADAPTER_WEIGHTS_NAME = "adapter_model.bin"
 TF_WEIGHTS_NAME = 'model.ckpt'
 CONFIG_NAME = "config.json"
+TF_CONVERSION_NAME = "tf_conversion.json"
 
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
@@ -7,7 +7,9 @@ import sys
 import torch
 from torch import nn
 from torch.nn import CrossEntropyLoss, MSELoss
-from .modeling_utils import PreTrainedModel, prune_linear_layer
+from .modeling_utils import PreTrainedModel, prune_linear_layer, kept_index, mkldnn_available, prepack_linear_layers
+from ..bert_pytorch.attention.chunked import chunked_attention
+from ..bert_pytorch.early_exit import EarlyExitHeads, exit_confidence
 from .configuration_albert import AlbertConfig
 from .file_utils import add_start_docstrings
 logger = logging.getLogger(__name__)
@@ -18,8 +20,9 @@ ALBERT_PRETRAINED_MODEL_ARCHIVE_MAP = {
     'albert-xlarge': "",
     'albert-xxlarge': "",
 }
-def load_tf_weights_in_albert(model, config, tf_checkpoint_path):
+def load_tf_weights_in_albert(model, config, tf_checkpoint_path, key_map=None):
     """ Load tf checkpoints in a pytorch model.
+        key_map, if given, is filled with {TF variable name: state_dict key} of every loaded variable.
     """
     try:
         import re
@@ -42,6 +45,7 @@ def load_tf_weights_in_albert(model, config, tf_checkpoint_path):
         array = tf.train.load_variable(tf_path, name)
         names.append(name)
         arrays.append(array)
+    param_names = dict((id(param), key) for key, param in model.named_parameters()) if key_map is not None else {}
     for name, array in zip(names, arrays):
         name = name.replace("attention_1","attention")
         name = name.replace("ffn_1","ffn")
@@ -90,6 +94,8 @@ def load_tf_weights_in_albert(model, config, tf_checkpoint_path):
             raise
         logger.info("Initialize PyTorch weight {}".format(name))
         pointer.data = torch.from_numpy(array)
+        if id(pointer) in param_names:
+            key_map["/".join(name)] = param_names[id(pointer)]
     return model
 
 def gelu(x):
@@ -123,6 +129,9 @@ class AlbertEmbeddings(nn.Module):
         # self.LayerNorm is not snake-cased to stick with TensorFlow model variable name and be able to load
         self.LayerNorm = AlbertLayerNorm(config.embedding_size, eps=config.layer_norm_eps)
         self.dropout = nn.Dropout(config.hidden_dropout_prob)
+        # inference tables of precompute(), derived from the weights so never saved
+        for name in ('word_table', 'position_table', 'token_type_table', 'table_bias'):
+            self.register_buffer(name, None, persistent=False)
 
     def forward(self, input_ids, token_type_ids=None, position_ids=None):
         seq_length = input_ids.size(1)
@@ -135,10 +144,43 @@ class AlbertEmbeddings(nn.Module):
         position_embeddings = self.position_embeddings(position_ids)
         token_type_embeddings = self.token_type_embeddings(token_type_ids)
         embeddings = words_embeddings + position_embeddings + token_type_embeddings
+        if self.word_table is not None and not self.training:
+            return self.forward_precomputed(embeddings, input_ids, token_type_ids, position_ids)
         embeddings = self.LayerNorm(embeddings)
         embeddings = self.dropout(embeddings)
         return embeddings
 
+    def precompute(self, mapping=None, dtype=None):
+        """ Fold the LayerNorm and the following `mapping` (embedding_hidden_mapping_in) into tables.
+            LayerNorm(w + p + t) mapped by W, b is W diag(gamma) (c(w) + c(p) + c(t)) / std + W beta + b
+            with c() the centering over embedding_size, so W diag(gamma) c() of every word, position and
+            token type is computed once. Only the std of every token still needs the embedding_size sum.
+            The output is then already hidden_size. Exact, up to `dtype` (e.g. torch.float16 halves the tables).
+        """
+        with torch.no_grad():
+            weight, bias = self.LayerNorm.weight, self.LayerNorm.bias
+            if mapping is not None:
+                mapping_weight = mapping.weight.to_dense() if mapping.weight.is_mkldnn else mapping.weight
+                mapping_bias = mapping.bias.to_dense() if mapping.bias.is_mkldnn else mapping.bias
+                bias = torch.mv(mapping_weight, bias) + mapping_bias
+                weight = mapping_weight * weight
+            else:
+                weight = torch.diag(weight)
+            for name, embedding in (('word_table', self.word_embeddings), ('position_table', self.position_embeddings),
+                                    ('token_type_table', self.token_type_embeddings)):
+                centered = embedding.weight - embedding.weight.mean(-1, keepdim=True)
+                setattr(self, name, torch.matmul(centered, weight.t()).to(dtype or centered.dtype))
+            self.table_bias = bias.clone()
+
+    def clear_precomputed(self):
+        self.word_table = self.position_table = self.token_type_table = self.table_bias = None
+
+    def forward_precomputed(self, embeddings, input_ids, token_type_ids, position_ids):
+        # embeddings is the embedding_size sum, only its variance is used
+        variance = embeddings.var(-1, unbiased=False, keepdim=True)
+        hidden = self.word_table[input_ids] + self.position_table[position_ids] + self.token_type_table[token_type_ids]
+        return hidden.to(embeddings.dtype) * torch.rsqrt(variance + self.LayerNorm.eps) + self.table_bias
+
 class AlbertSelfAttention(nn.Module):
     def __init__(self, config):
         super(AlbertSelfAttention, self).__init__()
@@ -154,14 +196,16 @@ class AlbertSelfAttention(nn.Module):
         self.key = nn.Linear(config.hidden_size, self.all_head_size)
         self.value = nn.Linear(config.hidden_size, self.all_head_size)
         self.dropout = nn.Dropout(config.attention_probs_dropout_prob)
+        self.chunk_size = getattr(config, 'attention_chunk_size', None)
 
     def transpose_for_scores(self, x):
         new_x_shape = x.size()[:-1] + (self.num_attention_heads, self.attention_head_size)
         x = x.view(*new_x_shape)
         return x.permute(0, 2, 1, 3)
 
-    def forward(self, hidden_states, attention_mask=None, head_mask=None):
-        mixed_query_layer = self.query(hidden_states)
+    def forward(self, hidden_states, attention_mask=None, head_mask=None, query_states=None):
+        # query_states: only these tokens attend (to all of hidden_states), e.g. the running tokens of halting
+        mixed_query_layer = self.query(hidden_states if query_states is None else query_states)
         mixed_key_layer = self.key(hidden_states)
         mixed_value_layer = self.value(hidden_states)
 
@@ -169,6 +213,17 @@ class AlbertSelfAttention(nn.Module):
         key_layer = self.transpose_for_scores(mixed_key_layer)
         value_layer = self.transpose_for_scores(mixed_value_layer)
 
+        if self.chunk_size and not self.output_attentions:
+            # Exact attention without the (seq_length x seq_length) scores, see chunked_attention
+            dropout_p = self.dropout.p if self.training else 0.0
+            context_layer = chunked_attention(query_layer, key_layer, value_layer, bias=attention_mask,
+                                              chunk_size=self.chunk_size, dropout_p=dropout_p)
+            if head_mask is not None:
+                context_layer = context_layer * head_mask
+            context_layer = context_layer.permute(0, 2, 1, 3).contiguous()
+            new_context_layer_shape = context_layer.size()[:-2] + (self.all_head_size,)
+            return (context_layer.view(*new_context_layer_shape),)
+
         # Take the dot product between "query" and "key" to get the raw attention scores.
         attention_scores = torch.matmul(query_layer, key_layer.transpose(-1, -2))
         attention_scores = attention_scores / math.sqrt(self.attention_head_size)
@@ -235,10 +290,10 @@ class AlbertAttention(nn.Module):
         self.self.all_head_size = self.self.attention_head_size * self.self.num_attention_heads
         self.pruned_heads = self.pruned_heads.union(heads)
 
-    def forward(self, input_tensor, attention_mask=None, head_mask=None):
-        self_outputs = self.self(input_tensor, attention_mask, head_mask)
-        attention_output = self.output(self_outputs[0], input_tensor)
-        outputs = (attention_output,self_outputs)
+    def forward(self, input_tensor, attention_mask=None, head_mask=None, query_states=None):
+        self_outputs = self.self(input_tensor, attention_mask, head_mask, query_states)
+        attention_output = self.output(self_outputs[0], input_tensor if query_states is None else query_states)
+        outputs = (attention_output,) + self_outputs[1:]  # add attentions if we output them
         return outputs
 
 class AlbertOutput(nn.Module):
@@ -257,6 +312,7 @@ class AlbertIntermediate(nn.Module):
         super(AlbertIntermediate, self).__init__()
         self.dense = nn.Linear(config.hidden_size, config.intermediate_size)
         self.output = AlbertOutput(config)
+        self.pruned_neurons = set()
         if isinstance(config.hidden_act, str) or (sys.version_info[0] == 2 and isinstance(config.hidden_act, unicode)):
             self.intermediate_act_fn = ACT2FN[config.hidden_act]
         else:
@@ -268,6 +324,15 @@ class AlbertIntermediate(nn.Module):
         output = self.output(intermediate_output)
         return output
 
+    def prune_neurons(self, neurons):
+        neurons = set(neurons) - self.pruned_neurons  # indices in the unpruned layer
+        if len(neurons) == 0:
+            return
+        index = kept_index(self.dense.out_features, self.pruned_neurons, neurons)
+        self.dense = prune_linear_layer(self.dense, index)
+        self.output.dense = prune_linear_layer(self.output.dense, index, dim=1)
+        self.pruned_neurons = self.pruned_neurons.union(neurons)
+
 class AlbertFFN(nn.Module):
     def __init__(self, config):
         super(AlbertFFN, self).__init__()
@@ -285,9 +350,11 @@ class AlbertLayer(nn.Module):
         self.LayerNorm = AlbertLayerNorm(config.hidden_size, eps=config.layer_norm_eps)
         self.LayerNorm_1 = AlbertLayerNorm(config.hidden_size, eps=config.layer_norm_eps)
 
-    def forward(self, hidden_states, attention_mask=None, head_mask=None):
-        attention_outputs = self.attention(hidden_states, attention_mask, head_mask)
-        attention_output = self.LayerNorm(attention_outputs[0] + hidden_states)
+    def forward(self, hidden_states, attention_mask=None, head_mask=None, query_states=None):
+        """ query_states: compute the output of these tokens only, hidden_states still give the keys and values """
+        attention_outputs = self.attention(hidden_states, attention_mask, head_mask, query_states)
+        residual = hidden_states if query_states is None else query_states
+        attention_output = self.LayerNorm(attention_outputs[0] + residual)
         ffn_output = self.ffn(attention_output)
         ffn_output = self.LayerNorm_1(ffn_output+attention_output)
         outputs = (ffn_output,) + attention_outputs[1:] # add attentions if we output them
@@ -296,19 +363,41 @@ class AlbertLayer(nn.Module):
 class AlbertGroup(nn.Module):
     def __init__(self, config):
         super(AlbertGroup, self).__init__()
+        self.output_attentions = config.output_attentions
+        self.output_hidden_states = config.output_hidden_states
         self.inner_group_num = config.inner_group_num
         self.inner_group = nn.ModuleList([AlbertLayer(config) for _ in range(config.inner_group_num)])
 
     def forward(self, hidden_states, attention_mask, head_mask):
+        # Only the running hidden state is kept unless intermediate outputs are requested
         layer_attentions = ()
         layer_hidden_states = ()
-        for inner_group_idx in range(self.inner_group_num):
-            layer_module = self.inner_group[inner_group_idx]
+        for layer_module in self.inner_group:
             layer_outputs = layer_module(hidden_states, attention_mask, head_mask)
             hidden_states = layer_outputs[0]
-            layer_attentions = layer_attentions + (layer_outputs[1],)
-            layer_hidden_states = layer_hidden_states + (hidden_states,)
-        return (layer_hidden_states, layer_attentions)
+            if self.output_attentions:
+                layer_attentions = layer_attentions + (layer_outputs[1],)
+            if self.output_hidden_states:
+                layer_hidden_states = layer_hidden_states + (hidden_states,)
+        outputs = (hidden_states,)
+        if self.output_hidden_states:
+            outputs = outputs + (layer_hidden_states,)
+        if self.output_attentions:
+            outputs = outputs + (layer_attentions,)
+        return outputs  # last hidden state, (hidden state of every inner layer), (attentions of every inner layer)
+
+class AlbertHalting(nn.Module):
+    """ Per-token halting probability of adaptive computation time over the shared layers. """
+    def __init__(self, config):
+        super(AlbertHalting, self).__init__()
+        self.dense = nn.Linear(config.hidden_size, 1)
+        # sigmoid(-3) * num_hidden_layers stays below the threshold: a pretrained model starts out at full depth.
+        # Its output is still the halting-weighted mix of all its layers (about 0.047 each, the remainder on the
+        # last one), not the last layer, so the model has to be fine-tuned with the halting unit.
+        self.initial_bias = -3.0
+
+    def forward(self, hidden_states):
+        return torch.sigmoid(self.dense(hidden_states)).squeeze(-1)
 
 class AlbertTransformer(nn.Module):
     def __init__(self, config):
@@ -318,27 +407,168 @@ class AlbertTransformer(nn.Module):
         self.num_hidden_layers = config.num_hidden_layers
         self.num_hidden_groups = config.num_hidden_groups
         self.group = nn.ModuleList([AlbertGroup(config) for _ in range(config.num_hidden_groups)])
+        num_exit_labels = getattr(config, 'num_exit_labels', None)
+        self.exit_heads = EarlyExitHeads(config.hidden_size, num_exit_labels,
+                                         config.num_hidden_layers) if num_exit_labels else None
+        self.halting_threshold = getattr(config, 'halting_threshold', None)
+        self.halting = AlbertHalting(config) if self.halting_threshold is not None else None
+        if self.halting is not None and self.exit_heads is not None:
+            raise ValueError("Early exit heads and halting are alternative ways to adapt the depth, set only one of "
+                             "config.num_exit_labels and config.halting_threshold")
 
     def forward(self, hidden_states, attention_mask, head_mask):
+        if self.halting is not None:
+            return self.forward_halting(hidden_states, attention_mask, head_mask)
+        return self.forward_layers(hidden_states, attention_mask, head_mask)
+
+    def forward_layers(self, hidden_states, attention_mask, head_mask):
         all_hidden_states = ()
         all_attentions = ()
+        all_exit_logits = ()
         for layer_idx in range(self.num_hidden_layers):
             if self.output_hidden_states and layer_idx == 0:
                 all_hidden_states = all_hidden_states + (hidden_states,)
             group_idx = int(layer_idx / self.num_hidden_layers * self.num_hidden_groups)
             layer_module = self.group[group_idx]
             layer_outputs = layer_module(hidden_states, attention_mask, head_mask[layer_idx])
-            hidden_states = layer_outputs[0][-1]
+            hidden_states = layer_outputs[0]
             if self.output_attentions:
-                all_attentions = all_attentions + layer_outputs[1]
+                all_attentions = all_attentions + layer_outputs[-1]
             if self.output_hidden_states:
-                all_hidden_states = all_hidden_states + layer_outputs[0]
+                all_hidden_states = all_hidden_states + layer_outputs[1]
+            if self.exit_heads is not None:
+                all_exit_logits = all_exit_logits + (self.exit_heads(hidden_states, layer_idx),)
         outputs = (hidden_states,)
         if self.output_hidden_states:
             outputs = outputs + (all_hidden_states,)
         if self.output_attentions:
             outputs = outputs + (all_attentions,)
-        return outputs  # last-layer hidden state, (all hidden states), (all attentions)
+        if self.exit_heads is not None:
+            outputs = outputs + (all_exit_logits,)
+        return outputs  # last-layer hidden state, (all hidden states), (all attentions), (exit logits)
+
+    def forward_early_exit(self, hidden_states, attention_mask, head_mask, token_mask,
+                           threshold=0.9, criterion='max_prob', per_sample=True, crf=None):
+        """ Runs the layers until the exit head of the current layer is confident enough.
+            Samples that exit are dropped from the batch when per_sample is True,
+            otherwise the whole batch stops once every sample is confident.
+            Returns (hidden states at the exit layer, exit head emissions, number of layers run per sample).
+        """
+        if self.exit_heads is None:
+            raise ValueError("The model has no exit heads, set config.num_exit_labels")
+
+        batch_size = hidden_states.size(0)
+        exit_hidden_states = torch.zeros_like(hidden_states)
+        exit_logits = hidden_states.new_zeros(batch_size, hidden_states.size(1), self.exit_heads.num_tags)
+        exit_layers = token_mask.new_full((batch_size,), self.num_hidden_layers, dtype=torch.long)
+        active = torch.arange(batch_size, device=hidden_states.device)
+
+        for layer_idx in range(self.num_hidden_layers):
+            group_idx = int(layer_idx / self.num_hidden_layers * self.num_hidden_groups)
+            layer_outputs = self.group[group_idx](hidden_states, attention_mask, head_mask[layer_idx])
+            hidden_states = layer_outputs[0]
+            logits = self.exit_heads(hidden_states, layer_idx)
+
+            if layer_idx == self.num_hidden_layers - 1:
+                done = torch.ones_like(active, dtype=torch.bool)
+            else:
+                done = exit_confidence(logits, token_mask, criterion, crf) >= threshold
+                if not per_sample:
+                    done = done.all().expand_as(done)
+            if not done.any():
+                continue
+
+            exited = active[done]
+            exit_hidden_states[exited] = hidden_states[done]
+            exit_logits[exited] = logits[done]
+            exit_layers[exited] = layer_idx + 1
+
+            keep = ~done
+            if not keep.any():
+                break
+            active, hidden_states = active[keep], hidden_states[keep]
+            attention_mask, token_mask = attention_mask[keep], token_mask[keep]
+
+        return exit_hidden_states, exit_logits, exit_layers
+
+    def forward_halting(self, hidden_states, attention_mask, head_mask):
+        """ Adaptive computation time over the layer loop (ACT as in the Universal Transformer).
+            At every step each running token emits a halting probability; once its running sum would pass
+            halting_threshold the token halts, spends the remainder as its last weight and its hidden state stops
+            changing. The output of a token is the halting-weighted mix of its states. Every layer only runs the
+            running tokens, packed first in each sample: their queries attend to the keys / values of all the
+            tokens (the halted ones frozen), the attention output and FFN are computed for them alone. Samples
+            whose tokens all halted leave the batch, so the compute follows the difficulty of every token.
+            Returns (output, (ponder_cost, n_updates)): ponder_cost is the mean of n_updates + remainders over
+            the tokens, to be added to the training loss with a small weight, n_updates the number of layers
+            every token used.
+        """
+        batch_size, seq_length = hidden_states.shape[:2]
+        dtype = hidden_states.dtype
+        # padding starts halted, attention_mask is 0 for tokens and -10000 for padding
+        token_mask = attention_mask.view(batch_size, seq_length) == 0
+        valid_tokens = token_mask.to(dtype)
+
+        outputs = hidden_states.clone()
+        out_updates = hidden_states.new_zeros(batch_size, seq_length)
+        out_remainders = hidden_states.new_zeros(batch_size, seq_length)
+
+        halted = ~token_mask
+        halting_prob = hidden_states.new_zeros(batch_size, seq_length)
+        remainders = hidden_states.new_zeros(batch_size, seq_length)
+        n_updates = hidden_states.new_zeros(batch_size, seq_length)
+        state = torch.zeros_like(hidden_states)
+        active = torch.arange(batch_size, device=hidden_states.device)
+        positions = torch.arange(seq_length, device=hidden_states.device)
+
+        for layer_idx in range(self.num_hidden_layers):
+            p = self.halting(hidden_states)
+            running = (~halted).to(dtype)
+            if layer_idx == self.num_hidden_layers - 1:
+                new_halted = running
+            else:
+                new_halted = ((halting_prob + p * running) > self.halting_threshold).to(dtype) * running
+            still_running = running - new_halted
+
+            halting_prob = halting_prob + p * still_running
+            remainders = remainders + new_halted * (1 - halting_prob)
+            halting_prob = halting_prob + new_halted * remainders
+            n_updates = n_updates + running
+            update_weights = (p * still_running + new_halted * remainders).unsqueeze(-1)
+
+            # the running tokens of every sample first, in order; the slots past a sample's running tokens hold
+            # halted tokens, written back unchanged
+            num_running = (~halted).sum(dim=1)
+            order = torch.sort(halted.long() * seq_length + positions, dim=1)[1][:, :int(num_running.max())]
+            query_index = order.unsqueeze(-1).expand(-1, -1, hidden_states.size(-1))
+            query_valid = (positions[:order.size(1)] < num_running.unsqueeze(1)).unsqueeze(-1)
+            group_idx = int(layer_idx / self.num_hidden_layers * self.num_hidden_groups)
+            for layer_module in self.group[group_idx].inner_group:
+                query_states = hidden_states.gather(1, query_index)
+                layer_output = layer_module(hidden_states, attention_mask, head_mask[layer_idx],
+                                            query_states=query_states)[0]
+                hidden_states = hidden_states.scatter(1, query_index,
+                                                      torch.where(query_valid, layer_output, query_states))
+            state = hidden_states * update_weights + state * (1 - update_weights)
+            halted = halted | (new_halted > 0)
+
+            done = halted.all(dim=1)
+            if not done.any():
+                continue
+            finished = active[done]
+            outputs[finished] = torch.where(token_mask[done].unsqueeze(-1), state[done], hidden_states[done])
+            out_updates[finished] = n_updates[done]
+            out_remainders[finished] = remainders[done]
+
+            keep = ~done
+            if not keep.any():
+                break
+            active, hidden_states, state = active[keep], hidden_states[keep], state[keep]
+            attention_mask, token_mask, halted = attention_mask[keep], token_mask[keep], halted[keep]
+            halting_prob, remainders, n_updates = halting_prob[keep], remainders[keep], n_updates[keep]
+
+        ponder_cost = ((out_updates + out_remainders) * valid_tokens).sum() / valid_tokens.sum()
+        return outputs, (ponder_cost, out_updates)
 
 class AlbertEncoder(nn.Module):
     def __init__(self, config):
@@ -449,6 +679,8 @@ class AlbertPreTrainedModel(PreTrainedModel):
             module.weight.data.fill_(1.0)
         if isinstance(module, nn.Linear) and module.bias is not None:
             module.bias.data.zero_()
+        if isinstance(module, AlbertHalting):
+            module.dense.bias.data.fill_(module.initial_bias)
 
 
 ALBERT_START_DOCSTRING = r"""    The ALBERT model was proposed in
@@ -514,6 +746,7 @@ class AlbertModel(AlbertPreTrainedModel):
             objective during Bert pretraining. This output is usually *not* a good summary
             of the semantic content of the input, you're often better with averaging or pooling
             the sequence of hidden-states for the whole input sequence.
+            ``None`` when the model is built with ``add_pooling_layer=False``.
         **hidden_states**: (`optional`, returned when ``config.output_hidden_states=True``)
             list of ``torch.FloatTensor`` (one for the output of each layer + the output of the embeddings)
             of shape ``(batch_size, sequence_length, hidden_size)``:
@@ -521,6 +754,12 @@ class AlbertModel(AlbertPreTrainedModel):
         **attentions**: (`optional`, returned when ``config.output_attentions=True``)
             list of ``torch.FloatTensor`` (one for each layer) of shape ``(batch_size, num_heads, sequence_length, sequence_length)``:
             Attentions weights after the attention softmax, used to compute the weighted average in the self-attention heads.
+        **exit_logits**: (`optional`, returned when ``config.num_exit_labels`` is set)
+            list of ``torch.FloatTensor`` (one for each layer) of shape ``(batch_size, sequence_length, num_exit_labels)``:
+            Tag emissions of the per-layer early exit heads, train them with ``early_exit_loss``.
+        **halting**: (`returned instead of hidden_states and attentions when ``config.halting_threshold`` is set`)
+            ``(ponder_cost, n_updates)``: scalar ponder cost to add to the loss with a small weight and
+            ``torch.FloatTensor`` of shape ``(batch_size, sequence_length)`` with the number of layers each token used.
     Examples::
         tokenizer = BertTokenizer.from_pretrained('bert-base-uncased')
         model = BertModel.from_pretrained('bert-base-uncased')
@@ -529,12 +768,13 @@ class AlbertModel(AlbertPreTrainedModel):
         last_hidden_states = outputs[0]  # The last hidden-state is the first element of the output tuple
     """
 
-    def __init__(self, config):
+    def __init__(self, config, add_pooling_layer=True):
         super(AlbertModel, self).__init__(config)
 
         self.embeddings = AlbertEmbeddings(config)
         self.encoder = AlbertEncoder(config)
-        self.pooler = AlbertPooler(config)
+        # token level heads never use the pooler, leave it out so it has no parameters to train or load
+        self.pooler = AlbertPooler(config) if add_pooling_layer else None
 
         self.init_weights()
 
@@ -542,15 +782,71 @@ class AlbertModel(AlbertPreTrainedModel):
         old_embeddings = self.embeddings.word_embeddings
         new_embeddings = self._get_resized_embeddings(old_embeddings, new_num_tokens)
         self.embeddings.word_embeddings = new_embeddings
+        self.embeddings.clear_precomputed()  # the tables no longer match the vocabulary
         return self.embeddings.word_embeddings
 
+    def prepare_for_inference(self, prepack=True):
+        """ Put the model in evaluation mode and, with prepack and a torch build with oneDNN (mkldnn),
+            reorder the Linear weights of the shared layers and of embedding_hidden_mapping_in once
+            into the blocked layout, so the 12 applications of the shared layer and every batch reuse them.
+            Falls back to the regular Linear layers (and returns False) when oneDNN is unavailable or
+            the weights are not float32 on the CPU. The prepacked model is inference only, rebuild it
+            with from_pretrained to train again.
+        """
+        self.eval()
+        if not prepack:
+            return False
+        if not mkldnn_available():
+            logger.info("oneDNN (mkldnn) is not available in this torch build, keeping the dense Linear layers")
+            return False
+        replaced = prepack_linear_layers(self.encoder)
+        logger.info("Prepacked %d Linear layers of the encoder", replaced)
+        return replaced > 0
+
+    def precompute_embeddings(self, enabled=True, dtype=None):
+        """ Memory for speed at inference: fold the embedding LayerNorm and embedding_hidden_mapping_in into
+            vocab_size x hidden_size tables (see AlbertEmbeddings.precompute), so no token goes through the
+            embedding_size -> hidden_size projection any more. The tables hold (vocab_size + max_position_embeddings
+            + type_vocab_size) x hidden_size values on top of the weights, about 62MB for 21128 x 768 in float32,
+            half of it with dtype=torch.float16. They are only used in eval mode and must be recomputed (call this
+            again) after the weights change. enabled=False drops them.
+        """
+        if not enabled:
+            self.embeddings.clear_precomputed()
+            return
+        mapping = self.encoder.embedding_hidden_mapping_in
+        self.embeddings.precompute(mapping if self.encoder.embedding_size != self.encoder.hidden_size else None, dtype)
+
+    def _embed(self, input_ids, token_type_ids=None, position_ids=None):
+        # hidden_size input of the transformer
+        embedding_output = self.embeddings(input_ids, position_ids=position_ids, token_type_ids=token_type_ids)
+        if self.embeddings.word_table is not None and not self.training:
+            return embedding_output  # the mapping is folded into the precomputed tables
+        if self.encoder.embedding_size != self.encoder.hidden_size:
+            embedding_output = self.encoder.embedding_hidden_mapping_in(embedding_output)
+        return embedding_output
+
+    def prunable_layers(self):
+        """ The distinct (shared) layers, layer_num in pruning is group_idx * config.inner_group_num + inner_idx """
+        return [layer for group in self.encoder.transformer.group for layer in group.inner_group]
+
     def _prune_heads(self, heads_to_prune):
         """ Prunes heads of the model.
             heads_to_prune: dict of {layer_num: list of heads to prune in this layer}
             See base class PreTrainedModel
         """
+        layers = self.prunable_layers()
         for layer, heads in heads_to_prune.items():
-            self.encoder.layer[layer].attention.prune_heads(heads)
+            layers[layer].attention.prune_heads(heads)
+
+    def _prune_neurons(self, neurons_to_prune):
+        """ Prunes intermediate neurons of the model.
+            neurons_to_prune: dict of {layer_num: list of neurons to prune in this layer}
+            See base class PreTrainedModel
+        """
+        layers = self.prunable_layers()
+        for layer, neurons in neurons_to_prune.items():
+            layers[layer].ffn.intermediate.prune_neurons(neurons)
 
     def forward(self, input_ids, attention_mask=None, token_type_ids=None, position_ids=None, head_mask=None):
         if attention_mask is None:
@@ -590,16 +886,39 @@ class AlbertModel(AlbertPreTrainedModel):
         else:
             head_mask = [None] * self.config.num_hidden_layers
 
-        embedding_output = self.embeddings(input_ids, position_ids=position_ids, token_type_ids=token_type_ids)
-        encoder_outputs = self.encoder(embedding_output,
-                                       extended_attention_mask,
-                                       head_mask=head_mask)
+        embedding_output = self._embed(input_ids, position_ids=position_ids, token_type_ids=token_type_ids)
+        encoder_outputs = self.encoder.transformer(embedding_output,
+                                                   extended_attention_mask,
+                                                   head_mask)
         sequence_output = encoder_outputs[0]
-        pooled_output = self.pooler(sequence_output)
+        pooled_output = self.pooler(sequence_output) if self.pooler is not None else None
 
         outputs = (sequence_output, pooled_output,) + encoder_outputs[
                                                       1:]  # add hidden_states and attentions if they are here
-        return outputs  # sequence_output, pooled_output, (hidden_states), (attentions)
+        return outputs  # sequence_output, pooled_output, (hidden_states), (attentions), (exit logits)
+
+    def forward_early_exit(self, input_ids, attention_mask=None, token_type_ids=None, position_ids=None,
+                           threshold=0.9, criterion='max_prob', per_sample=True, crf=None):
+        """ Inference with early exit: the layer loop stops once the per-layer exit head is confident.
+            Needs ``config.num_exit_labels``. ``criterion`` is ``'max_prob'`` (max tag posterior) or ``'entropy'``
+            (normalized posterior entropy), the least confident token of a sample decides; pass ``crf`` to use its
+            marginals as posteriors.
+            Returns (sequence_output at the exit layer, exit head emissions, number of layers run per sample).
+        """
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+        if token_type_ids is None:
+            token_type_ids = torch.zeros_like(input_ids)
+
+        extended_attention_mask = attention_mask.unsqueeze(1).unsqueeze(2)
+        extended_attention_mask = extended_attention_mask.to(dtype=next(self.parameters()).dtype)  # fp16 compatibility
+        extended_attention_mask = (1.0 - extended_attention_mask) * -10000.0
+        head_mask = [None] * self.config.num_hidden_layers
+
+        embedding_output = self._embed(input_ids, position_ids=position_ids, token_type_ids=token_type_ids)
+        return self.encoder.transformer.forward_early_exit(embedding_output, extended_attention_mask, head_mask,
+                                                           attention_mask > 0, threshold=threshold,
+                                                           criterion=criterion, per_sample=per_sample, crf=crf)
 
 @add_start_docstrings("""Bert Model with two heads on top as done during the pre-training:
     a `masked language modeling` head and a `next sentence prediction (classification)` head. """,
@@ -965,11 +1284,12 @@ class AlbertForTokenClassification(AlbertPreTrainedModel):
         loss, scores = outputs[:2]
     """
 
-    def __init__(self, config):
+    def __init__(self, config, add_pooling_layer=True):
         super(AlbertForTokenClassification, self).__init__(config)
         self.num_labels = config.num_labels
 
-        self.bert = AlbertModel(config)
+        # the head does not use the pooler, add_pooling_layer=False (also through from_pretrained) skips it
+        self.bert = AlbertModel(config, add_pooling_layer=add_pooling_layer)
         self.dropout = nn.Dropout(0.1 if config.hidden_dropout_prob == 0 else config.hidden_dropout_prob)
         self.classifier = nn.Linear(config.hidden_size, config.num_labels)
 
@@ -1042,11 +1362,12 @@ class AlbertForQuestionAnswering(AlbertPreTrainedModel):
         loss, start_scores, end_scores = outputs[:2]
     """
 
-    def __init__(self, config):
+    def __init__(self, config, add_pooling_layer=True):
         super(AlbertForQuestionAnswering, self).__init__(config)
         self.num_labels = config.num_labels
 
-        self.bert = AlbertModel(config)
+        # the head does not use the pooler, add_pooling_layer=False (also through from_pretrained) skips it
+        self.bert = AlbertModel(config, add_pooling_layer=add_pooling_layer)
         self.qa_outputs = nn.Linear(config.hidden_size, config.num_labels)
 
         self.init_weights()
@@ -25,8 +25,9 @@ ALBERT_PRETRAINED_MODEL_ARCHIVE_MAP = {
     'albert-xlarge': "",
     'albert-xxlarge': "",
 }
-def load_tf_weights_in_albert(model, config, tf_checkpoint_path):
+def load_tf_weights_in_albert(model, config, tf_checkpoint_path, key_map=None):
     """ Load tf checkpoints in a pytorch model.
+        key_map, if given, is filled with {TF variable name: state_dict key} of every loaded variable.
     """
     try:
         import re
@@ -47,6 +48,7 @@ def load_tf_weights_in_albert(model, config, tf_checkpoint_path):
         array = tf.train.load_variable(tf_path, name)
         names.append(name)
         arrays.append(array)
+    param_names = dict((id(param), key) for key, param in model.named_parameters()) if key_map is not None else {}
     for name, array in zip(names, arrays):
         name = name.split('/')
         # adam_v and adam_m are variables used in AdamWeightDecayOptimizer to calculated m and v
@@ -91,6 +93,8 @@ def load_tf_weights_in_albert(model, config, tf_checkpoint_path):
             raise
         logger.info("Initialize PyTorch weight {}".format(name))
         pointer.data = torch.from_numpy(array)
+        if id(pointer) in param_names:
+            key_map["/".join(name)] = param_names[id(pointer)]
     return model
 
 AlbertLayerNorm = torch.nn.LayerNorm
@@ -110,6 +114,8 @@ class AlbertEmbeddings(nn.Module):
         # any TensorFlow checkpoint file
         self.LayerNorm =AlbertLayerNorm(config.hidden_size, eps=config.layer_norm_eps)
         self.dropout = nn.Dropout(config.hidden_dropout_prob)
+        # projected vocabulary of precompute(), derived from the weights so never saved
+        self.register_buffer('word_table', None, persistent=False)
 
     def forward(self, input_ids, token_type_ids=None, position_ids=None):
         seq_length = input_ids.size(1)
@@ -119,9 +125,12 @@ class AlbertEmbeddings(nn.Module):
         if token_type_ids is None:
             token_type_ids = torch.zeros_like(input_ids)
 
-        words_embeddings = self.word_embeddings(input_ids)
-        # project transform
-        words_embeddings = self.word_embeddings_2(words_embeddings)
+        if self.word_table is not None and not self.training:
+            words_embeddings = self.word_table[input_ids].to(self.word_embeddings_2.weight.dtype)
+        else:
+            words_embeddings = self.word_embeddings(input_ids)
+            # project transform
+            words_embeddings = self.word_embeddings_2(words_embeddings)
         position_embeddings = self.position_embeddings(position_ids)
         token_type_embeddings = self.token_type_embeddings(token_type_ids)
 
@@ -130,6 +139,17 @@ class AlbertEmbeddings(nn.Module):
         embeddings = self.dropout(embeddings)
         return embeddings
 
+    def precompute(self, dtype=None):
+        """ Project the whole vocabulary with word_embeddings_2 once, a vocab_size x hidden_size lookup
+            then replaces the per token projection at inference. `dtype` (e.g. torch.float16) halves the table.
+        """
+        with torch.no_grad():
+            table = self.word_embeddings_2(self.word_embeddings.weight)
+            self.word_table = table.to(dtype or table.dtype)
+
+    def clear_precomputed(self):
+        self.word_table = None
+
 class AlbertSelfOutput(nn.Module):
     def __init__(self, config):
         super(AlbertSelfOutput, self).__init__()
@@ -389,6 +409,7 @@ class AlbertModel(AlbertPreTrainedModel):
             objective during Bert pretraining. This output is usually *not* a good summary
             of the semantic content of the input, you're often better with averaging or pooling
             the sequence of hidden-states for the whole input sequence.
+            ``None`` when the model is built with ``add_pooling_layer=False``.
         **hidden_states**: (`optional`, returned when ``config.output_hidden_states=True``)
             list of ``torch.FloatTensor`` (one for the output of each layer + the output of the embeddings)
             of shape ``(batch_size, sequence_length, hidden_size)``:
@@ -407,19 +428,31 @@ class AlbertModel(AlbertPreTrainedModel):
 
     """
 
-    def __init__(self, config):
+    def __init__(self, config, add_pooling_layer=True):
         super(AlbertModel, self).__init__(config)
 
         self.embeddings = AlbertEmbeddings(config)
         self.encoder = AlbertEncoder(config)
-        self.pooler = BertPooler(config)
+        # token level heads never use the pooler, leave it out so it has no parameters to train or load
+        self.pooler = BertPooler(config) if add_pooling_layer else None
 
         self.init_weights()
 
+    def precompute_embeddings(self, enabled=True, dtype=None):
+        """ Memory for speed at inference: a vocab_size x hidden_size table of projected word embeddings
+            (see AlbertEmbeddings.precompute), about 62MB for 21128 x 768 in float32. Only used in eval mode,
+            call again after the weights change, enabled=False drops it.
+        """
+        if enabled:
+            self.embeddings.precompute(dtype)
+        else:
+            self.embeddings.clear_precomputed()
+
     def _resize_token_embeddings(self, new_num_tokens):
         old_embeddings = self.embeddings.word_embeddings
         new_embeddings = self._get_resized_embeddings(old_embeddings, new_num_tokens)
         self.embeddings.word_embeddings = new_embeddings
+        self.embeddings.clear_precomputed()  # the tables no longer match the vocabulary
         return self.embeddings.word_embeddings
 
     def _prune_heads(self, heads_to_prune):
@@ -473,7 +506,7 @@ class AlbertModel(AlbertPreTrainedModel):
                                        extended_attention_mask,
                                        head_mask=head_mask)
         sequence_output = encoder_outputs[0]
-        pooled_output = self.pooler(sequence_output)
+        pooled_output = self.pooler(sequence_output) if self.pooler is not None else None
 
         outputs = (sequence_output, pooled_output,) + encoder_outputs[
                                                       1:]  # add hidden_states and attentions if they are here
@@ -875,11 +908,12 @@ class AlbertForTokenClassification(AlbertPreTrainedModel):
 
     """
 
-    def __init__(self, config):
+    def __init__(self, config, add_pooling_layer=True):
         super(AlbertForTokenClassification, self).__init__(config)
         self.num_labels = config.num_labels
 
-        self.bert = AlbertModel(config)
+        # the head does not use the pooler, add_pooling_layer=False (also through from_pretrained) skips it
+        self.bert = AlbertModel(config, add_pooling_layer=add_pooling_layer)
         self.dropout = nn.Dropout(config.hidden_dropout_prob)
         self.classifier = nn.Linear(config.hidden_size, config.num_labels)
 
@@ -956,11 +990,12 @@ class AlbertForQuestionAnswering(AlbertPreTrainedModel):
 
     """
 
-    def __init__(self, config):
+    def __init__(self, config, add_pooling_layer=True):
         super(AlbertForQuestionAnswering, self).__init__(config)
         self.num_labels = config.num_labels
 
-        self.bert = AlbertModel(config)
+        # the head does not use the pooler, add_pooling_layer=False (also through from_pretrained) skips it
+        self.bert = AlbertModel(config, add_pooling_layer=add_pooling_layer)
         self.qa_outputs = nn.Linear(config.hidden_size, config.num_labels)
 
         self.init_weights()
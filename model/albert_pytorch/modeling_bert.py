@@ -28,7 +28,8 @@ import torch
 from torch import nn
 from torch.nn import CrossEntropyLoss, MSELoss
 
-from .modeling_utils import PreTrainedModel, prune_linear_layer
+from .modeling_utils import PreTrainedModel, prune_linear_layer, kept_index
+from ..bert_pytorch.attention.chunked import chunked_attention
 from .configuration_bert import BertConfig
 from .file_utils import add_start_docstrings
 
@@ -52,8 +53,9 @@ BERT_PRETRAINED_MODEL_ARCHIVE_MAP = {
     'bert-base-german-dbmdz-uncased': "https://s3.amazonaws.com/models.huggingface.co/bert/bert-base-german-dbmdz-uncased-pytorch_model.bin",
 }
 
-def load_tf_weights_in_bert(model, config, tf_checkpoint_path):
+def load_tf_weights_in_bert(model, config, tf_checkpoint_path, key_map=None):
     """ Load tf checkpoints in a pytorch model.
+        key_map, if given, is filled with {TF variable name: state_dict key} of every loaded variable.
     """
     try:
         import re
@@ -74,6 +76,7 @@ def load_tf_weights_in_bert(model, config, tf_checkpoint_path):
         array = tf.train.load_variable(tf_path, name)
         names.append(name)
         arrays.append(array)
+    param_names = dict((id(param), key) for key, param in model.named_parameters()) if key_map is not None else {}
 
     for name, array in zip(names, arrays):
         name = name.split('/')
@@ -116,6 +119,8 @@ def load_tf_weights_in_bert(model, config, tf_checkpoint_path):
             raise
         logger.info("Initialize PyTorch weight {}".format(name))
         pointer.data = torch.from_numpy(array)
+        if id(pointer) in param_names:
+            key_map["/".join(name)] = param_names[id(pointer)]
     return model
 
 
@@ -192,6 +197,7 @@ class BertSelfAttention(nn.Module):
         self.value = nn.Linear(config.hidden_size, self.all_head_size)
 
         self.dropout = nn.Dropout(config.attention_probs_dropout_prob)
+        self.chunk_size = getattr(config, 'attention_chunk_size', None)
 
     def transpose_for_scores(self, x):
         new_x_shape = x.size()[:-1] + (self.num_attention_heads, self.attention_head_size)
@@ -207,6 +213,17 @@ class BertSelfAttention(nn.Module):
         key_layer = self.transpose_for_scores(mixed_key_layer)
         value_layer = self.transpose_for_scores(mixed_value_layer)
 
+        if self.chunk_size and not self.output_attentions:
+            # Exact attention without the (seq_length x seq_length) scores, see chunked_attention
+            dropout_p = self.dropout.p if self.training else 0.0
+            context_layer = chunked_attention(query_layer, key_layer, value_layer, bias=attention_mask,
+                                              chunk_size=self.chunk_size, dropout_p=dropout_p)
+            if head_mask is not None:
+                context_layer = context_layer * head_mask
+            context_layer = context_layer.permute(0, 2, 1, 3).contiguous()
+            new_context_layer_shape = context_layer.size()[:-2] + (self.all_head_size,)
+            return (context_layer.view(*new_context_layer_shape),)
+
         # Take the dot product between "query" and "key" to get the raw attention scores.
         attention_scores = torch.matmul(query_layer, key_layer.transpose(-1, -2))
         attention_scores = attention_scores / math.sqrt(self.attention_head_size)
@@ -290,6 +307,7 @@ class BertIntermediate(nn.Module):
     def __init__(self, config):
         super(BertIntermediate, self).__init__()
         self.dense = nn.Linear(config.hidden_size, config.intermediate_size)
+        self.pruned_neurons = set()
         if isinstance(config.hidden_act, str) or (sys.version_info[0] == 2 and isinstance(config.hidden_act, unicode)):
             self.intermediate_act_fn = ACT2FN[config.hidden_act]
         else:
@@ -300,6 +318,15 @@ class BertIntermediate(nn.Module):
         hidden_states = self.intermediate_act_fn(hidden_states)
         return hidden_states
 
+    def prune_neurons(self, neurons):
+        """ Prune the dense layer and return the kept index, BertLayer prunes the input of BertOutput with it """
+        neurons = set(neurons) - self.pruned_neurons  # indices in the unpruned layer
+        index = kept_index(self.dense.out_features, self.pruned_neurons, neurons)
+        if len(neurons) > 0:
+            self.dense = prune_linear_layer(self.dense, index)
+            self.pruned_neurons = self.pruned_neurons.union(neurons)
+        return index
+
 
 class BertOutput(nn.Module):
     def __init__(self, config):
@@ -322,6 +349,12 @@ class BertLayer(nn.Module):
         self.intermediate = BertIntermediate(config)
         self.output = BertOutput(config)
 
+    def prune_neurons(self, neurons):
+        if len(set(neurons) - self.intermediate.pruned_neurons) == 0:
+            return
+        index = self.intermediate.prune_neurons(neurons)
+        self.output.dense = prune_linear_layer(self.output.dense, index, dim=1)
+
     def forward(self, hidden_states, attention_mask=None, head_mask=None):
         attention_outputs = self.attention(hidden_states, attention_mask, head_mask)
         attention_output = attention_outputs[0]
@@ -545,6 +578,7 @@ class BertModel(BertPreTrainedModel):
             objective during Bert pretraining. This output is usually *not* a good summary
             of the semantic content of the input, you're often better with averaging or pooling
             the sequence of hidden-states for the whole input sequence.
+            ``None`` when the model is built with ``add_pooling_layer=False``.
         **hidden_states**: (`optional`, returned when ``config.output_hidden_states=True``)
             list of ``torch.FloatTensor`` (one for the output of each layer + the output of the embeddings)
             of shape ``(batch_size, sequence_length, hidden_size)``:
@@ -562,12 +596,13 @@ class BertModel(BertPreTrainedModel):
         last_hidden_states = outputs[0]  # The last hidden-state is the first element of the output tuple
 
     """
-    def __init__(self, config):
+    def __init__(self, config, add_pooling_layer=True):
         super(BertModel, self).__init__(config)
 
         self.embeddings = BertEmbeddings(config)
         self.encoder = BertEncoder(config)
-        self.pooler = BertPooler(config)
+        # token level heads never use the pooler, leave it out so it has no parameters to train or load
+        self.pooler = BertPooler(config) if add_pooling_layer else None
 
         self.init_weights()
 
@@ -577,6 +612,10 @@ class BertModel(BertPreTrainedModel):
         self.embeddings.word_embeddings = new_embeddings
         return self.embeddings.word_embeddings
 
+    def prunable_layers(self):
+        """ The layers the layer_num of pruning refers to """
+        return list(self.encoder.layer)
+
     def _prune_heads(self, heads_to_prune):
         """ Prunes heads of the model.
             heads_to_prune: dict of {layer_num: list of heads to prune in this layer}
@@ -585,6 +624,14 @@ class BertModel(BertPreTrainedModel):
         for layer, heads in heads_to_prune.items():
             self.encoder.layer[layer].attention.prune_heads(heads)
 
+    def _prune_neurons(self, neurons_to_prune):
+        """ Prunes intermediate neurons of the model.
+            neurons_to_prune: dict of {layer_num: list of neurons to prune in this layer}
+            See base class PreTrainedModel
+        """
+        for layer, neurons in neurons_to_prune.items():
+            self.encoder.layer[layer].prune_neurons(neurons)
+
     def forward(self, input_ids, attention_mask=None, token_type_ids=None, position_ids=None, head_mask=None):
         if attention_mask is None:
             attention_mask = torch.ones_like(input_ids)
@@ -626,7 +673,7 @@ class BertModel(BertPreTrainedModel):
                                        extended_attention_mask,
                                        head_mask=head_mask)
         sequence_output = encoder_outputs[0]
-        pooled_output = self.pooler(sequence_output)
+        pooled_output = self.pooler(sequence_output) if self.pooler is not None else None
 
         outputs = (sequence_output, pooled_output,) + encoder_outputs[1:]  # add hidden_states and attentions if they are here
         return outputs  # sequence_output, pooled_output, (hidden_states), (attentions)
@@ -1023,11 +1070,12 @@ class BertForTokenClassification(BertPreTrainedModel):
         loss, scores = outputs[:2]
 
     """
-    def __init__(self, config):
+    def __init__(self, config, add_pooling_layer=True):
         super(BertForTokenClassification, self).__init__(config)
         self.num_labels = config.num_labels
 
-        self.bert = BertModel(config)
+        # the head does not use the pooler, add_pooling_layer=False (also through from_pretrained) skips it
+        self.bert = BertModel(config, add_pooling_layer=add_pooling_layer)
         self.dropout = nn.Dropout(config.hidden_dropout_prob)
         self.classifier = nn.Linear(config.hidden_size, config.num_labels)
 
@@ -1103,11 +1151,12 @@ class BertForQuestionAnswering(BertPreTrainedModel):
         loss, start_scores, end_scores = outputs[:2]
 
     """
-    def __init__(self, config):
+    def __init__(self, config, add_pooling_layer=True):
         super(BertForQuestionAnswering, self).__init__(config)
         self.num_labels = config.num_labels
 
-        self.bert = BertModel(config)
+        # the head does not use the pooler, add_pooling_layer=False (also through from_pretrained) skips it
+        self.bert = BertModel(config, add_pooling_layer=add_pooling_layer)
         self.qa_outputs = nn.Linear(config.hidden_size, config.num_labels)
 
         self.init_weights()
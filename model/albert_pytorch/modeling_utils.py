@@ -3,16 +3,25 @@
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
+import json
 import logging
 import os
+import threading
+from contextlib import contextmanager
+from io import open
 
 import torch
 from torch import nn
 from torch.nn import CrossEntropyLoss
 from torch.nn import functional as F
 
+from .checkpoint_utils import (save_flat_state_dict, load_flat_state_dict, assign_state_dict,
+                               save_sharded_state_dict, read_shard_index, load_sharded_state_dict,
+                               save_delta_state_dict, read_delta_index, load_delta_state_dict,
+                               remove_weights_files, checkpoint_file)
 from .configuration_utils import PretrainedConfig
-from .file_utils import cached_path, WEIGHTS_NAME, TF_WEIGHTS_NAME
+from .file_utils import (cached_path, WEIGHTS_NAME, FLAT_WEIGHTS_NAME, SHARDED_INDEX_NAME, DELTA_INDEX_NAME,
+                         TF_WEIGHTS_NAME, TF_CONVERSION_NAME)
 
 logger = logging.getLogger(__name__)
 
@@ -30,6 +39,58 @@ except ImportError:
         def forward(self, input):
             return input
 
+# layer types quantize_dynamic_model swaps for their int8 versions, by the name stored in config.quantization
+QUANTIZABLE_MODULES = {'Linear': nn.Linear, 'GRU': nn.GRU, 'LSTM': nn.LSTM}
+
+# torch layers initializing their parameters in reset_parameters, skipped inside no_init_weights
+SKIP_INIT_MODULES = (nn.Linear, nn.Embedding, nn.LayerNorm, nn.modules.rnn.RNNBase)
+
+# whether the current thread is inside no_init_weights
+_skip_init = threading.local()
+# the layer classes are patched while any thread is inside no_init_weights, the patch defers to _skip_init
+_skip_init_lock = threading.Lock()
+_skip_init_patch = {'blocks': 0, 'resets': []}
+
+
+def _skipping_init():
+    return getattr(_skip_init, 'active', False)
+
+
+def _skippable_reset(reset):
+    def reset_parameters(self):
+        if not _skipping_init():
+            reset(self)
+    return reset_parameters
+
+
+@contextmanager
+def no_init_weights():
+    """ Modules built inside keep the uninitialized storage torch allocates for their parameters:
+        ``reset_parameters`` of the ``SKIP_INIT_MODULES`` and the random init of ``PreTrainedModel.init_weights``
+        are skipped. Used by ``from_pretrained``, which overwrites the weights right away.
+        Blocks can be nested and only affect the thread they run in: the layer classes are patched once while
+        any thread is inside a block, the patched ``reset_parameters`` only skips the init in those threads.
+    """
+    previous = _skipping_init()
+    with _skip_init_lock:
+        if _skip_init_patch['blocks'] == 0:
+            for module_class in SKIP_INIT_MODULES:
+                _skip_init_patch['resets'].append((module_class, module_class.reset_parameters))
+                module_class.reset_parameters = _skippable_reset(module_class.reset_parameters)
+        _skip_init_patch['blocks'] += 1
+    _skip_init.active = True
+    try:
+        yield
+    finally:
+        _skip_init.active = previous
+        with _skip_init_lock:
+            _skip_init_patch['blocks'] -= 1
+            if _skip_init_patch['blocks'] == 0:
+                for module_class, reset in _skip_init_patch['resets']:
+                    module_class.reset_parameters = reset
+                del _skip_init_patch['resets'][:]
+
+
 class PreTrainedModel(nn.Module):
     r""" Base class for all models.
 
@@ -146,12 +207,49 @@ class PreTrainedModel(nn.Module):
 
     def init_weights(self):
         """ Initialize and prunes weights if needed. """
-        # Initialize weights
-        self.apply(self._init_weights)
+        # Initialize weights, unless built inside no_init_weights
+        if not _skipping_init():
+            self.apply(self._init_weights)
 
         # Prune heads if needed
         if self.config.pruned_heads:
             self.prune_heads(self.config.pruned_heads)
+        if getattr(self.config, 'pruned_neurons', None):
+            self.prune_neurons(self.config.pruned_neurons)
+
+    def _init_missing_weights(self, module, missing_keys, prefix=''):
+        """ Initialize the parameters of module named in missing_keys after a load under no_init_weights.
+            Submodules missing all their parameters are initialized as a whole, in partly loaded ones
+            only the missing tensors change.
+        """
+        missing = set(missing_keys)
+
+        def reset_and_init(submodule):
+            if isinstance(submodule, SKIP_INIT_MODULES):
+                submodule.reset_parameters()
+            self._init_weights(submodule)
+
+        def init(module, prefix):
+            keys = [prefix + name for name, _ in module.named_parameters()]
+            if not any(key in missing for key in keys):
+                return
+            if all(key in missing for key in keys):
+                module.apply(reset_and_init)
+                return
+            # keep the loaded tensors of this module aside while initializing it
+            loaded = dict((name, param.data) for name, param in module._parameters.items()
+                          if param is not None and prefix + name not in missing)
+            if len(loaded) < len([param for param in module._parameters.values() if param is not None]):
+                for name, data in loaded.items():
+                    module._parameters[name].data = torch.empty_like(data)
+                reset_and_init(module)
+                for name, data in loaded.items():
+                    module._parameters[name].data = data
+            for name, child in module._modules.items():
+                if child is not None:
+                    init(child, prefix + name + '.')
+
+        init(module, prefix)
 
     def prune_heads(self, heads_to_prune):
         """ Prunes heads of the base model.
@@ -170,9 +268,46 @@ class PreTrainedModel(nn.Module):
 
         base_model._prune_heads(heads_to_prune)
 
-    def save_pretrained(self, save_directory):
+    def prune_neurons(self, neurons_to_prune):
+        """ Prunes intermediate neurons of the feed forward layers of the base model.
+
+            Arguments:
+
+                neurons_to_prune: dict with keys being selected layer indices (`int`) and associated values being the list of neurons to prune in said layer (list of `int`, indices in the unpruned layer).
+        """
+        base_model = getattr(self, self.base_model_prefix, self)  # get the base model if needed
+
+        for layer, neurons in neurons_to_prune.items():
+            union_neurons = set(self.config.pruned_neurons.get(layer, [])) | set(neurons)
+            self.config.pruned_neurons[layer] = list(union_neurons)
+
+        base_model._prune_neurons(neurons_to_prune)
+
+    def quantize(self, dtype=torch.qint8, modules=('Linear', 'GRU', 'LSTM')):
+        """ Dynamically quantize the model in place for CPU inference, see :func:`quantize_dynamic_model`.
+
+            The quantization is recorded in ``config.quantization`` so that a model saved with ``save_pretrained``
+            is rebuilt with the same quantized layers by ``from_pretrained`` before its int8 weights are loaded.
+
+            Arguments:
+
+                dtype: ``torch.qint8`` (default) or ``torch.float16`` weights.
+                modules: names of the layer types to quantize, keys of ``QUANTIZABLE_MODULES``.
+        """
+        quantize_dynamic_model(self, dtype=dtype, modules=modules)
+        self.config.quantization = {'dtype': str(dtype).split('.')[-1], 'modules': list(modules)}
+        return self
+
+    def save_pretrained(self, save_directory, flat=False, max_shard_size=None):
         """ Save a model and its configuration file to a directory, so that it
             can be re-loaded using the `:func:`~pytorch_transformers.PreTrainedModel.from_pretrained`` class method.
+
+            With ``flat=True`` the weights are written as a memory mappable flat archive (``pytorch_model.flat``,
+            see :mod:`checkpoint_utils`) instead of a pickle, ``from_pretrained`` then loads the parameters as views
+            into the file. With ``max_shard_size`` (bytes or a string like ``'200MB'``) the weights are split in
+            shards with a hashed index (``pytorch_model.bin.index.json``) that ``from_pretrained`` loads in parallel.
+            Quantized models can only be pickled in one file. The weights files of the other formats left in the
+            directory by an earlier save are removed, ``from_pretrained`` would load them first.
         """
         assert os.path.isdir(save_directory), "Saving path should be a directory where the model and configuration can be saved"
 
@@ -183,9 +318,43 @@ class PreTrainedModel(nn.Module):
         model_to_save.config.save_pretrained(save_directory)
 
         # If we save using the predefined names, we can load using `from_pretrained`
+        if flat:
+            save_flat_state_dict(model_to_save.state_dict(), os.path.join(save_directory, FLAT_WEIGHTS_NAME))
+            remove_weights_files(save_directory, keep=(FLAT_WEIGHTS_NAME,))
+            return
+        if max_shard_size:
+            save_sharded_state_dict(model_to_save.state_dict(), save_directory, max_shard_size)
+            remove_weights_files(save_directory, keep=(SHARDED_INDEX_NAME,))
+            return
         output_model_file = os.path.join(save_directory, WEIGHTS_NAME)
 
         torch.save(model_to_save.state_dict(), output_model_file)
+        remove_weights_files(save_directory, keep=(WEIGHTS_NAME,))
+
+    def save_delta_pretrained(self, save_directory, base_model_path, dtype=None, threshold=None):
+        """ Save the configuration and only the difference of the weights to the base model at ``base_model_path``
+            (a directory saved with ``save_pretrained`` or its weights file), see :func:`checkpoint_utils.save_delta_state_dict`.
+            ``from_pretrained`` on the directory loads the base and applies the delta, the base has to stay in place
+            (or be passed as ``base_model_path`` to ``from_pretrained``) and unchanged, it is checked against its hash.
+            The weights files of the other formats left in the directory by an earlier save are removed. The delta can't
+            be saved into the directory of its base: ``from_pretrained`` would load the base, whose config would be
+            overwritten.
+
+            Arguments:
+
+                dtype: e.g. ``torch.float16`` to store the deltas in half precision.
+                threshold: drop the changes of at most this absolute value, storing sparse deltas where possible.
+        """
+        assert os.path.isdir(save_directory), "Saving path should be a directory where the model and configuration can be saved"
+        base_directory = os.path.dirname(os.path.abspath(checkpoint_file(base_model_path)))
+        if os.path.realpath(base_directory) == os.path.realpath(save_directory):
+            raise ValueError("Can't save a delta into {}, the directory of its base model".format(save_directory))
+        model_to_save = self.module if hasattr(self, 'module') else self
+        model_to_save.config.save_pretrained(save_directory)
+        index = save_delta_state_dict(model_to_save.state_dict(), base_model_path, save_directory, dtype=dtype,
+                                      threshold=threshold, base_prefix=self.base_model_prefix + '.')
+        remove_weights_files(save_directory, keep=(DELTA_INDEX_NAME,))
+        return index
 
     @classmethod
     def from_pretrained(cls, pretrained_model_name_or_path, *model_args, **kwargs):
@@ -204,7 +373,7 @@ class PreTrainedModel(nn.Module):
 
                 - a string with the `shortcut name` of a pre-trained model to load from cache or download, e.g.: ``bert-base-uncased``.
                 - a path to a `directory` containing model weights saved using :func:`~pytorch_transformers.PreTrainedModel.save_pretrained`, e.g.: ``./my_model_directory/``.
-                - a path or url to a `tensorflow index checkpoint file` (e.g. `./tf_model/model.ckpt.index`). In this case, ``from_tf`` should be set to True and a configuration object should be provided as ``config`` argument. This loading path is slower than converting the TensorFlow checkpoint in a PyTorch model using the provided conversion scripts and loading the PyTorch model afterwards.
+                - a path or url to a `tensorflow index checkpoint file` (e.g. `./tf_model/model.ckpt.index`). In this case, ``from_tf`` should be set to True and a configuration object should be provided as ``config`` argument. This loading path is slower than converting the TensorFlow checkpoint in a PyTorch model using the provided conversion scripts and loading the PyTorch model afterwards. Once converted with ``convert_tf_checkpoint`` next to the TensorFlow checkpoint, the converted weights are picked up automatically and TensorFlow is not needed.
 
             model_args: (`optional`) Sequence of positional arguments:
                 All remaning positional arguments will be passed to the underlying model's ``__init__`` method
@@ -235,6 +404,18 @@ class PreTrainedModel(nn.Module):
             output_loading_info: (`optional`) boolean:
                 Set to ``True`` to also return a dictionnary containing missing keys, unexpected keys and error messages.
 
+            fast_init: (`optional`) boolean, default True:
+                Build the model without its random initialization (see :func:`no_init_weights`) and only initialize the weights missing from the checkpoint. Ignored when loading a TensorFlow checkpoint or a quantized model.
+
+            num_threads: (`optional`) int:
+                Threads loading the shards of a sharded checkpoint, defaults to the number of CPUs.
+
+            verify_shards: (`optional`) boolean, default True:
+                Check every shard against the sha256 of the index while reading it, and the base model of a delta checkpoint against the sha256 recorded with the delta.
+
+            base_model_path: (`optional`) string:
+                Location of the base model of a delta checkpoint (see :func:`save_delta_pretrained`) when it moved since the delta was saved.
+
             kwargs: (`optional`) Remaining dictionary of keyword arguments:
                 Can be used to update the configuration object (after it being loaded) and initiate the model. (e.g. ``output_attention=True``). Behave differently depending on whether a `config` is provided or automatically loaded:
 
@@ -256,6 +437,10 @@ class PreTrainedModel(nn.Module):
         state_dict = kwargs.pop('state_dict', None)
         cache_dir = kwargs.pop('cache_dir', None)
         from_tf = kwargs.pop('from_tf', False)
+        fast_init = kwargs.pop('fast_init', True)
+        num_threads = kwargs.pop('num_threads', None)
+        verify_shards = kwargs.pop('verify_shards', True)
+        base_model_path = kwargs.pop('base_model_path', None)
         force_download = kwargs.pop('force_download', False)
         proxies = kwargs.pop('proxies', None)
         output_loading_info = kwargs.pop('output_loading_info', False)
@@ -271,6 +456,14 @@ class PreTrainedModel(nn.Module):
         else:
             model_kwargs = kwargs
 
+        # A TensorFlow checkpoint converted once with convert_tf_checkpoint is loaded natively, without TensorFlow
+        if from_tf:
+            converted_dir = converted_tf_checkpoint(pretrained_model_name_or_path)
+            if converted_dir is not None:
+                logger.info("loading the converted checkpoint in {} instead of the TensorFlow checkpoint {}".format(
+                    converted_dir, pretrained_model_name_or_path))
+                pretrained_model_name_or_path, from_tf = converted_dir, False
+
         # Load model
         if pretrained_model_name_or_path in cls.pretrained_model_archive_map:
             archive_file = cls.pretrained_model_archive_map[pretrained_model_name_or_path]
@@ -278,6 +471,12 @@ class PreTrainedModel(nn.Module):
             if from_tf:
                 # Directly load from a TensorFlow checkpoint
                 archive_file = os.path.join(pretrained_model_name_or_path, TF_WEIGHTS_NAME + ".index")
+            elif os.path.isfile(os.path.join(pretrained_model_name_or_path, FLAT_WEIGHTS_NAME)):
+                archive_file = os.path.join(pretrained_model_name_or_path, FLAT_WEIGHTS_NAME)
+            elif os.path.isfile(os.path.join(pretrained_model_name_or_path, SHARDED_INDEX_NAME)):
+                archive_file = os.path.join(pretrained_model_name_or_path, SHARDED_INDEX_NAME)
+            elif os.path.isfile(os.path.join(pretrained_model_name_or_path, DELTA_INDEX_NAME)):
+                archive_file = os.path.join(pretrained_model_name_or_path, DELTA_INDEX_NAME)
             else:
                 archive_file = os.path.join(pretrained_model_name_or_path, WEIGHTS_NAME)
         else:
@@ -309,10 +508,33 @@ class PreTrainedModel(nn.Module):
             logger.info("loading weights file {} from cache at {}".format(
                 archive_file, resolved_archive_file))
 
-        # Instantiate model.
-        model = cls(config, *model_args, **model_kwargs)
-
-        if state_dict is None and not from_tf:
+        # Instantiate model. Its weights come from the checkpoint, only the missing ones are initialized after loading
+        # (a quantized model is built from initialized weights, the quantization observes them)
+        fast_init = fast_init and not from_tf and not config.quantization
+        if fast_init:
+            with no_init_weights():
+                model = cls(config, *model_args, **model_kwargs)
+        else:
+            model = cls(config, *model_args, **model_kwargs)
+
+        # Rebuild the quantized layers of a quantized model, its saved weights are already packed int8
+        if config.quantization and not from_tf:
+            model.quantize(getattr(torch, config.quantization['dtype']), config.quantization['modules'])
+
+        # A flat archive is memory mapped and its tensors become the parameters, nothing is copied
+        mapped = state_dict is None and not from_tf and resolved_archive_file.endswith(".flat")
+        # Shards are read after the prefix resolution below, directly into the parameters. Until then the weight
+        # map of the index ({key: shard}) stands in for the state dict, only its keys are used
+        sharded = state_dict is None and not from_tf and resolved_archive_file.endswith(".index.json")
+        # same for a delta checkpoint, its entries stand in for the state dict
+        delta = state_dict is None and not from_tf and resolved_archive_file.endswith(DELTA_INDEX_NAME)
+        if mapped:
+            state_dict = load_flat_state_dict(resolved_archive_file)
+        elif sharded:
+            state_dict = read_shard_index(resolved_archive_file)["weight_map"]
+        elif delta:
+            state_dict = read_delta_index(resolved_archive_file)["entries"]
+        elif state_dict is None and not from_tf:
             state_dict = torch.load(resolved_archive_file, map_location='cpu')
         if from_tf:
             # Directly load from a TensorFlow checkpoint
@@ -359,7 +581,16 @@ class PreTrainedModel(nn.Module):
         if hasattr(model, cls.base_model_prefix) and not any(s.startswith(cls.base_model_prefix) for s in state_dict.keys()):
             model_to_load = getattr(model, cls.base_model_prefix)
 
-        load(model_to_load, prefix=start_prefix)
+        if mapped:
+            missing_keys, unexpected_keys, error_msgs = assign_state_dict(model_to_load, state_dict, start_prefix)
+        elif sharded:
+            missing_keys, unexpected_keys, error_msgs = load_sharded_state_dict(
+                model_to_load, resolved_archive_file, start_prefix, num_threads=num_threads, verify=verify_shards)
+        elif delta:
+            missing_keys, unexpected_keys, error_msgs = load_delta_state_dict(
+                model_to_load, resolved_archive_file, start_prefix, base_path=base_model_path, verify=verify_shards)
+        else:
+            load(model_to_load, prefix=start_prefix)
         if len(missing_keys) > 0:
             logger.info("Weights of {} not initialized from pretrained model: {}".format(
                 model.__class__.__name__, missing_keys))
@@ -369,9 +600,18 @@ class PreTrainedModel(nn.Module):
         if len(error_msgs) > 0:
             raise RuntimeError('Error(s) in loading state_dict for {}:\n\t{}'.format(
                                model.__class__.__name__, "\n\t".join(error_msgs)))
+        if fast_init:
+            if model_to_load is model:
+                model._init_missing_weights(model, missing_keys, start_prefix)
+            else:
+                # the heads around the base model were not in the checkpoint at all
+                base_prefix = cls.base_model_prefix + '.'
+                missing = [base_prefix + key for key in missing_keys]
+                missing += [key for key, _ in model.named_parameters() if not key.startswith(base_prefix)]
+                model._init_missing_weights(model, missing)
 
-        if hasattr(model, 'tie_weights'):
-            model.tie_weights()  # make sure word embedding weights are still tied
+        if hasattr(model, 'tie_weights') and not config.quantization:
+            model.tie_weights()  # make sure word embedding weights are still tied (a quantized decoder has its own copy)
 
         # Set model in evaluation mode to desactivate DropOut modules by default
         model.eval()
@@ -693,6 +933,63 @@ class SequenceSummary(nn.Module):
         return output
 
 
+class PrepackedLinear(nn.Module):
+    """ Inference only nn.Linear whose weight is reordered once into the oneDNN (mkldnn) blocked layout.
+        Inputs of any rank are flattened to 2D, converted, multiplied and converted back to dense.
+        Saved and loaded as regular dense ``weight`` / ``bias`` entries.
+    """
+    def __init__(self, linear):
+        super(PrepackedLinear, self).__init__()
+        self.in_features = linear.in_features
+        self.out_features = linear.out_features
+        bias = linear.bias if linear.bias is not None else torch.zeros(linear.out_features)
+        self.register_buffer('weight', linear.weight.detach().float().to_mkldnn())
+        self.register_buffer('bias', bias.detach().float().to_mkldnn())
+
+    def forward(self, input):
+        output = torch._C._nn.mkldnn_linear(input.reshape(-1, self.in_features).to_mkldnn(), self.weight, self.bias)
+        return output.to_dense().view(input.size()[:-1] + (self.out_features,))
+
+    def _save_to_state_dict(self, destination, prefix, keep_vars):
+        destination[prefix + 'weight'] = self.weight.to_dense()
+        destination[prefix + 'bias'] = self.bias.to_dense()
+
+    def _load_from_state_dict(self, state_dict, prefix, local_metadata, strict, missing_keys, unexpected_keys, error_msgs):
+        for name in ('weight', 'bias'):
+            if prefix + name in state_dict:
+                setattr(self, name, state_dict.pop(prefix + name).float().to_mkldnn())
+            elif strict:
+                missing_keys.append(prefix + name)
+
+    def extra_repr(self):
+        return 'in_features={}, out_features={}'.format(self.in_features, self.out_features)
+
+
+def mkldnn_available():
+    """ Whether oneDNN (mkldnn) prepacked linear layers run in this torch build """
+    if not (torch.backends.mkldnn.is_available() and hasattr(torch._C._nn, 'mkldnn_linear')):
+        return False
+    try:
+        PrepackedLinear(nn.Linear(4, 4))(torch.zeros(2, 3, 4))
+    except RuntimeError:
+        return False
+    return True
+
+
+def prepack_linear_layers(module):
+    """ Replace every float32 CPU nn.Linear inside `module` by a PrepackedLinear, in place.
+        A module shared by several parents (the ALBERT shared layer) is converted once.
+        Returns the number of replaced layers.
+    """
+    replaced = 0
+    for parent in module.modules():
+        for name, child in list(parent._modules.items()):
+            if type(child) is nn.Linear and child.weight.dtype == torch.float32 and child.weight.device.type == 'cpu':
+                parent._modules[name] = PrepackedLinear(child)
+                replaced += 1
+    return replaced
+
+
 def prune_linear_layer(layer, index, dim=0):
     """ Prune a linear layer (a model parameters) to keep only entries in index.
         Return the pruned layer as a new layer with requires_grad=True.
@@ -718,6 +1015,14 @@ def prune_linear_layer(layer, index, dim=0):
     return new_layer
 
 
+def kept_index(size, pruned, to_prune):
+    """ Positions of the entries to keep in a layer dimension that has `size` entries left after removing
+        the original indices `pruned`, when the original indices `to_prune` are removed as well.
+    """
+    original = [i for i in range(size + len(pruned)) if i not in pruned]
+    return torch.tensor([position for position, i in enumerate(original) if i not in to_prune], dtype=torch.long)
+
+
 def prune_conv1d_layer(layer, index, dim=1):
     """ Prune a Conv1D layer (a model parameters) to keep only entries in index.
         A Conv1D work as a Linear layer (see e.g. BERT) but the weights are transposed.
@@ -753,3 +1058,64 @@ def prune_layer(layer, index, dim=None):
         return prune_conv1d_layer(layer, index, dim=1 if dim is None else dim)
     else:
         raise ValueError("Can't prune layer of class {}".format(layer.__class__))
+
+
+def quantize_dynamic_model(model, dtype=torch.qint8, modules=('Linear', 'GRU', 'LSTM')):
+    """ Replace the layers of `model` of the given types by dynamically quantized ones, in place.
+        Weights are stored in int8 (or fp16), activations are quantized on the fly at every call,
+        so no calibration data is needed. CPU inference only.
+        Works on any module, e.g. an ``AlbertModel`` wrapped with a BiGRU / BiLSTM and a CRF head:
+        the ALBERT attention, FFN and ``embedding_hidden_mapping_in`` layers and the recurrent heads are all covered.
+    """
+    unknown = [name for name in modules if name not in QUANTIZABLE_MODULES]
+    if unknown:
+        raise ValueError("Can't dynamically quantize layers of type {}".format(unknown))
+    return torch.quantization.quantize_dynamic(model, set(QUANTIZABLE_MODULES[name] for name in modules),
+                                               dtype=dtype, inplace=True)
+
+
+def tf_checkpoint_files(tf_checkpoint_path):
+    """ {file name: [size, mtime]} of the ``.index`` / ``.data-*`` files of a TensorFlow checkpoint (a directory,
+        with its ``checkpoint`` file, or a ``model.ckpt`` prefix), to tell when a conversion of it is stale.
+    """
+    if os.path.isdir(tf_checkpoint_path):
+        directory, prefix = tf_checkpoint_path, None
+    else:
+        directory, prefix = os.path.split(os.path.abspath(tf_checkpoint_path))
+    files = {}
+    for name in os.listdir(directory):
+        if prefix is None:
+            matches = name == "checkpoint" or name.endswith(".index") or ".data-" in name
+        else:
+            matches = name == prefix + ".index" or name.startswith(prefix + ".data-")
+        if matches:
+            stat = os.stat(os.path.join(directory, name))
+            files[name] = [stat.st_size, stat.st_mtime]
+    return files
+
+
+def converted_tf_checkpoint(tf_checkpoint_path):
+    """ Directory of the native checkpoint written by ``convert_tf_checkpoint`` for a TensorFlow checkpoint
+        (a directory or a ``model.ckpt`` prefix, with or without ``.index``), None if there is none or it is stale.
+    """
+    if tf_checkpoint_path.endswith(".index"):
+        tf_checkpoint_path = tf_checkpoint_path[:-6]
+    is_dir = os.path.isdir(tf_checkpoint_path)
+    directory = tf_checkpoint_path if is_dir else os.path.dirname(os.path.abspath(tf_checkpoint_path))
+    manifest_file = os.path.join(directory, TF_CONVERSION_NAME)
+    if not os.path.isfile(manifest_file):
+        return None
+    with open(manifest_file, "r", encoding="utf-8") as reader:
+        manifest = json.loads(reader.read())
+    if not is_dir and manifest["tf_checkpoint"] != os.path.basename(tf_checkpoint_path):
+        return None
+    weights_file = os.path.join(directory, manifest["weights_name"])
+    if not os.path.isfile(weights_file) or os.path.getsize(weights_file) != manifest["weights_size"]:
+        logger.warning("Ignoring the converted checkpoint in {}, {} is missing or was modified".format(
+            directory, manifest["weights_name"]))
+        return None
+    if manifest.get("tf_files") != tf_checkpoint_files(tf_checkpoint_path):
+        logger.warning("Ignoring the converted checkpoint in {}, the TensorFlow checkpoint {} changed since".format(
+            directory, tf_checkpoint_path))
+        return None
+    return directory
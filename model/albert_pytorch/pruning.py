@@ -0,0 +1,175 @@
+""" Importance scores and FLOP budgeted structured pruning of attention heads and FFN neurons.
+
+The importance of a head / intermediate neuron is the first order estimate of the change of the loss
+when it is removed: |sum over tokens of activation * d loss / d activation|, accumulated over a dev set.
+Heads are scored on the attention context they write (the input of the attention output dense),
+neurons on the FFN intermediate activations (the input of the FFN output dense). A shared ALBERT layer
+collects the scores of every time it is applied.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import logging
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+def _base_model(model):
+    return getattr(model, model.base_model_prefix, model)
+
+
+def _ffn_output(layer):
+    # AlbertLayer keeps the FFN output dense under ffn.intermediate, BertLayer next to the intermediate
+    return layer.ffn.intermediate.output if hasattr(layer, 'ffn') else layer.output
+
+
+def _pruned_neurons(layer):
+    return layer.ffn.intermediate.pruned_neurons if hasattr(layer, 'ffn') else layer.intermediate.pruned_neurons
+
+
+def _original_indices(size, pruned):
+    # current position -> index in the unpruned layer
+    return [i for i in range(size + len(pruned)) if i not in pruned]
+
+
+def compute_importance(model, batches):
+    """ Head and FFN neuron importance of every prunable layer of `model`.
+
+        :param model: a PreTrainedModel whose forward returns the loss first when given labels
+        :param batches: iterable of dicts of forward keyword arguments, including the labels
+        :return: (head_importance, neuron_importance, applications): lists with one entry per layer of
+                 ``prunable_layers()``, tensors of shape (num_heads,) and (num_neurons,) in the current
+                 (possibly already pruned) layer, and the number of times each layer runs per forward
+    """
+    layers = _base_model(model).prunable_layers()
+    head_importance = [torch.zeros(layer.attention.self.num_attention_heads) for layer in layers]
+    neuron_importance = [torch.zeros(_ffn_output(layer).dense.in_features) for layer in layers]
+    calls = [0] * len(layers)
+
+    def accumulate(scores, index, num_heads=None):
+        def hook(module, inputs, output):
+            activation = inputs[0]
+            calls[index] += 1
+
+            def save_grad(grad):
+                contribution = (activation * grad).detach()
+                if num_heads is not None:
+                    contribution = contribution.view(contribution.size()[:-1] + (num_heads, -1)).sum(-1)
+                # per sample first order estimate, summed over its tokens
+                scores[index] += contribution.sum(1).abs().sum(0).float().cpu()
+            activation.register_hook(save_grad)
+        return hook
+
+    handles = []
+    for index, layer in enumerate(layers):
+        num_heads = layer.attention.self.num_attention_heads
+        handles.append(layer.attention.output.register_forward_hook(accumulate(head_importance, index, num_heads)))
+        handles.append(_ffn_output(layer).register_forward_hook(accumulate(neuron_importance, index)))
+
+    was_training = model.training
+    model.eval()  # no dropout, the scores reflect the model used at inference
+    n_forwards = 0
+    try:
+        for batch in batches:
+            model.zero_grad()
+            loss = model(**batch)[0]
+            loss.backward()
+            n_forwards += 1
+    finally:
+        for handle in handles:
+            handle.remove()
+        model.zero_grad()
+        model.train(was_training)
+
+    applications = [count // max(n_forwards, 1) for count in calls]
+    return head_importance, neuron_importance, applications
+
+
+def layer_flops(layer, seq_length):
+    """ Multiply-add FLOPs per token of one head and of one FFN neuron of `layer` """
+    attention = layer.attention.self
+    hidden_size = layer.attention.output.dense.out_features
+    # query, key, value and output projections plus the scores and the weighted sum over seq_length keys
+    head_flops = 2 * 4 * hidden_size * attention.attention_head_size + 2 * 2 * seq_length * attention.attention_head_size
+    neuron_flops = 2 * 2 * hidden_size
+    return head_flops, neuron_flops
+
+
+def encoder_flops(model, seq_length, applications=None):
+    """ FLOPs per token of the prunable part (attention heads and FFN neurons) of the encoder """
+    layers = _base_model(model).prunable_layers()
+    applications = applications or [1] * len(layers)
+    total = 0
+    for layer, count in zip(layers, applications):
+        head_flops, neuron_flops = layer_flops(layer, seq_length)
+        total += count * (layer.attention.self.num_attention_heads * head_flops +
+                          _ffn_output(layer).dense.in_features * neuron_flops)
+    return total
+
+
+def flop_budget_plan(model, head_importance, neuron_importance, applications, target, seq_length=202):
+    """ Greedily remove the heads and neurons with the lowest importance per FLOP until the prunable
+        encoder FLOPs are at most `target` times the current ones. Every layer keeps at least one head
+        and one neuron.
+
+        :return: (heads_to_prune, neurons_to_prune), dicts of {layer_num: [indices in the unpruned layer]}
+                 for ``prune_heads`` / ``prune_neurons``
+    """
+    layers = _base_model(model).prunable_layers()
+    total = encoder_flops(model, seq_length, applications)
+    budget = target * total
+
+    candidates = []
+    for index, layer in enumerate(layers):
+        if applications[index] == 0:
+            continue
+        head_flops, neuron_flops = layer_flops(layer, seq_length)
+        for kind, scores, unit_flops in (('head', head_importance[index], head_flops),
+                                         ('neuron', neuron_importance[index], neuron_flops)):
+            cost = applications[index] * unit_flops
+            for position, score in enumerate(scores.tolist()):
+                candidates.append((score / cost, kind, index, position, cost))
+    candidates.sort(key=lambda candidate: candidate[0])
+
+    remaining = {('head', i): len(head_importance[i]) for i in range(len(layers))}
+    remaining.update({('neuron', i): len(neuron_importance[i]) for i in range(len(layers))})
+    selected = {'head': {}, 'neuron': {}}
+    for _, kind, index, position, cost in candidates:
+        if total <= budget:
+            break
+        if remaining[(kind, index)] <= 1:
+            continue
+        remaining[(kind, index)] -= 1
+        selected[kind].setdefault(index, []).append(position)
+        total -= cost
+
+    heads_to_prune, neurons_to_prune = {}, {}
+    for index, positions in selected['head'].items():
+        original = _original_indices(len(head_importance[index]), layers[index].attention.pruned_heads)
+        heads_to_prune[index] = sorted(original[p] for p in positions)
+    for index, positions in selected['neuron'].items():
+        original = _original_indices(len(neuron_importance[index]), _pruned_neurons(layers[index]))
+        neurons_to_prune[index] = sorted(original[p] for p in positions)
+    return heads_to_prune, neurons_to_prune
+
+
+def prune_to_flop_budget(model, batches, target, seq_length=202):
+    """ Score heads and neurons on `batches`, then physically remove the least important ones until the
+        prunable encoder FLOPs are at most `target` times the current ones.
+        The pruned heads / neurons are recorded in the config, so ``save_pretrained`` writes a smaller
+        model that ``from_pretrained`` rebuilds with the same shapes.
+
+        :return: (heads_to_prune, neurons_to_prune, flops_before, flops_after)
+    """
+    head_importance, neuron_importance, applications = compute_importance(model, batches)
+    flops_before = encoder_flops(model, seq_length, applications)
+    heads_to_prune, neurons_to_prune = flop_budget_plan(model, head_importance, neuron_importance,
+                                                        applications, target, seq_length)
+    model.prune_heads(heads_to_prune)
+    model.prune_neurons(neurons_to_prune)
+    flops_after = encoder_flops(model, seq_length, applications)
+    logger.info("Pruned %d heads and %d neurons, encoder FLOPs %.3fG -> %.3fG per token",
+                sum(len(h) for h in heads_to_prune.values()), sum(len(n) for n in neurons_to_prune.values()),
+                flops_before / 1e9, flops_after / 1e9)
+    return heads_to_prune, neurons_to_prune, flops_before, flops_after
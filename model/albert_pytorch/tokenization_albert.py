@@ -7,6 +7,9 @@ import unicodedata
 import six
 import logging
 import sentencepiece as spm
+from .wordpiece import WordpieceTokenizer
+from .unicode_classes import (CJK_RANGES, WHITESPACE_RE, PUNCTUATION_SPLIT_RE, TOKEN_SPLIT_RE, NONSPACING_MARK_RE,
+                              CHINESE_CHAR_RE, invalid_char_regex)
 
 logger = logging.getLogger(__name__)
 SPIECE_UNDERLINE = u"▁"
@@ -100,7 +103,7 @@ def whitespace_tokenize(text):
 class FullTokenizer(object):
   """Runs end-to-end tokenziation."""
 
-  def __init__(self, vocab_file, do_lower_case=True, spm_model_file=None):
+  def __init__(self, vocab_file, do_lower_case=True, spm_model_file=None, word_cache_size=65536):
     self.vocab = None
     self.sp_model = None
     if spm_model_file:
@@ -116,7 +119,8 @@ class FullTokenizer(object):
       self.vocab = load_vocab(vocab_file)
       print("load token")
       self.basic_tokenizer = BasicTokenizer(do_lower_case=do_lower_case)
-      self.wordpiece_tokenizer = WordpieceTokenizer(vocab=self.vocab,unk_token="[UNK]", max_input_chars_per_word=100)
+      self.wordpiece_tokenizer = WordpieceTokenizer(vocab=self.vocab,unk_token="[UNK]", max_input_chars_per_word=100,
+                                                    word_cache_size=word_cache_size)
     self.inv_vocab = {v: k for k, v in self.vocab.items()}
 
   def tokenize(self, text):
@@ -130,6 +134,13 @@ class FullTokenizer(object):
 
     return split_tokens
 
+  def tokenize_to_ids(self, text):
+    """(tokens, ids) of text, the ids of the words read from the word cache with their pieces."""
+    if self.sp_model:
+      split_tokens = self.tokenize(text)
+      return split_tokens, self.convert_tokens_to_ids(split_tokens)
+    return self.wordpiece_tokenizer.tokenize_to_ids(" ".join(self.basic_tokenizer.tokenize(text)))
+
   def convert_tokens_to_ids(self, tokens):
     if self.sp_model:
       return [self.sp_model.PieceToId(token) for token in tokens]
@@ -166,58 +177,29 @@ class BasicTokenizer(object):
     # words in the English Wikipedia.).
     text = self._tokenize_chinese_chars(text)
     orig_tokens = whitespace_tokenize(text)
-    split_tokens = []
-    for token in orig_tokens:
-      if self.do_lower_case:
-        token = token.lower()
-        token = self._run_strip_accents(token)
-      split_tokens.extend(self._run_split_on_punc(token))
+    split_tokens = self._run_lower_and_split(orig_tokens)
     output_tokens = whitespace_tokenize(" ".join(split_tokens))
     return output_tokens
 
+  def _run_lower_and_split(self, tokens):
+    """Lower cases, strips accents and splits punctuation of tokens in one pass over their joined text."""
+    text = " ".join(tokens)
+    if self.do_lower_case:
+      text = self._run_strip_accents(text.lower())
+    return TOKEN_SPLIT_RE.findall(text)
+
   def _run_strip_accents(self, text):
     """Strips accents from a piece of text."""
-    text = unicodedata.normalize("NFD", text)
-    output = []
-    for char in text:
-      cat = unicodedata.category(char)
-      if cat == "Mn":
-        continue
-      output.append(char)
-    return "".join(output)
+    return NONSPACING_MARK_RE.sub("", unicodedata.normalize("NFD", text))
 
   def _run_split_on_punc(self, text):
     """Splits punctuation on a piece of text."""
-    chars = list(text)
-    i = 0
-    start_new_word = True
-    output = []
-    while i < len(chars):
-      char = chars[i]
-      if _is_punctuation(char):
-        output.append([char])
-        start_new_word = True
-      else:
-        if start_new_word:
-          output.append([])
-        start_new_word = False
-        output[-1].append(char)
-      i += 1
-
-    return ["".join(x) for x in output]
+    # every punctuation character alone, every run of other characters as one piece
+    return PUNCTUATION_SPLIT_RE.findall(text)
 
   def _tokenize_chinese_chars(self, text):
     """Adds whitespace around any CJK character."""
-    output = []
-    for char in text:
-      cp = ord(char)
-      if self._is_chinese_char(cp):
-        output.append(" ")
-        output.append(char)
-        output.append(" ")
-      else:
-        output.append(char)
-    return "".join(output)
+    return " ".join(CHINESE_CHAR_RE.split(text))
 
   def _is_chinese_char(self, cp):
     """Checks whether CP is the codepoint of a CJK character."""
@@ -229,89 +211,11 @@ class BasicTokenizer(object):
     # as is Japanese Hiragana and Katakana. Those alphabets are used to write
     # space-separated words, so they are not treated specially and handled
     # like the all of the other languages.
-    if ((cp >= 0x4E00 and cp <= 0x9FFF) or  #
-        (cp >= 0x3400 and cp <= 0x4DBF) or  #
-        (cp >= 0x20000 and cp <= 0x2A6DF) or  #
-        (cp >= 0x2A700 and cp <= 0x2B73F) or  #
-        (cp >= 0x2B740 and cp <= 0x2B81F) or  #
-        (cp >= 0x2B820 and cp <= 0x2CEAF) or
-        (cp >= 0xF900 and cp <= 0xFAFF) or  #
-        (cp >= 0x2F800 and cp <= 0x2FA1F)):  #
-      return True
-
-    return False
+    return any(start <= cp <= end for start, end in CJK_RANGES)
 
   def _clean_text(self, text):
     """Performs invalid character removal and whitespace cleanup on text."""
-    output = []
-    for char in text:
-      cp = ord(char)
-      if cp == 0 or cp == 0xfffd or _is_control(char):
-        continue
-      if _is_whitespace(char):
-        output.append(" ")
-      else:
-        output.append(char)
-    return "".join(output)
-
-class WordpieceTokenizer(object):
-    """Runs WordPiece tokenization."""
-
-    def __init__(self, vocab, unk_token, max_input_chars_per_word=100):
-      self.vocab = vocab
-      self.unk_token = unk_token
-      self.max_input_chars_per_word = max_input_chars_per_word
-
-    def tokenize(self, text):
-      """Tokenizes a piece of text into its word pieces.
-
-      This uses a greedy longest-match-first algorithm to perform tokenization
-      using the given vocabulary.
-
-      For example:
-        input = "unaffable"
-        output = ["un", "##aff", "##able"]
-
-      Args:
-        text: A single token or whitespace separated tokens. This should have
-          already been passed through `BasicTokenizer`.
-
-      Returns:
-        A list of wordpiece tokens.
-      """
-
-      output_tokens = []
-      for token in whitespace_tokenize(text):
-        chars = list(token)
-        if len(chars) > self.max_input_chars_per_word:
-          output_tokens.append(self.unk_token)
-          continue
-
-        is_bad = False
-        start = 0
-        sub_tokens = []
-        while start < len(chars):
-          end = len(chars)
-          cur_substr = None
-          while start < end:
-            substr = "".join(chars[start:end])
-            if start > 0:
-              substr = "##" + substr
-            if substr in self.vocab:
-              cur_substr = substr
-              break
-            end -= 1
-          if cur_substr is None:
-            is_bad = True
-            break
-          sub_tokens.append(cur_substr)
-          start = end
-
-        if is_bad:
-          output_tokens.append(self.unk_token)
-        else:
-          output_tokens.extend(sub_tokens)
-      return output_tokens
+    return WHITESPACE_RE.sub(" ", _INVALID_CHAR_RE.sub("", text))
 
 def _is_whitespace(char):
   """Checks whether `chars` is a whitespace character."""
@@ -350,3 +254,6 @@ def _is_punctuation(char):
   if cat.startswith("P"):
     return True
   return False
+
+# what _clean_text drops, the control characters of _is_control are the Cc / Cf ones
+_INVALID_CHAR_RE = invalid_char_regex(lambda category: category in ("Cc", "Cf"))
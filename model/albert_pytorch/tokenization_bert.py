@@ -23,6 +23,9 @@ import unicodedata
 from io import open
 
 from .tokenization_utils import PreTrainedTokenizer
+from .wordpiece import WordpieceTokenizer
+from .unicode_classes import (CJK_RANGES, WHITESPACE_RE, PUNCTUATION_SPLIT_RE, TOKEN_SPLIT_RE, NONSPACING_MARK_RE,
+                              CHINESE_CHAR_RE, invalid_char_regex)
 
 logger = logging.getLogger(__name__)
 
@@ -67,7 +70,7 @@ class BertTokenizer(PreTrainedTokenizer):
 
     def __init__(self, vocab_file, do_lower_case=True, do_basic_tokenize=True, never_split=None,
                  unk_token="[UNK]", sep_token="[SEP]", pad_token="[PAD]", cls_token="[CLS]",
-                 mask_token="[MASK]", tokenize_chinese_chars=True, **kwargs):
+                 mask_token="[MASK]", tokenize_chinese_chars=True, word_cache_size=65536, **kwargs):
         """Constructs a BertTokenizer.
 
         Args:
@@ -84,6 +87,10 @@ class BertTokenizer(PreTrainedTokenizer):
                 Whether to tokenize Chinese characters.
                 This should likely be deactivated for Japanese:
                 see: https://github.com/huggingface/pytorch-pretrained-BERT/issues/328
+            **word_cache_size**: (`optional`) int (default 65536)
+                Number of words whose word pieces and ids are kept in the LRU cache of the WordpieceTokenizer,
+                0 to disable it. Its hit rate is in ``wordpiece_tokenizer.word_cache.stats()``. Call
+                ``wordpiece_tokenizer.vocab_changed()`` after editing ``vocab`` in place without changing its size.
         """
         super(BertTokenizer, self).__init__(unk_token=unk_token, sep_token=sep_token,
                                             pad_token=pad_token, cls_token=cls_token,
@@ -103,7 +110,8 @@ class BertTokenizer(PreTrainedTokenizer):
             self.basic_tokenizer = BasicTokenizer(do_lower_case=do_lower_case,
                                                   never_split=never_split,
                                                   tokenize_chinese_chars=tokenize_chinese_chars)
-        self.wordpiece_tokenizer = WordpieceTokenizer(vocab=self.vocab, unk_token=self.unk_token)
+        self.wordpiece_tokenizer = WordpieceTokenizer(vocab=self.vocab, unk_token=self.unk_token,
+                                                      word_cache_size=word_cache_size)
 
     @property
     def vocab_size(self):
@@ -238,7 +246,7 @@ class BasicTokenizer(object):
                 Now implemented directly at the base class level (see :func:`PreTrainedTokenizer.tokenize`)
                 List of token not to split.
         """
-        never_split = self.never_split + (never_split if never_split is not None else [])
+        never_split = set(self.never_split + (never_split if never_split is not None else []))
         text = self._clean_text(text)
         # This was added on November 1st, 2018 for the multilingual and Chinese
         # models. This is also applied to the English models now, but it doesn't
@@ -250,60 +258,39 @@ class BasicTokenizer(object):
             text = self._tokenize_chinese_chars(text)
         orig_tokens = whitespace_tokenize(text)
         split_tokens = []
-        for token in orig_tokens:
-            if self.do_lower_case and token not in never_split:
-                token = token.lower()
-                token = self._run_strip_accents(token)
-            split_tokens.extend(self._run_split_on_punc(token))
+        start = 0
+        for i, token in enumerate(orig_tokens):
+            if self.do_lower_case and token in never_split:
+                # kept as is, but still split on punctuation
+                split_tokens.extend(self._run_lower_and_split(orig_tokens[start:i]))
+                split_tokens.extend(self._run_split_on_punc(token))
+                start = i + 1
+        split_tokens.extend(self._run_lower_and_split(orig_tokens[start:]))
 
         output_tokens = whitespace_tokenize(" ".join(split_tokens))
         return output_tokens
 
+    def _run_lower_and_split(self, tokens):
+        """Lower cases, strips accents and splits punctuation of tokens in one pass over their joined text."""
+        text = " ".join(tokens)
+        if self.do_lower_case:
+            text = self._run_strip_accents(text.lower())
+        return TOKEN_SPLIT_RE.findall(text)
+
     def _run_strip_accents(self, text):
         """Strips accents from a piece of text."""
-        text = unicodedata.normalize("NFD", text)
-        output = []
-        for char in text:
-            cat = unicodedata.category(char)
-            if cat == "Mn":
-                continue
-            output.append(char)
-        return "".join(output)
+        return NONSPACING_MARK_RE.sub("", unicodedata.normalize("NFD", text))
 
     def _run_split_on_punc(self, text, never_split=None):
         """Splits punctuation on a piece of text."""
         if never_split is not None and text in never_split:
             return [text]
-        chars = list(text)
-        i = 0
-        start_new_word = True
-        output = []
-        while i < len(chars):
-            char = chars[i]
-            if _is_punctuation(char):
-                output.append([char])
-                start_new_word = True
-            else:
-                if start_new_word:
-                    output.append([])
-                start_new_word = False
-                output[-1].append(char)
-            i += 1
-
-        return ["".join(x) for x in output]
+        # every punctuation character alone, every run of other characters as one piece
+        return PUNCTUATION_SPLIT_RE.findall(text)
 
     def _tokenize_chinese_chars(self, text):
         """Adds whitespace around any CJK character."""
-        output = []
-        for char in text:
-            cp = ord(char)
-            if self._is_chinese_char(cp):
-                output.append(" ")
-                output.append(char)
-                output.append(" ")
-            else:
-                output.append(char)
-        return "".join(output)
+        return " ".join(CHINESE_CHAR_RE.split(text))
 
     def _is_chinese_char(self, cp):
         """Checks whether CP is the codepoint of a CJK character."""
@@ -315,90 +302,11 @@ class BasicTokenizer(object):
         # as is Japanese Hiragana and Katakana. Those alphabets are used to write
         # space-separated words, so they are not treated specially and handled
         # like the all of the other languages.
-        if ((cp >= 0x4E00 and cp <= 0x9FFF) or  #
-                (cp >= 0x3400 and cp <= 0x4DBF) or  #
-                (cp >= 0x20000 and cp <= 0x2A6DF) or  #
-                (cp >= 0x2A700 and cp <= 0x2B73F) or  #
-                (cp >= 0x2B740 and cp <= 0x2B81F) or  #
-                (cp >= 0x2B820 and cp <= 0x2CEAF) or
-                (cp >= 0xF900 and cp <= 0xFAFF) or  #
-                (cp >= 0x2F800 and cp <= 0x2FA1F)):  #
-            return True
-
-        return False
+        return any(start <= cp <= end for start, end in CJK_RANGES)
 
     def _clean_text(self, text):
         """Performs invalid character removal and whitespace cleanup on text."""
-        output = []
-        for char in text:
-            cp = ord(char)
-            if cp == 0 or cp == 0xfffd or _is_control(char):
-                continue
-            if _is_whitespace(char):
-                output.append(" ")
-            else:
-                output.append(char)
-        return "".join(output)
-
-
-class WordpieceTokenizer(object):
-    """Runs WordPiece tokenization."""
-
-    def __init__(self, vocab, unk_token, max_input_chars_per_word=100):
-        self.vocab = vocab
-        self.unk_token = unk_token
-        self.max_input_chars_per_word = max_input_chars_per_word
-
-    def tokenize(self, text):
-        """Tokenizes a piece of text into its word pieces.
-
-        This uses a greedy longest-match-first algorithm to perform tokenization
-        using the given vocabulary.
-
-        For example:
-          input = "unaffable"
-          output = ["un", "##aff", "##able"]
-
-        Args:
-          text: A single token or whitespace separated tokens. This should have
-            already been passed through `BasicTokenizer`.
-
-        Returns:
-          A list of wordpiece tokens.
-        """
-
-        output_tokens = []
-        for token in whitespace_tokenize(text):
-            chars = list(token)
-            if len(chars) > self.max_input_chars_per_word:
-                output_tokens.append(self.unk_token)
-                continue
-
-            is_bad = False
-            start = 0
-            sub_tokens = []
-            while start < len(chars):
-                end = len(chars)
-                cur_substr = None
-                while start < end:
-                    substr = "".join(chars[start:end])
-                    if start > 0:
-                        substr = "##" + substr
-                    if substr in self.vocab:
-                        cur_substr = substr
-                        break
-                    end -= 1
-                if cur_substr is None:
-                    is_bad = True
-                    break
-                sub_tokens.append(cur_substr)
-                start = end
-
-            if is_bad:
-                output_tokens.append(self.unk_token)
-            else:
-                output_tokens.extend(sub_tokens)
-        return output_tokens
+        return WHITESPACE_RE.sub(" ", _INVALID_CHAR_RE.sub("", text))
 
 
 def _is_whitespace(char):
@@ -439,3 +347,7 @@ def _is_punctuation(char):
     if cat.startswith("P"):
         return True
     return False
+
+
+# what _clean_text drops, the control characters of _is_control are all of the C* categories
+_INVALID_CHAR_RE = invalid_char_regex(lambda category: category.startswith("C"))
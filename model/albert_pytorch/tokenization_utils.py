@@ -17,14 +17,18 @@ from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
 import logging
+import multiprocessing
 import os
 import json
+import re
 import six
 import copy
+import collections
 from io import open
 
 from .file_utils import cached_path
 
+import numpy as np
 import torch
 
 logger = logging.getLogger(__name__)
@@ -33,6 +37,63 @@ SPECIAL_TOKENS_MAP_FILE = 'special_tokens_map.json'
 ADDED_TOKENS_FILE = 'added_tokens.json'
 TOKENIZER_CONFIG_FILE = 'tokenizer_config.json'
 
+
+def trie_pattern(tokens):
+    """ Regex alternation of tokens factored into a trie: one branch per next character, so matching costs
+        the length of a token rather than the number of tokens, and the longest token at a position wins.
+    """
+    trie = {}
+    for token in tokens:
+        node = trie
+        for char in token:
+            node = node.setdefault(char, {})
+        node[None] = True
+
+    def node_pattern(node):
+        branches = [re.escape(char) + node_pattern(child) for char, child in node.items() if char is not None]
+        if not branches:
+            return ''
+        pattern = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        return '(?:' + pattern + ')?' if None in node else pattern
+
+    return node_pattern(trie)
+
+
+def tokens_can_overlap(tokens):
+    """ Whether occurrences of two different tokens can overlap in a text (a token containing another one, or
+        ending with the start of another one) or a token starts or ends with whitespace. The order of the tokens
+        then decides how a text is split, a regex matching the longest token would not.
+    """
+    tokens = set(tokens)
+    prefixes = collections.defaultdict(set)
+    for token in tokens:
+        for i in range(1, len(token)):
+            prefixes[token[:i]].add(token)
+    for token in tokens:
+        if token != token.strip():
+            return True
+        for i in range(len(token)):
+            if prefixes.get(token[i:], set()) - {token}:
+                return True
+            if any(token[i:j] in tokens for j in range(i + 1, len(token) + 1) if (i, j) != (0, len(token))):
+                return True
+    return False
+
+
+# tokenizer and encode_plus arguments of the worker processes of batch_encode_plus, set by their initializer
+_batch_encoding_state = None
+
+
+def _init_batch_encoding_worker(tokenizer, encode_kwargs):
+    global _batch_encoding_state
+    _batch_encoding_state = (tokenizer, encode_kwargs)
+
+
+def _encode_batch_chunk(examples):
+    tokenizer, encode_kwargs = _batch_encoding_state
+    return [tokenizer._encode_example(example, **encode_kwargs) for example in examples]
+
+
 class PreTrainedTokenizer(object):
     """ Base class for all tokenizers.
     Handle all the shared methods for tokenization and special tokens as well as methods dowloading/caching/loading pretrained tokenizers as well as adding tokens to the vocabulary.
@@ -216,6 +277,8 @@ class PreTrainedTokenizer(object):
         # Added tokens
         self.added_tokens_encoder = {}
         self.added_tokens_decoder = {}
+        self._added_tokens_re = None
+        self._added_tokens_key = None
 
         # inputs and kwargs for saving and re-loading (see ``from_pretrained`` and ``save_pretrained``)
         self.init_inputs = ()
@@ -602,48 +665,74 @@ class PreTrainedTokenizer(object):
 
             Take care of added tokens.
         """
-        def split_on_token(tok, text):
-            result = []
-            split_text = text.split(tok)
-            for i, sub_text in enumerate(split_text):
-                sub_text = sub_text.strip()
-                if i == 0 and not sub_text:
-                    result += [tok]
-                elif i == len(split_text) - 1:
-                    if sub_text:
-                        result += [sub_text]
-                    else:
-                        pass
-                else:
-                    if sub_text:
-                        result += [sub_text]
-                    result += [tok]
-            return result
-
-        def split_on_tokens(tok_list, text):
-            if not text:
-                return []
-            if not tok_list:
-                return self._tokenize(text, **kwargs)
-
-            tokenized_text = []
-            text_list = [text]
-            for tok in tok_list:
-                tokenized_text = []
-                for sub_text in text_list:
-                    if sub_text not in self.added_tokens_encoder \
-                            and sub_text not in self.all_special_tokens:
-                        tokenized_text += split_on_token(tok, sub_text)
-                    else:
-                        tokenized_text += [sub_text]
-                text_list = tokenized_text
-
-            return sum((self._tokenize(token, **kwargs) if token not \
-                    in self.added_tokens_encoder and token not in self.all_special_tokens \
-                    else [token] for token in tokenized_text), [])
-
-        added_tokens = list(self.added_tokens_encoder.keys()) + self.all_special_tokens
-        tokenized_text = split_on_tokens(added_tokens, text)
+        if not text:
+            return []
+        added_tokens_re, added_tokens = self._added_tokens_pattern()
+        if not added_tokens:
+            return self._tokenize(text, **kwargs)
+        if added_tokens_re is None:
+            return self._split_on_tokens(added_tokens, text, **kwargs)
+
+        # the stripped text between two added or special tokens goes through _tokenize
+        tokenized_text = []
+        start = 0
+        for match in added_tokens_re.finditer(text):
+            sub_text = text[start:match.start()].strip()
+            if sub_text:
+                tokenized_text.extend(self._tokenize(sub_text, **kwargs))
+            tokenized_text.append(match.group())
+            start = match.end()
+        sub_text = text[start:].strip()
+        if sub_text:
+            tokenized_text.extend(self._tokenize(sub_text, **kwargs))
+        return tokenized_text
+
+    def _added_tokens_pattern(self):
+        """ (regex matching the added and special tokens, the tokens in precedence order: the added tokens in the
+            order they were added, then the special tokens). The regex is None when tokens can overlap, the text
+            is then split token by token (see _split_on_tokens). Computed again only when the added tokens or the
+            special tokens changed.
+        """
+        special_tokens = tuple(self.all_special_tokens)
+        key = (len(self.added_tokens_encoder), special_tokens)
+        if key != self._added_tokens_key:
+            tokens = [token for token in collections.OrderedDict.fromkeys(
+                list(self.added_tokens_encoder) + list(special_tokens)) if token]
+            regex = re.compile(trie_pattern(tokens)) if tokens and not tokens_can_overlap(tokens) else None
+            self._added_tokens_re = (regex, tokens)
+            self._added_tokens_key = key
+        return self._added_tokens_re
+
+    def _split_on_tokens(self, tokens, text, **kwargs):
+        """ Splits text on every token in turn: the stripped pieces left between the occurrences of a token are
+            split on the next ones, so of two overlapping tokens the one first in tokens wins. A piece that is a
+            token is kept as is, the others go through _tokenize.
+        """
+        if not text.strip():
+            return []
+        pieces = [text]
+        # a token missing from text is missing from its pieces
+        for token in [token for token in tokens if token in text]:
+            split_pieces = []
+            for piece in pieces:
+                if piece in tokens or token not in piece:
+                    split_pieces.append(piece if piece in tokens else piece.strip())
+                    continue
+                parts = piece.split(token)
+                for i, part in enumerate(parts):
+                    part = part.strip()
+                    if part:
+                        split_pieces.append(part)
+                    if i < len(parts) - 1:
+                        split_pieces.append(token)
+            pieces = split_pieces
+
+        tokenized_text = []
+        for piece in pieces:
+            if piece in tokens:
+                tokenized_text.append(piece)
+            else:
+                tokenized_text.extend(self._tokenize(piece, **kwargs))
         return tokenized_text
 
     def _tokenize(self, text, **kwargs):
@@ -791,6 +880,95 @@ class PreTrainedTokenizer(object):
                                       truncation_strategy=truncation_strategy,
                                       return_tensors=return_tensors)
 
+    def _encode_example(self, example, **kwargs):
+        """ encode_plus of a text or of a (text, text_pair) tuple """
+        if isinstance(example, tuple) and len(example) == 2:
+            return self.encode_plus(example[0], text_pair=example[1], **kwargs)
+        return self.encode_plus(example, **kwargs)
+
+    def batch_encode_plus(self,
+                          batch_text_or_text_pairs,
+                          add_special_tokens=False,
+                          max_length=None,
+                          stride=0,
+                          truncation_strategy='longest_first',
+                          pad_to_max_length=False,
+                          return_tensors='np',
+                          num_workers=0,
+                          chunk_size=256,
+                          **kwargs):
+        """
+        Encodes a batch of sequences or sequence pairs like ``encode_plus`` and pads them into arrays.
+
+        Args:
+            batch_text_or_text_pairs: list of the inputs of ``encode_plus``: strings, lists of strings, lists of
+                integers, or (text, text_pair) tuples for sequence pairs
+            add_special_tokens, max_length, stride, truncation_strategy: as in ``encode_plus``
+            pad_to_max_length: pad to ``max_length`` instead of the longest sequence of the batch
+            return_tensors: 'np' for numpy arrays, 'pt' for torch tensors sharing their memory
+            num_workers: if more than 1 and the batch holds more than ``chunk_size`` examples, the examples are
+                tokenized by a pool of that many processes, ``chunk_size`` examples per task. Starting the pool
+                and sending it the tokenizer has a fixed cost, this only pays off for large batches.
+            **kwargs: passed to the `self.tokenize()` method
+
+        Return:
+            A Dictionary with the fields:
+                ``input_ids``, ``token_type_ids``, ``attention_mask``: (batch_size, length) int64 arrays, each
+                allocated once, padded with the id of ``pad_token`` (0 if not set), 0 and 0
+
+                ``special_tokens_mask``: (batch_size, length) array padded with 1, if ``add_special_tokens``
+
+                ``lengths``: int64 array of the unpadded length of every sequence
+
+                ``overflowing_tokens``, ``num_truncated_tokens``: lists, one entry per example, if ``max_length``
+        """
+        if return_tensors not in ('np', 'pt'):
+            raise ValueError("return_tensors should be 'np' or 'pt', got {}".format(return_tensors))
+        if pad_to_max_length and not max_length:
+            raise ValueError("pad_to_max_length needs a max_length")
+        encode_kwargs = dict(kwargs, add_special_tokens=add_special_tokens, max_length=max_length, stride=stride,
+                             truncation_strategy=truncation_strategy)
+        examples = list(batch_text_or_text_pairs)
+        if num_workers > 1 and len(examples) > chunk_size:
+            chunks = [examples[start:start + chunk_size] for start in range(0, len(examples), chunk_size)]
+            pool = multiprocessing.Pool(num_workers, initializer=_init_batch_encoding_worker,
+                                        initargs=(self, encode_kwargs))
+            try:
+                encoded = [encoded_inputs for chunk in pool.imap(_encode_batch_chunk, chunks)
+                           for encoded_inputs in chunk]
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            encoded = [self._encode_example(example, **encode_kwargs) for example in examples]
+
+        lengths = np.array([len(encoded_inputs["input_ids"]) for encoded_inputs in encoded], dtype=np.int64)
+        width = max_length if pad_to_max_length else int(lengths.max(initial=0))
+        # every field is filled in one assignment through the mask of the unpadded positions
+        mask = np.arange(width) < lengths[:, None]
+        pad_token_id = self.pad_token_id if self._pad_token is not None else 0
+
+        def padded(field, pad_value):
+            array = np.full((len(encoded), width), pad_value, dtype=np.int64)
+            array[mask] = np.fromiter((value for encoded_inputs in encoded for value in encoded_inputs[field]),
+                                      dtype=np.int64, count=int(lengths.sum()))
+            return array
+
+        batch = {
+            "input_ids": padded("input_ids", pad_token_id),
+            "token_type_ids": padded("token_type_ids", 0),
+            "attention_mask": mask.astype(np.int64),
+            "lengths": lengths,
+        }
+        if add_special_tokens:
+            batch["special_tokens_mask"] = padded("special_tokens_mask", 1)
+        if return_tensors == 'pt':
+            batch = dict((field, torch.from_numpy(array)) for field, array in batch.items())
+        if max_length:
+            batch["overflowing_tokens"] = [encoded_inputs.get("overflowing_tokens", []) for encoded_inputs in encoded]
+            batch["num_truncated_tokens"] = [encoded_inputs.get("num_truncated_tokens", 0) for encoded_inputs in encoded]
+        return batch
+
     def prepare_for_model(self, ids, pair_ids=None, max_length=None, add_special_tokens=False, stride=0,
                           truncation_strategy='longest_first', return_tensors=None):
         """
@@ -890,16 +1068,22 @@ class PreTrainedTokenizer(object):
             return ids, pair_ids, []
 
         if truncation_strategy == 'longest_first':
-            overflowing_tokens = []
-            for _ in range(num_tokens_to_remove):
-                if pair_ids is None or len(ids) > len(pair_ids):
-                    overflowing_tokens = [ids[-1]] + overflowing_tokens
-                    ids = ids[:-1]
-                else:
-                    pair_ids = pair_ids[:-1]
-            window_len = min(len(ids), stride)
-            if window_len > 0:
-                overflowing_tokens = ids[-window_len:] + overflowing_tokens
+            # Removing one token at a time from the longer sequence (from the pair on ties), in slices:
+            # the longer sequence loses the difference of lengths, then the pair and the first take turns
+            len_ids = len(ids)
+            if pair_ids is None:
+                num_ids_to_remove, num_pair_ids_to_remove = num_tokens_to_remove, 0
+            else:
+                difference = len_ids - len(pair_ids)
+                first_cut = min(abs(difference), num_tokens_to_remove)
+                turns = num_tokens_to_remove - first_cut
+                num_ids_to_remove = (first_cut if difference > 0 else 0) + turns // 2
+                num_pair_ids_to_remove = (first_cut if difference <= 0 else 0) + (turns + 1) // 2
+                pair_ids = pair_ids[:max(len(pair_ids) - num_pair_ids_to_remove, 0)]
+            kept = max(len_ids - num_ids_to_remove, 0)
+            window_len = min(kept, stride)
+            overflowing_tokens = list(ids[kept - window_len:])
+            ids = ids[:kept]
         elif truncation_strategy == 'only_first':
             assert len(ids) > num_tokens_to_remove
             window_len = min(len(ids), stride + num_tokens_to_remove)
@@ -0,0 +1,111 @@
+"""Per codepoint classes of the BasicTokenizer passes as compiled regexes, shared by tokenization_bert and
+tokenization_albert, so that the passes run in C.
+
+The classes are built from the Unicode category of every codepoint. That scan takes a few tenths of a second,
+so it runs once per process on the first tokenization, not at import: the regexes below are ``LazyRegex``.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import itertools
+import re
+import sys
+import unicodedata
+
+import six
+
+# The CJK Unified Ideographs blocks, see BasicTokenizer._is_chinese_char
+CJK_RANGES = ((0x4E00, 0x9FFF), (0x3400, 0x4DBF), (0x20000, 0x2A6DF), (0x2A700, 0x2B73F),
+              (0x2B740, 0x2B81F), (0x2B820, 0x2CEAF), (0xF900, 0xFAFF), (0x2F800, 0x2FA1F))
+
+_category_runs = None
+_punctuation_ranges = None
+
+
+def category_runs():
+    """(first codepoint, last codepoint, Unicode category) of every run of consecutive codepoints of one category,
+    computed on the first call."""
+    global _category_runs
+    if _category_runs is None:
+        runs, start = [], 0
+        for category, group in itertools.groupby(map(unicodedata.category, map(six.unichr, range(sys.maxunicode + 1)))):
+            size = sum(1 for _ in group)
+            runs.append((start, start + size - 1, category))
+            start += size
+        _category_runs = runs
+    return _category_runs
+
+
+def char_ranges(category_test=None, include=(), exclude=()):
+    """Sorted disjoint [first, last] codepoint ranges of the categories passing category_test,
+    plus the (first, last) ranges of include, minus the codepoints of exclude."""
+    runs = category_runs() if category_test is not None else []
+    ranges = []
+    for start, end in sorted([(start, end) for start, end, category in runs if category_test(category)] + list(include)):
+        if ranges and start <= ranges[-1][1] + 1:
+            ranges[-1][1] = max(ranges[-1][1], end)
+        else:
+            ranges.append([start, end])
+    for cp in exclude:
+        for i, (start, end) in enumerate(ranges):
+            if start <= cp <= end:
+                ranges[i:i + 1] = [r for r in ([start, cp - 1], [cp + 1, end]) if r[0] <= r[1]]
+                break
+    return ranges
+
+
+def char_class(ranges, negate=False):
+    """Regex of one character in (negate: not in) ranges.
+
+    sre looks the BMP characters of a class up in a bitmap but tries the ranges above it one by one, for every
+    character not in the class. The astral ranges are only tried on astral characters, behind a lookbehind."""
+    bmp = "".join("\\U%08x-\\U%08x" % (start, min(end, 0xFFFF)) for start, end in ranges if start <= 0xFFFF)
+    astral = "".join("\\U%08x-\\U%08x" % (max(start, 0x10000), end) for start, end in ranges if end > 0xFFFF)
+    if not astral:
+        return "[%s%s]" % ("^" if negate else "", bmp)
+    if negate:
+        return "(?:[^%s\\U00010000-\\U0010ffff]|[\\U00010000-\\U0010ffff](?<![%s]))" % (bmp, astral)
+    return "(?:[%s]|[\\U00010000-\\U0010ffff](?<=[%s]))" % (bmp, astral)
+
+
+def punctuation_ranges():
+    """Codepoint ranges of _is_punctuation: the P* categories and the non-letter / number ASCII characters."""
+    global _punctuation_ranges
+    if _punctuation_ranges is None:
+        _punctuation_ranges = char_ranges(lambda category: category.startswith("P"),
+                                          include=[(33, 47), (58, 64), (91, 96), (123, 126)])
+    return _punctuation_ranges
+
+
+class LazyRegex(object):
+    """re.compile(build()) on the first use. The attributes used (findall, sub, ...) are then set on the instance,
+    later lookups cost no more than on the compiled regex."""
+
+    def __init__(self, build):
+        self._build = build
+        self._regex = None
+
+    def __getattr__(self, name):
+        if self._regex is None:
+            self._regex = re.compile(self._build())
+        value = getattr(self._regex, name)
+        setattr(self, name, value)
+        return value
+
+
+def invalid_char_regex(control_test):
+    """What _clean_text drops: NUL, the replacement character and the characters of the control categories
+    (passing control_test) but \\t, \\n and \\r."""
+    return LazyRegex(lambda: char_class(char_ranges(control_test, include=[(0, 0), (0xFFFD, 0xFFFD)],
+                                                    exclude=(0x9, 0xA, 0xD))))
+
+
+WHITESPACE_RE = LazyRegex(lambda: char_class(char_ranges(
+    lambda category: category == "Zs", include=[(0x9, 0xA), (0xD, 0xD), (0x20, 0x20)])))
+PUNCTUATION_SPLIT_RE = LazyRegex(lambda: "%s|%s+" % (
+    char_class(punctuation_ranges()), char_class(punctuation_ranges(), negate=True)))
+# the pieces of space joined tokens, the spaces between them dropped
+TOKEN_SPLIT_RE = LazyRegex(lambda: "%s|%s+" % (
+    char_class(punctuation_ranges()), char_class(punctuation_ranges() + [(0x20, 0x20)], negate=True)))
+NONSPACING_MARK_RE = LazyRegex(lambda: char_class(char_ranges(lambda category: category == "Mn")))
+# split keeps the captured CJK characters, joining the pieces with spaces puts one on both sides of each
+CHINESE_CHAR_RE = LazyRegex(lambda: "(%s)" % char_class(char_ranges(include=CJK_RANGES)))
@@ -0,0 +1,164 @@
+"""WordPiece tokenization shared by tokenization_bert and tokenization_albert: the greedy longest-match-first split
+of a word against the vocab, walked down a trie of the vocab, with an LRU cache of the words already split.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import collections
+
+
+TRIE_END = None  # key of a trie node marking the end of a word
+
+
+def build_trie(words):
+    """Nested dicts {char: node}, the node of the last char of every word holding TRIE_END."""
+    root = {}
+    for word in words:
+        node = root
+        for char in word:
+            node = node.setdefault(char, {})
+        node[TRIE_END] = True
+    return root
+
+
+class WordCache(object):
+    """Least recently used cache of the word pieces and ids of words, with hit counts."""
+
+    def __init__(self, max_size=65536):
+        self.max_size = max_size
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, word):
+        entry = self.entries.get(word)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(word)
+        return entry
+
+    def put(self, word, entry):
+        if self.max_size <= 0:
+            return
+        self.entries[word] = entry
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        return {"size": len(self.entries), "max_size": self.max_size, "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hit_rate}
+
+
+class WordpieceTokenizer(object):
+    """Runs WordPiece tokenization."""
+
+    def __init__(self, vocab, unk_token, max_input_chars_per_word=100, word_cache_size=65536):
+        self.vocab = vocab
+        self.unk_token = unk_token
+        self.max_input_chars_per_word = max_input_chars_per_word
+        self.word_cache = WordCache(word_cache_size)
+        self._tries = None
+        self._tries_key = None
+
+    def vocab_changed(self):
+        """Drops the tries and the word cache, to be called after editing the vocab in place. Assigning a new
+        vocab or adding / removing entries is noticed on its own, an edit keeping its size (e.g. replacing an
+        unused entry) is not."""
+        self._tries = None
+        self._tries_key = None
+        self.word_cache.clear()
+
+    @property
+    def tries(self):
+        """(trie of every vocab entry, trie of the "##" continuation entries without their "##"),
+        built on first use and again when the vocab object or its size changes (see `vocab_changed`),
+        dropping the word cache."""
+        key = (id(self.vocab), len(self.vocab))
+        if self._tries_key != key:
+            self._tries = (build_trie(self.vocab),
+                           build_trie(token[2:] for token in self.vocab if token.startswith("##")))
+            self._tries_key = key
+            self.word_cache.clear()
+        return self._tries
+
+    def tokenize(self, text):
+        """Tokenizes a piece of text into its word pieces.
+
+        This uses a greedy longest-match-first algorithm to perform tokenization
+        using the given vocabulary. The longest match is found in one walk down
+        the vocab trie (the continuation trie after the first piece).
+
+        For example:
+          input = "unaffable"
+          output = ["un", "##aff", "##able"]
+
+        Args:
+          text: A single token or whitespace separated tokens. This should have
+            already been passed through `BasicTokenizer`.
+
+        Returns:
+          A list of wordpiece tokens.
+        """
+
+        output_tokens = []
+        for token in text.split():
+            if len(token) <= self.max_input_chars_per_word and token in self.vocab:
+                output_tokens.append(token)  # the whole word is the longest match, e.g. every CJK character
+            else:
+                output_tokens.extend(self.word_pieces(token)[0])
+        return output_tokens
+
+    def tokenize_to_ids(self, text):
+        """Like `tokenize`, returns (word pieces, their ids in the vocab)."""
+        output_tokens, output_ids = [], []
+        for token in text.split():
+            if len(token) <= self.max_input_chars_per_word and token in self.vocab:
+                output_tokens.append(token)
+                output_ids.append(self.vocab[token])
+            else:
+                pieces, ids = self.word_pieces(token)
+                output_tokens.extend(pieces)
+                output_ids.extend(ids)
+        return output_tokens, output_ids
+
+    def word_pieces(self, token):
+        """(word pieces, ids) of one word, from the word cache or the longest match walk. The words found
+        whole in the vocab are a dict lookup in `tokenize` and do not go through the cache."""
+        prefix_trie, suffix_trie = self.tries
+        entry = self.word_cache.get(token)
+        if entry is not None:
+            return entry
+
+        is_bad = len(token) > self.max_input_chars_per_word
+        start = 0
+        sub_tokens = []
+        while not is_bad and start < len(token):
+            node = prefix_trie if start == 0 else suffix_trie
+            end = None
+            for i in range(start, len(token)):
+                node = node.get(token[i])
+                if node is None:
+                    break
+                if TRIE_END in node:
+                    end = i + 1
+            if end is None:
+                is_bad = True
+                break
+            sub_tokens.append(token[start:end] if start == 0 else "##" + token[start:end])
+            start = end
+
+        if is_bad:
+            sub_tokens = [self.unk_token]
+        unk_id = self.vocab.get(self.unk_token)
+        entry = (tuple(sub_tokens), tuple(self.vocab.get(sub_token, unk_id) for sub_token in sub_tokens))
+        self.word_cache.put(token, entry)
+        return entry
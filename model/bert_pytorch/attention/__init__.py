@@ -1,2 +1,4 @@
 from .multi_head import MultiHeadedAttention
 from .single import Attention
+from .local import LocalAttention
+from .chunked import ChunkedAttention, chunked_attention
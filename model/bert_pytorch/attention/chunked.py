@@ -0,0 +1,149 @@
+import torch.nn as nn
+import torch
+
+import math
+
+
+class ChunkedAttentionFunction(torch.autograd.Function):
+    """
+    Exact softmax attention computed chunk by chunk with an online softmax.
+
+    Queries and keys are walked in blocks of chunk_size, the running row max and
+    normalizer are rescaled as new key blocks come in, so only a
+    (chunk_size x chunk_size) block of scores exists at any time.
+    The backward pass recomputes the blocks from the saved log-sum-exp instead of
+    keeping the (L x L) probabilities around. Dropout masks on the probabilities are
+    regenerated block by block from a seed, so they are not stored either.
+    """
+
+    @staticmethod
+    def forward(ctx, query, key, value, bias, chunk_size, dropout_p, seed):
+        scale = 1.0 / math.sqrt(query.size(-1))
+        q_len, k_len = query.size(-2), key.size(-2)
+
+        output = torch.empty_like(query)
+        lse = query.new_empty(query.shape[:-1])
+
+        for i in range(0, q_len, chunk_size):
+            q_chunk = query[..., i:i + chunk_size, :] * scale
+            row_max = q_chunk.new_full(q_chunk.shape[:-1], -float('inf'))
+            row_sum = q_chunk.new_zeros(q_chunk.shape[:-1])
+            acc = torch.zeros_like(q_chunk)
+
+            for j in range(0, k_len, chunk_size):
+                scores = torch.matmul(q_chunk, key[..., j:j + chunk_size, :].transpose(-2, -1))
+                if bias is not None:
+                    scores = scores + _bias_chunk(bias, i, j, chunk_size)
+
+                new_max = torch.max(row_max, scores.max(dim=-1)[0])
+                correction = torch.exp(row_max - new_max)
+                p = torch.exp(scores - new_max.unsqueeze(-1))
+
+                row_sum = row_sum * correction + p.sum(dim=-1)
+                if dropout_p > 0:
+                    p = p * _dropout_mask(p, dropout_p, seed, i, j)
+                acc = acc * correction.unsqueeze(-1) + torch.matmul(p, value[..., j:j + chunk_size, :])
+                row_max = new_max
+
+            output[..., i:i + chunk_size, :] = acc / row_sum.unsqueeze(-1)
+            lse[..., i:i + chunk_size] = row_max + torch.log(row_sum)
+
+        ctx.save_for_backward(query, key, value, bias, output, lse)
+        ctx.chunk_size = chunk_size
+        ctx.dropout_p = dropout_p
+        ctx.seed = seed
+        return output
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        query, key, value, bias, output, lse = ctx.saved_tensors
+        chunk_size, dropout_p, seed = ctx.chunk_size, ctx.dropout_p, ctx.seed
+        scale = 1.0 / math.sqrt(query.size(-1))
+        q_len, k_len = query.size(-2), key.size(-2)
+
+        grad_query = torch.zeros_like(query)
+        grad_key = torch.zeros_like(key)
+        grad_value = torch.zeros_like(value)
+        # rowsum(dO * O) == rowsum(dP * P), the softmax backward term of every row (with or without dropout)
+        delta = (grad_output * output).sum(dim=-1)
+
+        for i in range(0, q_len, chunk_size):
+            q_chunk = query[..., i:i + chunk_size, :]
+            grad_out_chunk = grad_output[..., i:i + chunk_size, :]
+            lse_chunk = lse[..., i:i + chunk_size].unsqueeze(-1)
+            delta_chunk = delta[..., i:i + chunk_size].unsqueeze(-1)
+
+            for j in range(0, k_len, chunk_size):
+                k_chunk = key[..., j:j + chunk_size, :]
+                v_chunk = value[..., j:j + chunk_size, :]
+
+                scores = torch.matmul(q_chunk, k_chunk.transpose(-2, -1)) * scale
+                if bias is not None:
+                    scores = scores + _bias_chunk(bias, i, j, chunk_size)
+                p = torch.exp(scores - lse_chunk)
+
+                grad_p = torch.matmul(grad_out_chunk, v_chunk.transpose(-2, -1))
+                if dropout_p > 0:
+                    mask = _dropout_mask(p, dropout_p, seed, i, j)
+                    grad_value[..., j:j + chunk_size, :] += torch.matmul((p * mask).transpose(-2, -1), grad_out_chunk)
+                    grad_p = grad_p * mask
+                else:
+                    grad_value[..., j:j + chunk_size, :] += torch.matmul(p.transpose(-2, -1), grad_out_chunk)
+                grad_scores = p * (grad_p - delta_chunk) * scale
+
+                grad_query[..., i:i + chunk_size, :] += torch.matmul(grad_scores, k_chunk)
+                grad_key[..., j:j + chunk_size, :] += torch.matmul(grad_scores.transpose(-2, -1), q_chunk)
+
+        return grad_query, grad_key, grad_value, None, None, None, None
+
+
+def _bias_chunk(bias, i, j, chunk_size):
+    # bias broadcasts over the query dimension when it has size 1 there (padding masks)
+    if bias.size(-2) != 1:
+        bias = bias[..., i:i + chunk_size, :]
+    return bias[..., j:j + chunk_size]
+
+
+def _dropout_mask(p, dropout_p, seed, i, j):
+    # the same (seed, block) always yields the same mask, forward and backward agree without storing it
+    generator = torch.Generator(device=p.device)
+    generator.manual_seed(seed + i * 1000003 + j)
+    keep = torch.rand(p.shape, generator=generator, device=p.device, dtype=p.dtype) >= dropout_p
+    return keep.to(p.dtype) / (1.0 - dropout_p)
+
+
+def chunked_attention(query, key, value, bias=None, chunk_size=128, dropout_p=0.0):
+    """
+    softmax(query @ key^T / sqrt(d_k) + bias) @ value without building the (L x L) matrices
+
+    :param query: (batch_size, h, q_len, d_k)
+    :param key, value: (batch_size, h, k_len, d_k)
+    :param bias: additive mask broadcastable to (batch_size, h, q_len, k_len), e.g. (batch_size, 1, 1, k_len)
+    :param chunk_size: number of queries and keys scored per block
+    :param dropout_p: dropout rate on the attention probabilities
+    """
+    if bias is not None and bias.requires_grad:
+        raise ValueError("chunked_attention does not compute gradients for the attention bias")
+    seed = int(torch.randint(2 ** 31, (1,)).item()) if dropout_p > 0 else 0
+    return ChunkedAttentionFunction.apply(query, key, value, bias, chunk_size, dropout_p, seed)
+
+
+class ChunkedAttention(nn.Module):
+    """
+    Compute 'Scaled Dot Product Attention' in chunks, see chunked_attention.
+    The attention probabilities are never materialized, so None is returned in their place.
+    """
+
+    def __init__(self, chunk_size=128):
+        super().__init__()
+        self.chunk_size = chunk_size
+
+    def forward(self, query, key, value, mask=None, dropout=None):
+        dropout_p = dropout.p if dropout is not None and dropout.training else 0.0
+
+        bias = None
+        if mask is not None:
+            bias = torch.zeros(mask.shape, dtype=query.dtype, device=query.device).masked_fill(mask == 0, -1e9)
+
+        output = chunked_attention(query, key, value, bias=bias, chunk_size=self.chunk_size, dropout_p=dropout_p)
+        return output, None
@@ -0,0 +1,105 @@
+import torch.nn as nn
+import torch.nn.functional as F
+import torch
+
+import math
+
+
+class LocalAttention(nn.Module):
+    """
+    Compute banded (sliding window) 'Scaled Dot Product Attention'
+
+    Every position attends to the positions at most `window` steps away from it.
+    The sequence is cut into blocks of `window` positions and each block is only scored
+    against itself and its two neighbour blocks, so memory grows as O(L * window)
+    and the full L x L score matrix is never built.
+    With global_cls the first position ([CLS]) attends to, and is attended by, every position.
+    """
+
+    def __init__(self, window, global_cls=True):
+        """
+        :param window: number of positions visible on each side of a query
+        :param global_cls: let the first position attend globally
+        """
+        super().__init__()
+        assert window > 0
+        self.window = window
+        self.global_cls = global_cls
+
+    def forward(self, query, key, value, mask=None, dropout=None):
+        """
+        :param query, key, value: (batch_size, h, seq_len, d_k)
+        :param mask: key padding mask broadcastable to (batch_size, 1, 1, seq_len), 0 for padding
+        :return: output (batch_size, h, seq_len, d_k) and the banded attention probabilities
+                 (batch_size, h, n_blocks, window, 3 * window [+ 1 global column])
+        """
+        batch_size, h, seq_len, d_k = query.size()
+        w = self.window
+        pad = -seq_len % w
+        n_blocks = (seq_len + pad) // w
+
+        if mask is None:
+            keep = query.new_ones(batch_size, seq_len)
+        else:
+            keep = (mask != 0).reshape(batch_size, seq_len).to(query.dtype)
+
+        local_keep = keep
+        if self.global_cls:
+            # [CLS] is scored once as a global key below, so drop it from the bands
+            local_keep = torch.cat([keep.new_zeros(batch_size, 1), keep[:, 1:]], dim=1)
+
+        q = F.pad(query, (0, 0, 0, pad)).view(batch_size, h, n_blocks, w, d_k)
+        k = self._neighbour_blocks(F.pad(key, (0, 0, 0, pad)), n_blocks)
+        v = self._neighbour_blocks(F.pad(value, (0, 0, 0, pad)), n_blocks)
+        key_keep = self._neighbour_blocks(F.pad(local_keep, (0, pad)).view(batch_size, 1, -1, 1), n_blocks)
+
+        # (batch_size, h, n_blocks, w, 3w)
+        scores = torch.matmul(q, k.transpose(-2, -1)) / math.sqrt(d_k)
+        visible = (key_keep.transpose(-2, -1) > 0) & self._band(w, query.device)
+        scores = scores.masked_fill(~visible, -1e9)
+
+        if self.global_cls:
+            cls_key = key[:, :, :1].unsqueeze(2)
+            cls_scores = torch.matmul(q, cls_key.transpose(-2, -1)) / math.sqrt(d_k)
+            cls_scores = cls_scores.masked_fill(keep[:, :1].view(batch_size, 1, 1, 1, 1) == 0, -1e9)
+            scores = torch.cat([scores, cls_scores], dim=-1)
+
+        p_attn = F.softmax(scores, dim=-1)
+
+        if dropout is not None:
+            p_attn = dropout(p_attn)
+
+        output = torch.matmul(p_attn[..., :3 * w], v)
+        if self.global_cls:
+            output = output + p_attn[..., 3 * w:] * value[:, :, :1].unsqueeze(2)
+        output = output.view(batch_size, h, n_blocks * w, d_k)[:, :, :seq_len]
+
+        if self.global_cls:
+            # the [CLS] row is a single query, scoring it against every key is O(L)
+            cls_scores = torch.matmul(query[:, :, :1], key.transpose(-2, -1)) / math.sqrt(d_k)
+            cls_scores = cls_scores.masked_fill(keep.view(batch_size, 1, 1, seq_len) == 0, -1e9)
+            cls_attn = F.softmax(cls_scores, dim=-1)
+            if dropout is not None:
+                cls_attn = dropout(cls_attn)
+            output = torch.cat([torch.matmul(cls_attn, value), output[:, :, 1:]], dim=2)
+
+        return output, p_attn
+
+    @staticmethod
+    def _neighbour_blocks(x, n_blocks):
+        """
+        (..., n_blocks * w, d) -> (..., n_blocks, 3 * w, d): every block next to its previous and next block,
+        the missing neighbours of the first and last block are zero filled
+        """
+        blocks = x.view(*x.shape[:-2], n_blocks, -1, x.size(-1))
+        padded = F.pad(blocks, (0, 0, 0, 0, 1, 1))
+        return torch.cat([padded[..., :-2, :, :], padded[..., 1:-1, :, :], padded[..., 2:, :, :]], dim=-2)
+
+    @staticmethod
+    def _band(w, device):
+        """
+        (w, 3w) bool mask, True where a query of the current block is at most w positions away from a key of
+        the [previous, current, next] blocks
+        """
+        offset = torch.arange(3 * w, device=device).unsqueeze(0) - w - torch.arange(w, device=device).unsqueeze(1)
+        return offset.abs() <= w
@@ -1,5 +1,7 @@
 import torch.nn as nn
 from .single import Attention
+from .local import LocalAttention
+from .chunked import ChunkedAttention
 
 
 class MultiHeadedAttention(nn.Module):
@@ -7,7 +9,15 @@ class MultiHeadedAttention(nn.Module):
     Take in model size and number of heads.
     """
 
-    def __init__(self, h, d_model, dropout=0.1):
+    def __init__(self, h, d_model, dropout=0.1, window=None, global_cls=True, chunk_size=None):
+        """
+        :param h: number of heads
+        :param d_model: model size
+        :param dropout: dropout rate on the attention probabilities
+        :param window: if set, attend only to positions at most `window` steps away (banded attention)
+        :param global_cls: with banded attention, let the first position ([CLS]) attend globally
+        :param chunk_size: if set, compute exact attention in chunks of this many positions
+        """
         super().__init__()
         assert d_model % h == 0
 
@@ -17,7 +27,12 @@ class MultiHeadedAttention(nn.Module):
 
         self.linear_layers = nn.ModuleList([nn.Linear(d_model, d_model) for _ in range(3)])
         self.output_linear = nn.Linear(d_model, d_model)
-        self.attention = Attention()
+        if window is not None:
+            self.attention = LocalAttention(window, global_cls=global_cls)
+        elif chunk_size is not None:
+            self.attention = ChunkedAttention(chunk_size)
+        else:
+            self.attention = Attention()
 
         self.dropout = nn.Dropout(p=dropout)
 
@@ -1,7 +1,9 @@
 import torch.nn as nn
+import torch
 
 from .transformer import TransformerBlock
 from .embedding import BERTEmbedding
+from .early_exit import EarlyExitHeads, exit_confidence
 
 
 class BERT(nn.Module):
@@ -9,34 +11,46 @@ class BERT(nn.Module):
     BERT model : Bidirectional Encoder Representations from Transformers.
     """
 
-    def __init__(self, vocab_size, hidden=768, n_layers=12, attn_heads=12, dropout=0.1):
+    def __init__(self, vocab_size, hidden=768, n_layers=12, attn_heads=12, dropout=0.1,
+                 max_len=512, attn_window=None, global_cls=True, attn_chunk_size=None, num_exit_tags=None):
         """
         :param vocab_size: vocab_size of total words
         :param hidden: BERT model hidden size
         :param n_layers: numbers of Transformer blocks(layers)
         :param attn_heads: number of attention heads
         :param dropout: dropout rate
+        :param max_len: initial size of the positional table, it grows for longer inputs
+        :param attn_window: if set, use banded attention of this window instead of full attention
+        :param global_cls: with banded attention, let [CLS] attend globally
+        :param attn_chunk_size: compute exact full attention in chunks of this many positions
+        :param num_exit_tags: if set, add a tag emission head after every layer for early exit
         """
 
         super().__init__()
         self.hidden = hidden
         self.n_layers = n_layers
         self.attn_heads = attn_heads
+        self.attn_window = attn_window
 
         # paper noted they used 4*hidden_size for ff_network_hidden_size
         self.feed_forward_hidden = hidden * 4
 
         # embedding for BERT, sum of positional, segment, token embeddings
-        self.embedding = BERTEmbedding(vocab_size=vocab_size, embed_size=hidden)
+        self.embedding = BERTEmbedding(vocab_size=vocab_size, embed_size=hidden, max_len=max_len)
 
         # multi-layers transformer blocks, deep network
         self.transformer_blocks = nn.ModuleList(
-            [TransformerBlock(hidden, attn_heads, hidden * 4, dropout) for _ in range(n_layers)])
+            [TransformerBlock(hidden, attn_heads, hidden * 4, dropout, window=attn_window, global_cls=global_cls,
+                              chunk_size=attn_chunk_size)
+             for _ in range(n_layers)])
+
+        # per-layer emission heads, see forward_exits and forward_early_exit
+        self.exit_heads = EarlyExitHeads(hidden, num_exit_tags, n_layers) if num_exit_tags else None
 
     def forward(self, x, segment_info):
         # attention masking for padded token
-        # torch.ByteTensor([batch_size, 1, seq_len, seq_len)
-        mask = (x > 0).unsqueeze(1).repeat(1, x.size(1), 1).unsqueeze(1)
+        # torch.BoolTensor([batch_size, 1, 1, seq_len), broadcast over heads and query positions
+        mask = (x > 0).unsqueeze(1).unsqueeze(1)
 
         # embedding the indexed sequence to sequence of vectors
         x = self.embedding(x, segment_info)
@@ -46,3 +60,71 @@ class BERT(nn.Module):
             x = transformer.forward(x, mask)
 
         return x
+
+    def forward_exits(self, x, segment_info):
+        """
+        Run every layer and collect the emissions of every exit head, for training them with early_exit_loss
+
+        :return: top layer output, list of (batch_size, seq_len, num_exit_tags) emissions, one per layer
+        """
+        if self.exit_heads is None:
+            raise ValueError("BERT was built without exit heads, set num_exit_tags")
+
+        mask = (x > 0).unsqueeze(1).unsqueeze(1)
+        x = self.embedding(x, segment_info)
+
+        exit_emissions = []
+        for i, transformer in enumerate(self.transformer_blocks):
+            x = transformer.forward(x, mask)
+            exit_emissions.append(self.exit_heads(x, i))
+
+        return x, exit_emissions
+
+    def forward_early_exit(self, x, segment_info, threshold=0.9, criterion='max_prob', per_sample=True, crf=None):
+        """
+        Inference that stops the layer loop once the exit head is confident enough, see exit_confidence
+
+        :param threshold: exit when the confidence reaches this value
+        :param criterion: 'max_prob' or 'entropy'
+        :param per_sample: drop confident samples from the batch as soon as they exit,
+                           otherwise the whole batch exits once every sample is confident
+        :param crf: score confidence with the marginals of this CRF instead of the per token softmax
+        :return: output of the exit layer (batch_size, seq_len, hidden), emissions of the exit head
+                 (batch_size, seq_len, num_exit_tags) and the number of layers run for every sample (batch_size,)
+        """
+        if self.exit_heads is None:
+            raise ValueError("BERT was built without exit heads, set num_exit_tags")
+
+        token_mask = x > 0
+        mask = token_mask.unsqueeze(1).unsqueeze(1)
+        h = self.embedding(x, segment_info)
+
+        hidden = torch.zeros_like(h)
+        emissions = h.new_zeros(x.size(0), x.size(1), self.exit_heads.num_tags)
+        exit_layers = x.new_full((x.size(0),), self.n_layers)
+        active = torch.arange(x.size(0), device=x.device)
+
+        for i, transformer in enumerate(self.transformer_blocks):
+            h = transformer.forward(h, mask)
+            emission = self.exit_heads(h, i)
+
+            if i == self.n_layers - 1:
+                done = torch.ones_like(active, dtype=torch.bool)
+            else:
+                done = exit_confidence(emission, token_mask, criterion, crf) >= threshold
+                if not per_sample:
+                    done = done.all().expand_as(done)
+            if not done.any():
+                continue
+
+            exited = active[done]
+            hidden[exited] = h[done]
+            emissions[exited] = emission[done]
+            exit_layers[exited] = i + 1
+
+            keep = ~done
+            if not keep.any():
+                break
+            active, h, mask, token_mask = active[keep], h[keep], mask[keep], token_mask[keep]
+
+        return hidden, emissions, exit_layers
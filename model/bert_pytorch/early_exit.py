@@ -0,0 +1,99 @@
+import torch.nn as nn
+import torch.nn.functional as F
+import torch
+
+import math
+
+
+class EarlyExitHeads(nn.Module):
+    """
+    One lightweight linear emission head per layer,
+    lets the tags be predicted from any intermediate layer and the layer loop stop early
+    """
+
+    def __init__(self, hidden, num_tags, n_layers):
+        """
+        :param hidden: hidden size of the layers
+        :param num_tags: number of tags the heads emit scores for
+        :param n_layers: number of layers, one head each
+        """
+        super().__init__()
+        self.num_tags = num_tags
+        self.heads = nn.ModuleList([nn.Linear(hidden, num_tags) for _ in range(n_layers)])
+
+    def forward(self, x, layer):
+        return self.heads[layer](x)
+
+
+def tag_posteriors(emissions, mask=None, crf=None):
+    """
+    :param emissions: (batch_size, seq_len, num_tags)
+    :param mask: (batch_size, seq_len), 0 for padding
+    :param crf: if given, CRF marginals are used instead of the per token softmax
+    :return: (batch_size, seq_len, num_tags) tag posteriors
+    """
+    if crf is None:
+        return F.softmax(emissions, dim=-1)
+    if crf.batch_first:
+        return crf.marginal_probabilities(emissions, mask)
+    mask = None if mask is None else mask.transpose(0, 1)
+    return crf.marginal_probabilities(emissions.transpose(0, 1), mask).transpose(0, 1)
+
+
+def exit_confidence(emissions, mask=None, criterion='max_prob', crf=None):
+    """
+    Confidence of every sample, decided by its least confident token
+
+    :param criterion: 'max_prob' for the max tag posterior,
+                      'entropy' for one minus the posterior entropy normalized by log(num_tags)
+    :return: (batch_size,) confidence in [0, 1]
+    """
+    probs = tag_posteriors(emissions, mask, crf)
+    if criterion == 'max_prob':
+        token_confidence = probs.max(dim=-1)[0]
+    elif criterion == 'entropy':
+        entropy = -(probs * torch.log(probs.clamp(min=1e-12))).sum(dim=-1)
+        token_confidence = 1.0 - entropy / math.log(probs.size(-1))
+    else:
+        raise ValueError("unknown early exit criterion: %s" % criterion)
+
+    if mask is not None:
+        token_confidence = token_confidence.masked_fill(mask == 0, 1.0)
+    return token_confidence.min(dim=-1)[0]
+
+
+def early_exit_loss(exit_emissions, tags, mask=None, mode='joint', temperature=1.0):
+    """
+    Training loss of the per-layer emission heads
+
+    :param exit_emissions: list of (batch_size, seq_len, num_tags), one per layer, the last one is the top layer
+    :param tags: (batch_size, seq_len) gold tag ids
+    :param mask: (batch_size, seq_len), 0 for tokens that are not scored
+    :param mode: 'joint' averages the cross entropy of every head,
+                 'distill' trains the top head on the tags and every lower head to match the top head
+    :param temperature: softmax temperature of the self-distillation targets
+    """
+    if mask is None:
+        mask = torch.ones_like(tags)
+    mask = mask.reshape(-1) > 0
+    flat_tags = tags.reshape(-1)[mask]
+
+    def token_loss(emissions):
+        return F.cross_entropy(emissions.reshape(-1, emissions.size(-1))[mask], flat_tags)
+
+    if mode == 'joint':
+        return sum(token_loss(emissions) for emissions in exit_emissions) / len(exit_emissions)
+    if mode != 'distill':
+        raise ValueError("unknown early exit loss mode: %s" % mode)
+
+    top = exit_emissions[-1]
+    loss = token_loss(top)
+    if len(exit_emissions) == 1:
+        return loss
+
+    target = F.softmax(top.reshape(-1, top.size(-1))[mask].detach() / temperature, dim=-1)
+    distill_loss = 0
+    for emissions in exit_emissions[:-1]:
+        log_probs = F.log_softmax(emissions.reshape(-1, emissions.size(-1))[mask] / temperature, dim=-1)
+        distill_loss = distill_loss + F.kl_div(log_probs, target, reduction='batchmean') * temperature ** 2
+    return loss + distill_loss / (len(exit_emissions) - 1)
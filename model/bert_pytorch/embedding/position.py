@@ -4,22 +4,47 @@ import math
 
 
 class PositionalEmbedding(nn.Module):
+    """
+    Sinusoidal positional encodings, defined for any position:
+    the table starts at max_len entries and grows when a longer sequence comes in.
+    """
 
     def __init__(self, d_model, max_len=512):
         super().__init__()
+        self.d_model = d_model
 
         # Compute the positional encodings once in log space.
-        pe = torch.zeros(max_len, d_model).float()
+        pe = self._encodings(max_len)
         pe.require_grad = False
+        self.register_buffer('pe', pe)
+
+    def _encodings(self, max_len):
+        pe = torch.zeros(max_len, self.d_model).float()
 
         position = torch.arange(0, max_len).float().unsqueeze(1)
-        div_term = (torch.arange(0, d_model, 2).float() * -(math.log(10000.0) / d_model)).exp()
+        div_term = (torch.arange(0, self.d_model, 2).float() * -(math.log(10000.0) / self.d_model)).exp()
 
         pe[:, 0::2] = torch.sin(position * div_term)
         pe[:, 1::2] = torch.cos(position * div_term)
 
-        pe = pe.unsqueeze(0)
-        self.register_buffer('pe', pe)
+        return pe.unsqueeze(0)
+
+    def extend(self, max_len):
+        """
+        :param max_len: number of positions the table must cover
+        """
+        if max_len > self.pe.size(1):
+            self.pe = self._encodings(max_len).to(device=self.pe.device, dtype=self.pe.dtype)
+
+    def _load_from_state_dict(self, state_dict, prefix, local_metadata, strict,
+                              missing_keys, unexpected_keys, error_msgs):
+        # checkpoints saved after the table grew carry a longer 'pe'
+        pe = state_dict.get(prefix + 'pe')
+        if pe is not None and pe.size(1) != self.pe.size(1):
+            self.pe = self._encodings(pe.size(1)).to(device=self.pe.device, dtype=self.pe.dtype)
+        super()._load_from_state_dict(state_dict, prefix, local_metadata, strict,
+                                      missing_keys, unexpected_keys, error_msgs)
 
     def forward(self, x):
+        self.extend(x.size(1))
         return self.pe[:, :x.size(1)]
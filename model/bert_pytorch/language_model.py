@@ -1,18 +1,27 @@
+from functools import partial
+
 import torch.nn as nn
 
 from .bert import BERT
 
 
+def _zero_padding_grad(padding_idx, grad):
+    grad = grad.clone()
+    grad[padding_idx] = 0
+    return grad
+
+
 class BERTLM(nn.Module):
     """
     BERT Language Model
     Next Sentence Prediction Model + Masked Language Model
     """
 
-    def __init__(self, bert: BERT, vocab_size):
+    def __init__(self, bert: BERT, vocab_size, tie_weights=False):
         """
         :param bert: BERT model which should be trained
         :param vocab_size: total vocab size for masked_lm
+        :param tie_weights: share the token embedding matrix with the masked_lm output projection
         """
 
         super().__init__()
@@ -20,6 +29,43 @@ class BERTLM(nn.Module):
         self.next_sentence = NextSentencePrediction(self.bert.hidden)
         self.mask_lm = MaskedLanguageModel(self.bert.hidden, vocab_size)
 
+        self.tie_word_embeddings = tie_weights
+        self._padding_grad_hook = None
+        if tie_weights:
+            self.tie_weights()
+        self._register_load_state_dict_pre_hook(self._sync_tied_weights)
+
+    def tie_weights(self):
+        """
+        Make sure we are sharing the input and output embeddings.
+        The output bias of masked_lm is kept as a separate parameter.
+        The padding row of the embedding gets no gradient from masked_lm, it stays the zero vector.
+        """
+        embedding = self.bert.embedding.token
+        assert self.mask_lm.linear.weight.shape == embedding.weight.shape, \
+            "masked_lm vocab_size {} does not match the token embedding vocab size {}".format(
+                self.mask_lm.linear.out_features, embedding.num_embeddings)
+        self.tie_word_embeddings = True
+        self.mask_lm.linear.weight = embedding.weight
+        if embedding.padding_idx is not None and self._padding_grad_hook is None:
+            self._padding_grad_hook = embedding.weight.register_hook(partial(_zero_padding_grad, embedding.padding_idx))
+
+    def _sync_tied_weights(self, state_dict, prefix, local_metadata, strict,
+                           missing_keys, unexpected_keys, error_msgs):
+        """
+        Keep checkpoints interchangeable between tied and untied models:
+        when tied, the token embedding is the source of truth and is copied over the output projection
+        (or the other way round if only the projection was saved).
+        """
+        if not self.tie_word_embeddings:
+            return
+        embedding_key = prefix + 'bert.embedding.token.weight'
+        decoder_key = prefix + 'mask_lm.linear.weight'
+        if embedding_key in state_dict:
+            state_dict[decoder_key] = state_dict[embedding_key]
+        elif decoder_key in state_dict:
+            state_dict[embedding_key] = state_dict[decoder_key]
+
     def forward(self, x, segment_label):
         x = self.bert(x, segment_label)
         return self.next_sentence(x), self.mask_lm(x)
@@ -10,16 +10,21 @@ class TransformerBlock(nn.Module):
     Transformer = MultiHead_Attention + Feed_Forward with sublayer connection
     """
 
-    def __init__(self, hidden, attn_heads, feed_forward_hidden, dropout):
+    def __init__(self, hidden, attn_heads, feed_forward_hidden, dropout, window=None, global_cls=True,
+                 chunk_size=None):
         """
         :param hidden: hidden size of transformer
         :param attn_heads: head sizes of multi-head attention
         :param feed_forward_hidden: feed_forward_hidden, usually 4*hidden_size
         :param dropout: dropout rate
+        :param window: banded attention window, None for full attention
+        :param global_cls: with banded attention, let [CLS] attend globally
+        :param chunk_size: compute exact attention in chunks of this many positions, None for the dense computation
         """
 
         super().__init__()
-        self.attention = MultiHeadedAttention(h=attn_heads, d_model=hidden)
+        self.attention = MultiHeadedAttention(h=attn_heads, d_model=hidden, window=window, global_cls=global_cls,
+                                              chunk_size=chunk_size)
         self.feed_forward = PositionwiseFeedForward(d_model=hidden, d_ff=feed_forward_hidden, dropout=dropout)
         self.input_sublayer = SublayerConnection(size=hidden, dropout=dropout)
         self.output_sublayer = SublayerConnection(size=hidden, dropout=dropout)
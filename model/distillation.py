@@ -0,0 +1,207 @@
+"""Knowledge distillation of an EncoderCRFTagger into a shallower / narrower student.
+
+The student keeps the architecture of the teacher with fewer layers (and optionally a smaller
+hidden size). It starts from a subset of the teacher layers and is trained on a mix of
+    - the CRF negative log likelihood of the gold tags,
+    - KL divergence between the softened teacher and student emissions,
+    - MSE between mapped student and teacher hidden states (optional),
+    - KL divergence between the teacher and student CRF marginals (optional).
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import copy
+import logging
+import re
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from .bert_pytorch.early_exit import tag_posteriors
+from .ner_models import EncoderCRFTagger
+
+logger = logging.getLogger(__name__)
+
+
+def uniform_layer_map(num_teacher_layers, num_student_layers):
+    """ Teacher layer behind every student layer, evenly spaced and ending at the top layer (e.g. 12 -> 3: 3, 7, 11) """
+    return [(i + 1) * num_teacher_layers // num_student_layers - 1 for i in range(num_student_layers)]
+
+
+def build_student(teacher, num_layers, hidden_size=None, intermediate_size=None, layer_map=None):
+    """
+    Student tagger with num_layers encoder layers, initialized from the teacher
+
+    With the teacher hidden size, the embeddings, the layers picked by layer_map and the layers on top of
+    the encoder are copied. A BertModel student layer i copies teacher layer layer_map[i], an AlbertModel
+    student copies the shared layers and just applies them fewer times. With a smaller hidden size
+    only the shapes that still match are copied, the rest is trained from scratch.
+
+    :param teacher: a trained EncoderCRFTagger
+    :param num_layers: number of student layers
+    :param hidden_size: student hidden size, defaults to the teacher's
+    :param intermediate_size: student FFN size, defaults to the teacher's scaled with the hidden size
+    :param layer_map: teacher layer of every student layer, defaults to uniform_layer_map
+    """
+    encoder = teacher.encoder
+    config = copy.deepcopy(encoder.config)
+    num_teacher_layers = config.num_hidden_layers
+    layer_map = layer_map or uniform_layer_map(num_teacher_layers, num_layers)
+    if len(layer_map) != num_layers:
+        raise ValueError("layer_map needs one teacher layer for each of the %d student layers" % num_layers)
+
+    config.num_hidden_layers = num_layers
+    if hidden_size and hidden_size != config.hidden_size:
+        config.intermediate_size = intermediate_size or config.intermediate_size * hidden_size // config.hidden_size
+        config.hidden_size = hidden_size
+        config.pruned_heads, config.pruned_neurons = {}, {}
+    elif intermediate_size:
+        config.intermediate_size = intermediate_size
+    per_layer = hasattr(encoder.encoder, 'layer')  # BertModel layers are not shared
+    if per_layer:
+        config.pruned_heads = dict((i, config.pruned_heads[j]) for i, j in enumerate(layer_map) if j in config.pruned_heads)
+        config.pruned_neurons = dict((i, config.pruned_neurons[j]) for i, j in enumerate(layer_map)
+                                     if j in config.pruned_neurons)
+
+    student = EncoderCRFTagger(encoder.__class__(config, add_pooling_layer=False), teacher.num_tags,
+                               rnn=teacher.rnn_type, dropout=teacher.dropout.p)
+
+    def teacher_key(key):
+        if not per_layer:
+            return key
+        return re.sub(r'^encoder\.encoder\.layer\.(\d+)\.',
+                      lambda match: 'encoder.encoder.layer.%d.' % layer_map[int(match.group(1))], key)
+
+    teacher_state = teacher.state_dict()
+    student_state = student.state_dict()
+    copied = 0
+    for key, value in student_state.items():
+        source = teacher_state.get(teacher_key(key))
+        if source is not None and source.shape == value.shape:
+            student_state[key] = source.clone()
+            copied += 1
+    student.load_state_dict(student_state)
+    logger.info("Student with %d layers (teacher layers %s), %d of %d tensors copied from the teacher",
+                num_layers, layer_map, copied, len(student_state))
+    return student
+
+
+def _collect_layer_outputs(encoder, outputs):
+    # every application of a layer appends its output, the shared ALBERT layer once per iteration
+    def hook(module, inputs, output):
+        outputs.append(output[0])
+    return [layer.register_forward_hook(hook) for layer in encoder.prunable_layers()]
+
+
+class Distiller(nn.Module):
+    """
+    Distillation loss of a student EncoderCRFTagger against a frozen teacher.
+    The parameters to train are the student's and, with hidden state matching between different
+    hidden sizes, the projection of the student hidden states.
+    """
+
+    def __init__(self, teacher, student, layer_map=None, temperature=2.0, hard_weight=1.0,
+                 emission_weight=1.0, hidden_weight=0.0, crf_weight=0.0):
+        """
+        :param layer_map: teacher layer matched by every student layer in the hidden state loss
+        :param temperature: softmax temperature of the emission targets
+        :param hard_weight, emission_weight, hidden_weight, crf_weight: weights of the loss terms, 0 to skip one
+        """
+        super(Distiller, self).__init__()
+        self.teacher = teacher
+        self.student = student
+        for param in self.teacher.parameters():
+            param.requires_grad = False
+        self.layer_map = layer_map or uniform_layer_map(teacher.encoder.config.num_hidden_layers,
+                                                        student.encoder.config.num_hidden_layers)
+        self.temperature = temperature
+        self.hard_weight = hard_weight
+        self.emission_weight = emission_weight
+        self.hidden_weight = hidden_weight
+        self.crf_weight = crf_weight
+
+        teacher_hidden, student_hidden = teacher.encoder.config.hidden_size, student.encoder.config.hidden_size
+        self.projection = nn.Linear(student_hidden, teacher_hidden) \
+            if hidden_weight and teacher_hidden != student_hidden else None
+        self.teacher.eval()
+
+    def train(self, mode=True):
+        super(Distiller, self).train(mode)
+        self.teacher.eval()  # the targets never use dropout
+        return self
+
+    def _run(self, tagger, input_ids, attention_mask, layer_outputs):
+        handles = _collect_layer_outputs(tagger.encoder, layer_outputs) if self.hidden_weight else []
+        try:
+            return tagger.emissions(input_ids, attention_mask)
+        finally:
+            for handle in handles:
+                handle.remove()
+
+    def forward(self, input_ids, attention_mask=None, tags=None):
+        """
+        :return: (loss, dict of the float value of every loss term)
+        """
+        if attention_mask is None:
+            attention_mask = (input_ids > 0).long()
+        mask = attention_mask > 0
+        token_mask = mask.reshape(-1)
+
+        teacher_layers, student_layers = [], []
+        with torch.no_grad():
+            teacher_emissions = self._run(self.teacher, input_ids, attention_mask, teacher_layers)
+        student_emissions = self._run(self.student, input_ids, attention_mask, student_layers)
+
+        losses = {}
+        if self.hard_weight and tags is not None:
+            losses['hard'] = -self.student.crf(student_emissions, tags, mask=mask, reduction='mean')
+
+        if self.emission_weight:
+            num_tags = student_emissions.size(-1)
+            target = F.softmax(teacher_emissions.reshape(-1, num_tags)[token_mask] / self.temperature, dim=-1)
+            log_probs = F.log_softmax(student_emissions.reshape(-1, num_tags)[token_mask] / self.temperature, dim=-1)
+            losses['emission'] = F.kl_div(log_probs, target, reduction='batchmean') * self.temperature ** 2
+
+        if self.hidden_weight:
+            hidden_loss = 0
+            for student_hidden, teacher_index in zip(student_layers, self.layer_map):
+                if self.projection is not None:
+                    student_hidden = self.projection(student_hidden)
+                hidden_loss = hidden_loss + F.mse_loss(student_hidden[mask], teacher_layers[teacher_index][mask])
+            losses['hidden'] = hidden_loss / len(student_layers)
+
+        if self.crf_weight:
+            with torch.no_grad():
+                teacher_marginals = tag_posteriors(teacher_emissions, mask, self.teacher.crf)[mask]
+            student_marginals = tag_posteriors(student_emissions, mask, self.student.crf)[mask]
+            losses['crf'] = (teacher_marginals * (torch.log(teacher_marginals.clamp(min=1e-12)) -
+                                                  torch.log(student_marginals.clamp(min=1e-12)))).sum(-1).mean()
+
+        weights = {'hard': self.hard_weight, 'emission': self.emission_weight,
+                   'hidden': self.hidden_weight, 'crf': self.crf_weight}
+        loss = sum(weights[name] * value for name, value in losses.items())
+        return loss, dict((name, value.item()) for name, value in losses.items())
+
+
+def distill(distiller, data, epochs=1, learning_rate=5e-5, log_steps=100):
+    """
+    Train the student of distiller
+
+    :param data: re-iterable of dicts with input_ids, attention_mask and tags (e.g. a DataLoader)
+    :return: the student
+    """
+    optimizer = torch.optim.Adam([p for p in distiller.parameters() if p.requires_grad], lr=learning_rate)
+    distiller.train()
+    step = 0
+    for epoch in range(epochs):
+        for batch in data:
+            loss, parts = distiller(**batch)
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            step += 1
+            if log_steps and step % log_steps == 0:
+                logger.info("epoch %d step %d loss %.4f %s", epoch, step, loss.item(),
+                            " ".join("%s %.4f" % item for item in sorted(parts.items())))
+    distiller.eval()
+    return distiller.student
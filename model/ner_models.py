@@ -0,0 +1,230 @@
+"""Importable encoder + CRF taggers.
+
+The *CRFNer models of the notebooks put a BiGRU / BiLSTM and a CRF on top of a
+BertModel / AlbertModel. EncoderCRFTagger is the same stack with a linear
+emission layer in front of the CRF, so the tag scores have their own size and
+can be distilled, saved and loaded outside the notebooks. MultiTaskTagger runs
+one encoder pass for several such heads.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import json
+import os
+from io import open
+
+import torch
+import torch.nn as nn
+
+from .torchcrf import CRF
+
+TAGGER_CONFIG_NAME = "tagger_config.json"
+TAGGER_WEIGHTS_NAME = "tagger_head.bin"
+
+RNN_CLASSES = {"gru": nn.GRU, "lstm": nn.LSTM}
+
+
+class EncoderCRFTagger(nn.Module):
+    """
+    encoder (BertModel / AlbertModel) -> optional BiGRU / BiLSTM -> linear emissions -> CRF
+    """
+
+    def __init__(self, encoder, num_tags, rnn=None, dropout=0.1):
+        """
+        :param encoder: a BertModel / AlbertModel, the pooler is not used
+        :param num_tags: number of tags, see ner_utils.build_label_map
+        :param rnn: None, 'gru' or 'lstm' for a bidirectional layer of hidden_size // 2 per direction
+        :param dropout: dropout rate before the emission layer
+        """
+        super(EncoderCRFTagger, self).__init__()
+        hidden_size = encoder.config.hidden_size
+        self.encoder = encoder
+        self.num_tags = num_tags
+        self.rnn_type = rnn
+        self.rnn = RNN_CLASSES[rnn](hidden_size, hidden_size // 2, batch_first=True,
+                                    bidirectional=True) if rnn else None
+        self.dropout = nn.Dropout(dropout)
+        self.classifier = nn.Linear(hidden_size, num_tags)
+        self.crf = CRF(num_tags, batch_first=True)
+
+    def emissions(self, input_ids, attention_mask=None):
+        """
+        :return: (batch_size, seq_len, num_tags) emission scores
+        """
+        sequence_output = self.encoder(input_ids, attention_mask=attention_mask)[0]
+        if self.rnn is not None:
+            sequence_output = self.rnn(sequence_output)[0]
+        return self.classifier(self.dropout(sequence_output))
+
+    def forward(self, input_ids, attention_mask=None, tags=None):
+        """
+        :return: the mean negative log likelihood when tags are given, else the Viterbi tag ids of every sample
+        """
+        if attention_mask is None:
+            attention_mask = (input_ids > 0).long()
+        emissions = self.emissions(input_ids, attention_mask)
+        mask = attention_mask > 0
+        if tags is None:
+            return self.crf.decode(emissions, mask)
+        return -self.crf(emissions, tags, mask=mask, reduction='mean')
+
+    def save_pretrained(self, save_directory):
+        """ The encoder with its own save_pretrained, the layers on top next to it """
+        self.encoder.save_pretrained(save_directory)
+        head_state = dict((key, value) for key, value in self.state_dict().items() if not key.startswith("encoder."))
+        torch.save(head_state, os.path.join(save_directory, TAGGER_WEIGHTS_NAME))
+        with open(os.path.join(save_directory, TAGGER_CONFIG_NAME), "w", encoding="utf-8") as writer:
+            writer.write(json.dumps({"num_tags": self.num_tags, "rnn": self.rnn_type}, indent=2) + "\n")
+
+    @classmethod
+    def from_pretrained(cls, pretrained_model_dir, encoder_class, **kwargs):
+        """
+        :param encoder_class: BertModel / AlbertModel the encoder was saved from
+        :param kwargs: passed to encoder_class.from_pretrained
+        """
+        with open(os.path.join(pretrained_model_dir, TAGGER_CONFIG_NAME), "r", encoding="utf-8") as reader:
+            tagger_config = json.loads(reader.read())
+        encoder = encoder_class.from_pretrained(pretrained_model_dir, add_pooling_layer=False, **kwargs)
+        tagger = cls(encoder, tagger_config["num_tags"], rnn=tagger_config["rnn"])
+        # the encoder keys are its own, loaded above: the head keys of the file have to match the head exactly
+        state = dict(("encoder." + key, value) for key, value in encoder.state_dict().items())
+        state.update(torch.load(os.path.join(pretrained_model_dir, TAGGER_WEIGHTS_NAME), map_location="cpu"))
+        tagger.load_state_dict(state)
+        tagger.eval()
+        return tagger
+
+
+class TagHead(nn.Module):
+    """
+    Token level head over an encoder sequence output:
+    optional BiGRU / BiLSTM -> linear emissions -> optional CRF.
+    rnn=None, crf=False is a plain linear (softmax) tagger.
+    The parameter names match the layers of EncoderCRFTagger, so a saved tagger directory loads as a head.
+    """
+
+    def __init__(self, hidden_size, num_tags, rnn=None, crf=True, dropout=0.1):
+        super(TagHead, self).__init__()
+        self.num_tags = num_tags
+        self.rnn_type = rnn
+        self.rnn = RNN_CLASSES[rnn](hidden_size, hidden_size // 2, batch_first=True,
+                                    bidirectional=True) if rnn else None
+        self.dropout = nn.Dropout(dropout)
+        self.classifier = nn.Linear(hidden_size, num_tags)
+        self.crf = CRF(num_tags, batch_first=True) if crf else None
+
+    def emissions(self, sequence_output):
+        if self.rnn is not None:
+            sequence_output = self.rnn(sequence_output)[0]
+        return self.classifier(self.dropout(sequence_output))
+
+    def loss(self, emissions, tags, mask):
+        if self.crf is not None:
+            return -self.crf(emissions, tags, mask=mask, reduction='mean')
+        return nn.functional.cross_entropy(emissions[mask], tags[mask])
+
+    def decode(self, emissions, mask):
+        """ Tag ids of every sample, as many as its unmasked tokens """
+        if self.crf is not None:
+            return self.crf.decode(emissions, mask)
+        lengths = mask.long().sum(1).tolist()
+        return [ids[:length] for ids, length in zip(emissions.argmax(-1).tolist(), lengths)]
+
+    def save_pretrained(self, save_directory):
+        torch.save(self.state_dict(), os.path.join(save_directory, TAGGER_WEIGHTS_NAME))
+        with open(os.path.join(save_directory, TAGGER_CONFIG_NAME), "w", encoding="utf-8") as writer:
+            writer.write(json.dumps({"num_tags": self.num_tags, "rnn": self.rnn_type,
+                                     "crf": self.crf is not None}, indent=2) + "\n")
+
+    @classmethod
+    def from_pretrained(cls, pretrained_head_dir, hidden_size):
+        with open(os.path.join(pretrained_head_dir, TAGGER_CONFIG_NAME), "r", encoding="utf-8") as reader:
+            head_config = json.loads(reader.read())
+        head = cls(hidden_size, head_config["num_tags"], rnn=head_config["rnn"], crf=head_config.get("crf", True))
+        head.load_state_dict(torch.load(os.path.join(pretrained_head_dir, TAGGER_WEIGHTS_NAME), map_location="cpu"))
+        head.eval()
+        return head
+
+
+class MultiTaskTagger(nn.Module):
+    """
+    One encoder pass fanned out to several named TagHeads, e.g. NER plus two other token taggers.
+    Heads loaded from separate checkpoints share this encoder, so they should have been trained on it
+    (jointly, or each over the same frozen encoder).
+    """
+
+    HEADS_DIR = "heads"
+
+    def __init__(self, encoder):
+        """
+        :param encoder: a BertModel / AlbertModel, the pooler is not used
+        """
+        super(MultiTaskTagger, self).__init__()
+        self.encoder = encoder
+        self.heads = nn.ModuleDict()
+
+    def add_head(self, name, num_tags, rnn=None, crf=True, dropout=0.1):
+        """ Register a new head, see TagHead """
+        self.heads[name] = TagHead(self.encoder.config.hidden_size, num_tags, rnn=rnn, crf=crf, dropout=dropout)
+        return self.heads[name]
+
+    def add_head_from_pretrained(self, name, pretrained_head_dir):
+        """ Register a head saved with TagHead.save_pretrained or the head of a saved EncoderCRFTagger """
+        self.heads[name] = TagHead.from_pretrained(pretrained_head_dir, self.encoder.config.hidden_size)
+        return self.heads[name]
+
+    def forward(self, input_ids, attention_mask=None, tags=None, heads=None):
+        """
+        :param tags: dict of {head name: (batch_size, seq_len) tag ids}, the heads to train
+        :param heads: names of the heads to run at inference, all by default
+        :return: (sum of the head losses, dict of the loss of every head) when tags are given,
+                 else a dict of {head name: tag ids of every sample}
+        """
+        if attention_mask is None:
+            attention_mask = (input_ids > 0).long()
+        mask = attention_mask > 0
+        sequence_output = self.encoder(input_ids, attention_mask=attention_mask)[0]
+
+        if tags is not None:
+            losses = dict((name, self.heads[name].loss(self.heads[name].emissions(sequence_output), head_tags, mask))
+                          for name, head_tags in tags.items())
+            return sum(losses.values()), losses
+
+        names = heads if heads is not None else list(self.heads.keys())
+        return dict((name, self.heads[name].decode(self.heads[name].emissions(sequence_output), mask))
+                    for name in names)
+
+    def predict(self, input_ids, batch_size=32, heads=None):
+        """ Batched inference over (num_samples, seq_len) input ids, returns {head name: tag ids of every sample} """
+        self.eval()
+        predictions = {}
+        with torch.no_grad():
+            for i in range(0, input_ids.size(0), batch_size):
+                for name, tag_ids in self.forward(input_ids[i:i + batch_size], heads=heads).items():
+                    predictions.setdefault(name, []).extend(tag_ids)
+        return predictions
+
+    def save_pretrained(self, save_directory):
+        """ The encoder with its own save_pretrained and every head in heads/<name> """
+        self.encoder.save_pretrained(save_directory)
+        for name, head in self.heads.items():
+            head_dir = os.path.join(save_directory, self.HEADS_DIR, name)
+            if not os.path.isdir(head_dir):
+                os.makedirs(head_dir)
+            head.save_pretrained(head_dir)
+
+    @classmethod
+    def from_pretrained(cls, pretrained_model_dir, encoder_class, heads=None, **kwargs):
+        """
+        :param encoder_class: BertModel / AlbertModel the encoder was saved from
+        :param heads: dict of {head name: head directory} to load, defaults to the heads/ saved with the model
+        :param kwargs: passed to encoder_class.from_pretrained
+        """
+        encoder = encoder_class.from_pretrained(pretrained_model_dir, add_pooling_layer=False, **kwargs)
+        tagger = cls(encoder)
+        if heads is None:
+            heads_dir = os.path.join(pretrained_model_dir, cls.HEADS_DIR)
+            names = sorted(os.listdir(heads_dir)) if os.path.isdir(heads_dir) else []
+            heads = dict((name, os.path.join(heads_dir, name)) for name in names)
+        for name, head_dir in heads.items():
+            tagger.add_head_from_pretrained(name, head_dir)
+        tagger.eval()
+        return tagger
@@ -0,0 +1,110 @@
+"""Helpers shared by the NER notebooks and benchmarks.
+
+Reads the character level "char TAG" files under data/, maps them to ids and
+scores entity level precision / recall / F1 on BIO tags.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from io import open
+
+PAD_LABEL_ID = 0
+
+
+def read_ner_file(filepath):
+    """ Read a "char TAG" file, sentences are separated by blank lines.
+        Returns (words, labels): two lists of sentences, every sentence a list of strings.
+    """
+    words, labels = [], []
+    word, label = [], []
+    with open(filepath, "r", encoding="utf-8") as reader:
+        for line in reader:
+            line = line.strip()
+            if not line:
+                if word:
+                    words.append(word)
+                    labels.append(label)
+                word, label = [], []
+                continue
+            char, tag = line.split(" ")[:2]
+            word.append(char)
+            label.append(tag)
+    if word:
+        words.append(word)
+        labels.append(label)
+    return words, labels
+
+
+def load_vocab(filepath="data/vocab.txt"):
+    """ Map every line of a BERT style vocab file to its line number. """
+    vocab = {}
+    with open(filepath, "r", encoding="utf-8") as reader:
+        for index, line in enumerate(reader):
+            vocab.setdefault(line.rstrip("\n"), index)
+    return vocab
+
+
+def build_label_map(labels):
+    """ Deterministic label ids: 0 is padding, "O" is 1 and the other tags follow in sorted order.
+        Returns (label2id, id2label).
+    """
+    tags = set(tag for sentence in labels for tag in sentence)
+    tags.discard("O")
+    label_list = ["O"] + sorted(tags)
+    label2id = {tag: i + 1 for i, tag in enumerate(label_list)}
+    id2label = {i: tag for tag, i in label2id.items()}
+    id2label[PAD_LABEL_ID] = "O"
+    return label2id, id2label
+
+
+def encode_sentences(words, vocab, max_seq_length=202, labels=None, label2id=None):
+    """ [CLS] chars [SEP] padded with 0 to max_seq_length, unknown chars map to [UNK].
+        [CLS], [SEP] and padding get PAD_LABEL_ID in the label ids.
+        Returns (input_ids, label_ids), label_ids is None when no labels are given.
+    """
+    unk_id = vocab.get("[UNK]", 0)
+    input_ids, label_ids = [], []
+    for index, sentence in enumerate(words):
+        sentence = sentence[:max_seq_length - 2]
+        ids = [vocab["[CLS]"]] + [vocab.get(char, unk_id) for char in sentence] + [vocab["[SEP]"]]
+        input_ids.append(ids + [0] * (max_seq_length - len(ids)))
+        if labels is not None:
+            tags = [label2id[tag] for tag in labels[index][:max_seq_length - 2]]
+            tags = [PAD_LABEL_ID] + tags + [PAD_LABEL_ID]
+            label_ids.append(tags + [PAD_LABEL_ID] * (max_seq_length - len(tags)))
+    return input_ids, (label_ids if labels is not None else None)
+
+
+def get_entities(tags):
+    """ (type, start, end) spans of a BIO tag sequence, end is exclusive.
+        An I- tag that does not continue an entity of the same type starts a new one.
+    """
+    entities = []
+    entity_type, start = None, None
+    for i, tag in enumerate(list(tags) + ["O"]):
+        prefix, _, tag_type = tag.partition("-")
+        if entity_type is not None and (prefix != "I" or tag_type != entity_type):
+            entities.append((entity_type, start, i))
+            entity_type = None
+        if prefix in ("B", "I") and entity_type is None:
+            entity_type, start = tag_type, i
+    return entities
+
+
+def entity_f1(true_labels, pred_labels):
+    """ Micro averaged entity precision, recall and F1 over a list of sentences of tags. """
+    n_true, n_pred, n_correct = 0, 0, 0
+    for true_tags, pred_tags in zip(true_labels, pred_labels):
+        true_entities = set(get_entities(true_tags))
+        pred_entities = set(get_entities(pred_tags))
+        n_true += len(true_entities)
+        n_pred += len(pred_entities)
+        n_correct += len(true_entities & pred_entities)
+    precision = n_correct / n_pred if n_pred else 0.0
+    recall = n_correct / n_true if n_true else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return precision, recall, f1
+
+
+def decode_label_ids(label_ids, lengths, id2label):
+    """ Tag strings of every sentence, dropping [CLS] and cutting at the sentence length. """
+    return [[id2label.get(i, "O") for i in ids[1:length + 1]] for ids, length in zip(label_ids, lengths)]
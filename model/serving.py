@@ -0,0 +1,124 @@
+"""Multi-tenant NER serving over one resident encoder.
+
+Every tenant is a directory with a TagHead (tagger_config.json + tagger_head.bin, as written by
+TagHead.save_pretrained or next to the encoder by EncoderCRFTagger.save_pretrained) and optionally a LoRA
+adapter of the shared encoder (adapter_config.json + adapter_model.bin, see albert_pytorch.adapters.save_adapter).
+Only the encoder stays resident. Heads and adapters are loaded on first use and the least recently used
+ones are evicted to keep them under a memory budget. A batch mixing tenants runs through the encoder once,
+every row through the adapter of its tenant, then each tenant's rows through its head.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import torch
+
+from .albert_pytorch.adapters import load_adapter, delete_adapter, adapter_state_dict, set_adapter_routing
+from .albert_pytorch.file_utils import ADAPTER_CONFIG_NAME
+from .ner_models import TagHead
+
+logger = logging.getLogger(__name__)
+
+
+def _bytes(tensors):
+    return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+
+
+class TenantRegistry(object):
+    """
+    One AlbertModel / BertModel shared by the registered tenants, their heads and adapters kept in an LRU cache
+    """
+
+    def __init__(self, encoder, memory_budget=512 * 2 ** 20):
+        """
+        :param encoder: the resident AlbertModel / BertModel every tenant was fine-tuned on
+        :param memory_budget: bytes of the loaded heads and adapters, the encoder not included
+        """
+        if getattr(encoder.config, 'halting_threshold', None) is not None:
+            # a mixed batch is routed row by row through the adapters, halting drops finished rows from the batch
+            raise ValueError("A TenantRegistry encoder can't use adaptive computation time (config.halting_threshold)")
+        self.encoder = encoder.eval()
+        self.memory_budget = memory_budget
+        self.tenant_dirs = {}
+        self.loaded = OrderedDict()  # tenant -> (head, adapter name or None, bytes), least recently used first
+        self.lock = threading.RLock()
+
+    def register(self, tenant, tenant_dir):
+        """ Make a tenant known, nothing is loaded before its first request """
+        if not os.path.isdir(tenant_dir):
+            raise EnvironmentError("The directory {} of tenant {} does not exist".format(tenant_dir, tenant))
+        with self.lock:
+            if tenant in self.loaded:
+                self.evict(tenant)
+            self.tenant_dirs[tenant] = tenant_dir
+
+    @property
+    def memory_used(self):
+        return sum(size for _, _, size in self.loaded.values())
+
+    def evict(self, tenant):
+        with self.lock:
+            head, adapter, size = self.loaded.pop(tenant)
+            if adapter is not None:
+                delete_adapter(self.encoder, adapter)
+            logger.info("Evicted tenant %s, %.1fMB freed", tenant, size / 2 ** 20)
+
+    def load(self, tenant, keep=()):
+        """ The head and adapter name of a tenant, loaded if needed, evicting others but the tenants in keep """
+        with self.lock:
+            if tenant in self.loaded:
+                self.loaded.move_to_end(tenant)
+                return self.loaded[tenant][:2]
+            if tenant not in self.tenant_dirs:
+                raise KeyError("Unknown tenant {}".format(tenant))
+            tenant_dir = self.tenant_dirs[tenant]
+            device = next(self.encoder.parameters()).device
+            head = TagHead.from_pretrained(tenant_dir, self.encoder.config.hidden_size).to(device)
+            size = _bytes(head.parameters())
+            adapter = None
+            if os.path.isfile(os.path.join(tenant_dir, ADAPTER_CONFIG_NAME)):
+                adapter = load_adapter(self.encoder, tenant_dir, name="tenant_{}".format(tenant), activate=False)
+                size += _bytes(adapter_state_dict(self.encoder, adapter).values())
+
+            for other in list(self.loaded):
+                if self.memory_used + size <= self.memory_budget:
+                    break
+                if other not in keep:
+                    self.evict(other)
+            if self.memory_used + size > self.memory_budget:
+                logger.warning("Tenant %s goes over the memory budget of %.1fMB", tenant, self.memory_budget / 2 ** 20)
+            self.loaded[tenant] = (head, adapter, size)
+            logger.info("Loaded tenant %s, %.1fMB", tenant, size / 2 ** 20)
+            return head, adapter
+
+    def predict(self, tenants, input_ids, attention_mask=None):
+        """
+        Tag a batch mixing tenants with one encoder pass
+
+        :param tenants: tenant of every row of input_ids
+        :param input_ids: (batch_size, seq_len) token ids, 0 for padding
+        :return: tag ids of every row, as many as its unmasked tokens
+        """
+        if attention_mask is None:
+            attention_mask = (input_ids > 0).long()
+        mask = attention_mask > 0
+        with self.lock, torch.no_grad():
+            keep = set(tenants)
+            models = dict((tenant, self.load(tenant, keep)) for tenant in keep)
+            set_adapter_routing(self.encoder, [models[tenant][1] for tenant in tenants])
+            try:
+                sequence_output = self.encoder(input_ids, attention_mask=attention_mask)[0]
+            finally:
+                set_adapter_routing(self.encoder, None)
+
+            predictions = [None] * len(tenants)
+            for tenant, (head, _) in models.items():
+                rows = [row for row, name in enumerate(tenants) if name == tenant]
+                index = torch.tensor(rows, dtype=torch.long, device=input_ids.device)
+                decoded = head.decode(head.emissions(sequence_output.index_select(0, index)), mask.index_select(0, index))
+                for row, tag_ids in zip(rows, decoded):
+                    predictions[row] = tag_ids
+        return predictions
@@ -138,6 +138,31 @@ class CRF(nn.Module):
 
         return self._viterbi_decode(emissions, mask)
 
+    def marginal_probabilities(self, emissions: torch.Tensor,
+                               mask: Optional[torch.ByteTensor] = None) -> torch.Tensor:
+        """Compute the posterior probability of every tag at every timestep (forward-backward).
+
+        Args:
+            emissions (`~torch.Tensor`): Emission score tensor of size
+                ``(seq_length, batch_size, num_tags)`` if ``batch_first`` is ``False``,
+                ``(batch_size, seq_length, num_tags)`` otherwise.
+            mask (`~torch.ByteTensor`): Mask tensor of size ``(seq_length, batch_size)``
+                if ``batch_first`` is ``False``, ``(batch_size, seq_length)`` otherwise.
+
+        Returns:
+            `~torch.Tensor`: Marginals of the same size as ``emissions``, zero at masked timesteps.
+        """
+        self._validate(emissions, mask=mask)
+        if mask is None:
+            mask = emissions.new_ones(emissions.shape[:2], dtype=torch.uint8)
+
+        if self.batch_first:
+            emissions = emissions.transpose(0, 1)
+            mask = mask.transpose(0, 1)
+
+        marginals = self._compute_marginals(emissions, mask)
+        return marginals.transpose(0, 1) if self.batch_first else marginals
+
     def _validate(
             self,
             emissions: torch.Tensor,
@@ -256,6 +281,47 @@ class CRF(nn.Module):
         # shape: (batch_size,)
         return torch.logsumexp(score, dim=1)
 
+    def _compute_marginals(
+            self, emissions: torch.Tensor, mask: torch.ByteTensor) -> torch.Tensor:
+        # emissions: (seq_length, batch_size, num_tags)
+        # mask: (seq_length, batch_size)
+        assert emissions.dim() == 3 and mask.dim() == 2
+        assert emissions.shape[:2] == mask.shape
+        assert emissions.size(2) == self.num_tags
+        assert mask[0].all()
+
+        seq_length = emissions.size(0)
+        mask = mask.bool()
+
+        # Forward scores: alpha[i] is the log-sum-exp of all tag sequences for timesteps 0..i
+        # ending with each tag, carried over unchanged through masked timesteps
+        # shape: (batch_size, num_tags)
+        score = self.start_transitions + emissions[0]
+        alphas = [score]
+        for i in range(1, seq_length):
+            next_score = torch.logsumexp(score.unsqueeze(2) + self.transitions + emissions[i].unsqueeze(1), dim=1)
+            score = torch.where(mask[i].unsqueeze(1), next_score, score)
+            alphas.append(score)
+
+        # Backward scores: beta[i] is the log-sum-exp of all tag sequences for timesteps i+1..end
+        # starting from each tag at timestep i
+        # shape: (batch_size, num_tags)
+        score = self.end_transitions.expand_as(emissions[0])
+        betas = [score]
+        for i in range(seq_length - 2, -1, -1):
+            next_score = torch.logsumexp(
+                self.transitions + (emissions[i + 1] + score).unsqueeze(1), dim=2)
+            score = torch.where(mask[i + 1].unsqueeze(1), next_score, score)
+            betas.append(score)
+        betas.reverse()
+
+        # shape: (seq_length, batch_size, num_tags)
+        log_marginals = torch.stack(alphas) + torch.stack(betas)
+        # shape: (batch_size,)
+        log_normalizer = torch.logsumexp(alphas[-1] + self.end_transitions, dim=1)
+        marginals = torch.exp(log_marginals - log_normalizer.unsqueeze(1))
+        return marginals * mask.unsqueeze(2).type_as(marginals)
+
     def _viterbi_decode(self, emissions: torch.FloatTensor,
                         mask: torch.ByteTensor) -> List[List[int]]:
         # emissions: (seq_length, batch_size, num_tags)